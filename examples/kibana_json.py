@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark of JSON decoding of Elasticsearch scroll pages by wikia.common.kibana
+
+Usage: kibana_json.py [page.json ...]
+
+Pages are raw bodies of _search / _scroll responses recorded from the production cluster, e.g.:
+
+curl 'http://127.0.0.1:9200/logstash-other-2017.05.09/_search?scroll=1m&size=1000' > page.json
+
+Synthetic pages are generated when no files are given. Recorded pages are replayed by a fake connection, so the
+benchmark measures Kibana._search() without the network round trips.
+"""
+
+import json
+import logging
+import sys
+import time
+
+from elasticsearch import Connection, Elasticsearch
+from elasticsearch.serializer import JSONSerializer
+
+from wikia.common.kibana import Kibana
+from wikia.common.kibana.serializer import FastJSONSerializer
+
+
+RUNS = 5
+SYNTHETIC_PAGES = 20
+BATCH_SIZE = 1000
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def get_synthetic_page(page_no):
+    hits = [{
+        '_index': 'logstash-other-2017.05.09',
+        '_type': 'doc',
+        '_id': 'AVvxPZ{:08d}'.format(page_no * BATCH_SIZE + n),
+        '_score': None,
+        '_source': {
+            '@timestamp': '2017-05-09T10:{:02d}:{:02d}.000Z'.format(n % 60, page_no % 60),
+            '@message': 'Http request to http://example.com/wiki/Page_{:d} took {:d} ms'.format(n, n % 500),
+            '@context': {
+                'requestTimeMS': n % 500,
+                'statusCode': 200,
+                'caller': 'Wikia\\Service\\Gateway\\ConsulUrlProvider:getUrl',
+            },
+            '@fields': {
+                'app_name': 'mediawiki',
+                'datacenter': 'sjc',
+                'environment': 'prod',
+                'city_id': str(n % 1000),
+                'url': 'http://muppet.wikia.com/wiki/Kermit_the_Frog?page={:d}'.format(n),
+            },
+            'tags': ['mediawiki', 'http'],
+        },
+        'sort': [n],
+    } for n in range(BATCH_SIZE)]
+
+    return json.dumps({'_scroll_id': 'scroll', 'took': 42, 'timed_out': False,
+                       '_shards': {'total': 5, 'successful': 5, 'failed': 0}, 'hits': {'total': 1, 'hits': hits}})
+
+
+class ReplayConnection(Connection):
+    """
+    Returns recorded pages instead of sending requests to Elasticsearch
+    """
+    pages = []
+
+    def __init__(self, **kwargs):
+        super(ReplayConnection, self).__init__(**kwargs)
+        self._responses = iter(self.pages)
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        return 200, {}, next(self._responses, '{"_scroll_id": "scroll", "_shards": {"total": 5, "successful": 5}, '
+                                              '"hits": {"hits": []}}')
+
+
+if len(sys.argv) > 1:
+    pages = []
+    for path in sys.argv[1:]:
+        with open(path) as fp:
+            pages.append(fp.read())
+else:
+    pages = [get_synthetic_page(page_no) for page_no in range(SYNTHETIC_PAGES)]
+
+ReplayConnection.pages = pages
+print('{:d} pages, {:.1f} MiB of JSON'.format(len(pages), sum(len(page) for page in pages) / 1024. / 1024))
+
+serializers = [('json (elasticsearch default)', JSONSerializer()), ('FastJSONSerializer', FastJSONSerializer())]
+
+for name, serializer in serializers:
+    if isinstance(serializer, FastJSONSerializer):
+        name = '{} ({})'.format(name, serializer.decoder_name)
+
+    # decoding only
+    timings = []
+    for _ in range(RUNS):
+        start = time.time()
+        for page in pages:
+            serializer.loads(page)
+        timings.append(time.time() - start)
+
+    print('{:<40} loads:   best={:.3f} s avg={:.3f} s'.format(name, min(timings), sum(timings) / len(timings)))
+
+    # the whole scroll
+    timings = []
+    for _ in range(RUNS):
+        source = Kibana(period=3600, shared_client=False, serializer=serializer)
+        source._es = Elasticsearch(connection_class=ReplayConnection, serializer=serializer)
+
+        start = time.time()
+        rows = source._search({'match_all': {}}, limit=len(pages) * BATCH_SIZE * 10)
+        timings.append(time.time() - start)
+
+    print('{:<40} _search: best={:.3f} s avg={:.3f} s rows={:d}'.format(
+        name, min(timings), sum(timings) / len(timings), len(rows)))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Benchmark of sampling methods supported by wikia.common.kibana
+
+Usage: kibana_sampling.py [es_host] [index_prefix]
+
+Run it against a local Elasticsearch instance filled with log messages (or the production cluster) to time real
+queries. When no host is given, requests are served by an in-process stand-in that keeps a synthetic index in memory
+and emulates the sampling queries in Python (String.hashCode() of _id for the painless script, a seeded crc32 for
+random_score). This is a client-side emulation: it shows how many rows each sampling method returns, but its timings
+measure neither the script cost on Elasticsearch nor real query latency, so do not compare methods by them.
+"""
+
+import json
+import logging
+import sys
+import time
+import zlib
+
+from elasticsearch import Connection, Elasticsearch
+
+from wikia.common.kibana import Kibana
+
+
+QUERY = '*'
+PERIOD = 3600
+LIMIT = 50000
+RUNS = 5
+STAND_IN_DOCUMENTS = 100000
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def java_string_hash(value):
+    """ String.hashCode() as used by the painless sampling script """
+    hash_code = 0
+    for char in value:
+        hash_code = (31 * hash_code + ord(char)) & 0xFFFFFFFF
+    return hash_code - 0x100000000 if hash_code & 0x80000000 else hash_code
+
+
+class StandInConnection(Connection):
+    """
+    Serves _search and _search/scroll requests from a synthetic in-memory index
+    """
+    documents = []
+    scrolls = {}
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        body = json.loads(body) if body else {}
+        params = params or {}
+
+        if url.endswith('/_search/scroll'):
+            scroll_id = body['scroll_id']
+            hits, size = self.scrolls[scroll_id]
+        else:
+            scroll_id = str(len(self.scrolls))
+            hits, size = self.search(body), int(params.get('size', 10))
+
+        page, rest = hits[:size], hits[size:]
+        self.scrolls[scroll_id] = (rest, size)
+
+        return 200, {}, json.dumps({
+            '_scroll_id': scroll_id,
+            '_shards': {'total': 5, 'successful': 5, 'failed': 0},
+            'hits': {'total': len(page), 'hits': page},
+        })
+
+    def search(self, body):
+        sampling = [clause for clause in body['query']['bool']['must']
+                    if 'script' in clause or 'function_score' in clause]
+        matches = self.documents
+
+        if sampling and 'script' in sampling[0]:
+            percent = sampling[0]['script']['script']['params']['sampling']
+            matches = [doc for doc in matches if abs(java_string_hash(doc['_id'])) % 100 < percent]
+        elif sampling:
+            function_score = sampling[0]['function_score']
+            seed = function_score['random_score']['seed']
+            min_score = function_score['min_score']
+            matches = [doc for doc in matches
+                       if zlib.crc32('{}:{}'.format(seed, doc['_seq_no']).encode('utf-8')) / 4294967296.0 >= min_score]
+
+        includes = body.get('_source', {}).get('includes')
+        if includes:
+            matches = [dict(doc, _source=dict((field, doc['_source'][field]) for field in includes)) for doc in matches]
+
+        return matches
+
+
+def get_stand_in_documents(count):
+    return [{
+        '_index': 'logstash-other-2017.05.09',
+        '_type': 'doc',
+        '_id': 'AVvxPZ{:08d}'.format(n),
+        '_seq_no': n,
+        '_source': {
+            '@timestamp': '2017-05-09T10:{:02d}:{:02d}.000Z'.format(n // 60 % 60, n % 60),
+            '@message': 'Http request to http://example.com/wiki/Page_{:d}'.format(n),
+        },
+    } for n in range(count)]
+
+
+es_host = sys.argv[1] if len(sys.argv) > 1 else None
+index_prefix = sys.argv[2] if len(sys.argv) > 2 else 'logstash-other'
+
+if es_host is None:
+    StandInConnection.documents = get_stand_in_documents(STAND_IN_DOCUMENTS)
+    print('client-side emulation on a stand-in index with {:d} documents, '
+          'timings do not reflect Elasticsearch cost'.format(STAND_IN_DOCUMENTS))
+
+for sampling in (None, 50, 10, 1):
+    for method in (Kibana.SAMPLING_SCRIPT, Kibana.SAMPLING_RANDOM_SCORE):
+        source = Kibana(period=PERIOD, es_host=es_host, index_prefix=index_prefix, sampling_method=method,
+                        shared_client=False)
+        if es_host is None:
+            source._es = Elasticsearch(connection_class=StandInConnection)
+        timings = []
+
+        for _ in range(RUNS):
+            start = time.time()
+            rows = source.query_by_string(QUERY, limit=LIMIT, sampling=sampling, fields=['@timestamp'])
+            timings.append(time.time() - start)
+
+        print('{}sampling={:>4} method={:<12} rows={:<6d} best={:.3f} s avg={:.3f} s'.format(
+            '[emulated] ' if es_host is None else '', str(sampling), method, len(rows), min(timings),
+            sum(timings) / len(timings)))
+
+        if sampling is None:
+            break  # sampling method does not matter here
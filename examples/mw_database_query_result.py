@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of wikia.common.mw_database QueryResult views over a synthetic result
+
+Usage: mw_database_query_result.py [num_rows]
+
+Compares building dicts with the previous implementation of QueryResult.rows_as_dicts (a new list of dicts on every
+access) with the current one and with records / rows_as_columns views. Memory usage is reported on Python 3 only
+(tracemalloc).
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import six
+
+from wikia.common.mw_database.connection import QueryResult
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+NUM_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+ACCESSES = 3
+
+DESCRIPTION = (('page_id',), ('page_namespace',), ('page_title',), ('page_touched',), ('page_random',),
+               ('page_len',))
+
+
+def legacy_rows_as_dicts(result):
+    column_names = [column[0] for column in result.description]
+    column_range = range(len(column_names))
+    res = []
+    for row in result.rows:
+        res.append({column_names[i]: row[i] if not isinstance(row[i], (str, six.text_type)) else str(row[i])
+                    for i in column_range
+                    })
+    return res
+
+
+def measure(name, fn):
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    start = time.time()
+    for _ in range(ACCESSES):
+        value = fn()
+    elapsed = time.time() - start
+
+    memory = ''
+    if tracemalloc is not None:
+        memory = ' memory={:.1f} MiB'.format(tracemalloc.get_traced_memory()[0] / 1024. / 1024)
+        tracemalloc.stop()
+
+    print('{:<28} {:d} accesses: {:.3f} s{}'.format(name, ACCESSES, elapsed, memory))
+    return value
+
+
+rows = tuple((page_id, page_id % 16, 'Page_{}'.format(page_id), '20160603161844', 0.292251140939, page_id % 5000)
+             for page_id in range(NUM_ROWS))
+print('{:d} rows'.format(NUM_ROWS))
+
+
+def new_result():
+    return QueryResult('SELECT * FROM page', (), {}, NUM_ROWS, DESCRIPTION, rows)
+
+
+legacy = new_result()
+measure('legacy rows_as_dicts', lambda: legacy_rows_as_dicts(legacy))
+
+result = new_result()
+measure('rows_as_dicts', lambda: result.rows_as_dicts)
+
+result = new_result()
+measure('records', lambda: result.records)
+
+result = new_result()
+measure('rows_as_columns', lambda: result.rows_as_columns)
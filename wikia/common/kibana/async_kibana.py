@@ -0,0 +1,350 @@
+"""
+Run queries against Kibana's elasticsearch using asyncio (Python 3.6 - 3.10)
+
+Requires elasticsearch-async package (install wikia-common-kibana[async]). Its 6.x releases use asyncio.coroutine
+decorator removed in Python 3.11, hence this module can not be imported there.
+@see https://github.com/elastic/elasticsearch-py-async
+"""
+import asyncio
+import json
+import time
+
+from elasticsearch_async import AsyncElasticsearch
+
+from .columnar import ColumnBatch
+from .kibana import BaseKibana, _SliceError
+
+
+class AsyncKibana(BaseKibana):
+    """
+    Interface for querying Kibana's storage from asyncio code
+
+    Provides the same API as Kibana class, but all methods are coroutines (iter_* methods and follow() are async
+    generators).
+    Many queries can be run concurrently on a single event loop:
+
+    rows, stats = await asyncio.gather(source.query_by_string(...), source.get_aggregations(...))
+    """
+
+    # how long should Elasticsearch keep the scroll context between requests for the next batches
+    SCROLL_TIMEOUT = '5m'
+
+    def _create_client(self, hosts, timeout):
+        # aiohttp client session is bound to the event loop, hence it's not shared between instances
+        return AsyncElasticsearch(hosts=hosts, timeout=timeout, serializer=self._serializer)
+
+    def _filter_indices(self, indices):
+        # we can not wait for the response in the constructor, skip missing indices when querying instead
+        return indices
+
+    def _get_search_params(self):
+        """
+        Return query string parameters common for all search requests
+
+        :rtype: dict
+        """
+        params = {
+            'index': self._index,
+        }
+
+        if self._check_indices:
+            params['ignore_unavailable'] = True
+
+        return params
+
+    async def close(self):
+        """ Close connections to Elasticsearch """
+        await self._es.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _scroll(self, body):
+        """
+        Iterate over all hits matching the given search body using a single scroll
+
+        :type body dict
+        """
+        res = await self._es.search(
+            body=body,
+            scroll=self.SCROLL_TIMEOUT,
+            sort=["_doc"],  # return the next batch of results from every shard that still has results to return.
+            size=self._batch_size,  # batch size
+            **self._get_search_params()
+        )
+
+        while True:
+            hits = res['hits']['hits']
+
+            if not hits:
+                return
+
+            for hit in hits:
+                yield hit
+
+            # clear_scroll is not called - it causes "403 Forbidden: You don't have access to this resource"
+            res = await self._es.scroll(scroll_id=res['_scroll_id'], scroll=self.SCROLL_TIMEOUT)
+
+    async def _sliced_scan(self, body, slices):
+        """
+        Split the scroll into slices that are consumed by concurrent tasks and merge hits into a single iterator
+
+        @see https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-request-scroll.html#sliced-scroll
+
+        :type body dict
+        :type slices int
+        """
+        hits = asyncio.Queue(maxsize=slices * self._batch_size)
+        done = object()  # put by each task when its slice is consumed
+
+        async def worker(slice_id):
+            try:
+                async for hit in self._scroll(dict(body, slice={'id': slice_id, 'max': slices})):
+                    await hits.put(hit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:  # pylint: disable=broad-except
+                await hits.put(_SliceError(ex))
+            else:
+                await hits.put(done)
+
+        self._logger.info("Running {:d} sliced scrolls concurrently".format(slices))
+
+        tasks = [asyncio.ensure_future(worker(slice_id)) for slice_id in range(slices)]
+
+        try:
+            finished = 0
+            while finished < slices:
+                item = await hits.get()
+
+                if item is done:
+                    finished += 1
+                elif isinstance(item, _SliceError):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _scan_hits(self, body):
+        """
+        Return an async generator of all hits matching the given search body (using sliced scroll when requested)
+
+        :type body dict
+        """
+        if self._scroll_slices > 1:
+            return self._sliced_scan(body, self._scroll_slices)
+
+        return self._scroll(body)
+
+    async def _iter_search(self, query, limit=50000, sampling=None, fields=None, exclude_fields=None):
+        """
+        Perform the search and yield raw rows as they are fetched from Elasticsearch
+
+        :type query object
+        :type limit int
+        :type sampling int or None
+        :type fields list or None
+        :type exclude_fields list or None
+        """
+        body = self._get_search_body(query, sampling, fields, exclude_fields)
+
+        self._logger.debug("Running {} query (limit set to {:d})".format(json.dumps(body), limit))
+
+        hits = self._scan_hits(body)
+        count = 0
+
+        try:
+            if limit > 0:
+                async for entry in hits:
+                    count += 1
+                    yield entry['_source']  # get data
+
+                    # get only requested amount of entries
+                    if count >= limit:
+                        break
+        finally:
+            await hits.aclose()
+
+        self._logger.info("{:d} rows returned".format(count))
+
+    async def _search(self, query, limit=50000, sampling=None, fields=None, exclude_fields=None):
+        return [row async for row in self._iter_search(query, limit, sampling, fields, exclude_fields)]
+
+    async def get_rows(self, match, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """ See Kibana.get_rows() """
+        return await self._search(self._get_match_query(match), limit, sampling, fields, exclude_fields)
+
+    def iter_rows(self, match, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """ See Kibana.iter_rows() - returns an async generator """
+        return self._iter_search(self._get_match_query(match), limit, sampling, fields, exclude_fields)
+
+    async def query_by_string(self, query, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """ See Kibana.query_by_string() """
+        return await self._search(self._get_query_string_query(query), limit, sampling, fields, exclude_fields)
+
+    def iter_query_by_string(self, query, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """ See Kibana.iter_query_by_string() - returns an async generator """
+        return self._iter_search(self._get_query_string_query(query), limit, sampling, fields, exclude_fields)
+
+    async def count(self, query):
+        """ See Kibana.count() """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        res = await self._es.count(body=body, **self._get_search_params())
+        return res['count']
+
+    async def exists(self, query):
+        """ See Kibana.exists() """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        res = await self._es.search(body=body, size=0, terminate_after=1, filter_path=['hits.total'],
+                                    **self._get_search_params())
+        return res['hits']['total'] > 0
+
+    async def iter_columns(self, query, fields, limit=50000, sampling=None, batch_size=None):
+        """ See Kibana.iter_columns() - this is an async generator """
+        batch_size = batch_size or self._batch_size
+        batch = ColumnBatch(fields)
+
+        async for row in self._iter_search(self._get_query_string_query(query), limit, sampling, fields):
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = ColumnBatch(fields)
+
+        if len(batch) > 0:
+            yield batch
+
+    async def follow(self, query, checkpoint_path, poll_interval=60, fields=None, max_polls=None):
+        """ See Kibana.follow() - this is an async generator """
+        since, seen_ids = self._load_checkpoint(checkpoint_path)
+
+        if since is None:
+            since = self._since
+
+        # timestamps are needed to find rows from the boundary second
+        if fields is not None and '@timestamp' not in fields:
+            fields = list(fields) + ['@timestamp']
+
+        polls = 0
+
+        while True:
+            to = int(time.time()) - self.SHORT_DELAY  # give logs some time to reach Logstash
+
+            if to > since:
+                self._set_time_range(since, to)
+
+                # the next time range will start at "to" (inclusive), remember rows we've already seen there
+                boundary = self.format_timestamp(to)[:19]  # ex. 2014-07-09T08:37:18
+                boundary_ids = []
+
+                hits = self._scan_hits(self._get_search_body(self._get_query_string_query(query), fields=fields))
+
+                try:
+                    async for hit in hits:
+                        if hit['_id'] in seen_ids:
+                            continue
+
+                        if hit['_source'].get('@timestamp', '').startswith(boundary):
+                            boundary_ids.append(hit['_id'])
+
+                        yield hit['_source']
+                finally:
+                    await hits.aclose()
+
+                self._save_checkpoint(checkpoint_path, to, boundary_ids)
+                since, seen_ids = to, set(boundary_ids)
+
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                return
+
+            await asyncio.sleep(poll_interval)
+
+    async def multi_query(self, queries):
+        """ See Kibana.multi_query() - queries with limit above MAX_RESULT_WINDOW are scrolled concurrently """
+        results, searches, scrolled = self._prepare_multi_query(queries)
+        pending = []
+
+        for position, item in scrolled:
+            pending.append(self._search(self._get_query_string_query(item['query']), item['limit'],
+                                        item['sampling'], item['fields'], item['exclude_fields']))
+
+        if searches:
+            self._logger.info("Running {:d} queries in a single multi search request".format(len(searches)))
+
+            header = {'ignore_unavailable': True} if self._check_indices else None
+            pending.append(self._es.msearch(body=self._get_multi_search_body(searches, header), index=self._index))
+
+        responses = await asyncio.gather(*pending)
+
+        for (position, _), rows in zip(scrolled, responses):
+            results[position] = rows
+
+        if searches:
+            self._parse_multi_search_response(responses[-1], searches, results)
+
+        return results
+
+    async def _aggregate(self, body):
+        cache_key = self._get_cache_key(body)
+
+        if cache_key is not None:
+            res = self._cache.get(cache_key)
+
+            if res is not None:
+                self._logger.info("Using cached aggregations")
+                return res
+
+        res = await self._es.search(
+            body=body,
+            size=0,  # we don need any rows from the index, stats is all we need here
+            filter_path=['aggregations'],  # skip hits and shards metadata in the response
+            **self._get_search_params()
+        )
+
+        if cache_key is not None:
+            self._cache.set(cache_key, res)
+
+        return res
+
+    async def get_aggregations(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), size=100):
+        """ See Kibana.get_aggregations() """
+        body = self._get_aggregations_body(query, group_by, stats_field, percents, size)
+
+        self._logger.info("Getting aggregations for {} field when grouped by {}".format(group_by, stats_field))
+
+        return self._parse_aggregations_response(await self._aggregate(body))
+
+    async def iter_aggregations(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), page_size=100):
+        """ See Kibana.iter_aggregations() - this is an async generator """
+        self._logger.info("Getting paginated aggregations for {} field when grouped by {}".
+                          format(stats_field, group_by))
+
+        after_key = None
+
+        while True:
+            body = self._get_composite_aggregations_body(query, group_by, stats_field, percents, page_size, after_key)
+
+            page, after_key = self._parse_composite_response(await self._aggregate(body), page_size)
+
+            if page:
+                yield page
+
+            if after_key is None:
+                return
+
+    async def get_histogram(self, query, interval, stats_field=None, group_by=None, percents=(50, 95, 99, 99.9),
+                            size=100):
+        """ See Kibana.get_histogram() """
+        body = self._get_histogram_body(query, interval, stats_field, group_by, percents, size)
+
+        self._logger.info("Getting {} histogram for {} query".format(interval, query))
+
+        return self._parse_histogram_response(await self._aggregate(body))
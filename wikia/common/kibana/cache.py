@@ -0,0 +1,129 @@
+"""
+Caches for Elasticsearch aggregation responses
+
+Both caches implement the same interface: get(key) returns the cached value (or None when the key is not found
+or has expired) and set(key, value) stores a JSON-serializable value.
+"""
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    """
+    In-process LRU cache with entries expiring after a given time
+    """
+    def __init__(self, max_size=128, ttl=3600):
+        """
+        :type max_size int
+        :type ttl int
+
+        :arg max_size: maximum number of entries kept, least recently used ones are evicted first (defaults to 128)
+        :arg ttl: number of seconds entries are kept for (defaults to 1 hour)
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[0] < time.time():
+                return None
+
+            # mark as the most recently used one
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, value)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache(object):
+    """
+    On-disk cache (a JSON file per entry) with entries expiring after a given time
+
+    Can be shared between processes and survives restarts.
+    """
+    def __init__(self, directory, max_size=1024, ttl=86400):
+        """
+        :type directory str
+        :type max_size int
+        :type ttl int
+
+        :arg directory: directory to store entries in (will be created if needed)
+        :arg max_size: maximum number of entries kept, the oldest ones are evicted first (defaults to 1024)
+        :arg ttl: number of seconds entries are kept for (defaults to 24 hours)
+        """
+        self._directory = directory
+        self._max_size = max_size
+        self._ttl = ttl
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _get_path(self, key):
+        return os.path.join(self._directory, '{}.json'.format(key))
+
+    def get(self, key):
+        path = self._get_path(key)
+
+        try:
+            if os.path.getmtime(path) + self._ttl < time.time():
+                os.remove(path)
+                return None
+
+            with open(path) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            # not cached, removed by another process in the meantime or corrupted
+            return None
+
+    def set(self, key, value):
+        path = self._get_path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        with open(tmp_path, 'w') as fp:
+            json.dump(value, fp)
+
+        os.rename(tmp_path, path)
+
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove the oldest entries above the size limit
+        """
+        names = [name for name in os.listdir(self._directory) if name.endswith('.json')]
+
+        if len(names) <= self._max_size:
+            return
+
+        entries = []
+        for name in names:
+            path = os.path.join(self._directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # removed by another process in the meantime
+
+        entries.sort()
+
+        for _, path in entries[:len(entries) - self._max_size]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
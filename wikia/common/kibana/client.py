@@ -0,0 +1,54 @@
+"""
+Process-wide registry of Elasticsearch clients shared by Kibana instances
+
+Each client keeps a pool of persistent (HTTP keep-alive) connections, so reusing it between Kibana instances
+saves TCP and TLS handshakes when many short queries are run.
+"""
+import json
+import threading
+
+from elasticsearch import Elasticsearch
+
+from .serializer import DEFAULT_SERIALIZER
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(hosts, timeout=10, pool_size=10, serializer=DEFAULT_SERIALIZER):
+    """
+    Return Elasticsearch client for given hosts and settings, create it on the first call
+
+    Elasticsearch client is thread-safe, the same instance can be used by many threads.
+
+    :type hosts str|list
+    :type timeout int
+    :type pool_size int
+    :type serializer elasticsearch.serializer.JSONSerializer
+
+    :arg hosts: Elasticsearch host(s)
+    :arg timeout: read timeout (in seconds)
+    :arg pool_size: maximum number of persistent connections kept per host (defaults to 10)
+    :arg serializer: JSON serializer to encode requests and decode responses with (defaults to FastJSONSerializer)
+
+    :rtype: Elasticsearch
+    """
+    key = (json.dumps(hosts, sort_keys=True), timeout, pool_size, serializer)
+
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Elasticsearch(hosts=hosts, timeout=timeout, maxsize=pool_size, serializer=serializer)
+
+        return _clients[key]
+
+
+def clear_clients():
+    """
+    Close connections of all registered clients and empty the registry
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.transport.close()
+
+        _clients.clear()
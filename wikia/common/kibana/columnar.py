@@ -0,0 +1,229 @@
+"""
+Compact, column-oriented storage for batches of log messages
+
+Numeric fields are kept in typed arrays (C long or double per value) and strings are dictionary-encoded, i.e. every
+distinct value is stored once and rows keep its integer code. Columns expose buffers that can be wrapped by NumPy
+without copying (see to_numpy methods).
+"""
+import json
+import numbers
+
+from array import array
+from collections import OrderedDict
+
+
+MISSING_CODE = -1  # code of missing values in dictionary-encoded columns
+
+STRING_TYPES = (str, type(u''))
+
+
+def is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def is_integer(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def to_string(value):
+    """
+    Return the value as a string (non-string values are JSON-encoded), None is kept as is
+    """
+    if value is None or isinstance(value, STRING_TYPES):
+        return value
+
+    return json.dumps(value)
+
+
+def get_field(source, field):
+    """
+    Return the value of a given field from the log message, dots in the field name are used to reach nested values
+
+    :type source dict
+    :type field str
+    """
+    if field in source:
+        return source[field]
+
+    value = source
+    for key in field.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+
+    return value
+
+
+class NumericColumn(object):
+    """
+    Column of numbers stored in a typed array, integers are upcast to floats when needed (missing values are NaN)
+    """
+    def __init__(self, typecode, values=()):
+        self.values = array(typecode, values)
+        self.has_only_integers = typecode == 'l'  # are all (not missing) values integers?
+
+    @property
+    def is_integer(self):
+        return self.values.typecode == 'l'
+
+    def append(self, value):
+        if value is None:
+            self._to_float()
+            value = float('nan')
+        elif not is_integer(value):
+            self._to_float()
+            self.has_only_integers = False
+
+        try:
+            self.values.append(value)
+        except OverflowError:
+            self._to_float()
+            self.values.append(value)
+
+    def _to_float(self):
+        if self.is_integer:
+            self.values = array('d', self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def to_list(self):
+        return self.values.tolist()
+
+    def to_numpy(self):
+        import numpy
+        dtype = 'i{}' if self.is_integer else 'f{}'
+        return numpy.frombuffer(self.values, dtype=numpy.dtype(dtype.format(self.values.itemsize)))
+
+
+class DictionaryColumn(object):
+    """
+    Dictionary-encoded column of strings, MISSING_CODE marks missing values
+    """
+    def __init__(self):
+        self.codes = array('l')
+        self.dictionary = []
+        self._lookup = {}
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(MISSING_CODE)
+            return
+
+        code = self._lookup.get(value)
+
+        if code is None:
+            code = len(self.dictionary)
+            self._lookup[value] = code
+            self.dictionary.append(value)
+
+        self.codes.append(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        code = self.codes[index]
+        return self.dictionary[code] if code != MISSING_CODE else None
+
+    def to_list(self):
+        return [self.dictionary[code] if code != MISSING_CODE else None for code in self.codes]
+
+    def to_numpy(self):
+        """ Return codes as NumPy array, use dictionary attribute to decode them """
+        import numpy
+        return numpy.frombuffer(self.codes, dtype=numpy.dtype('i{}'.format(self.codes.itemsize)))
+
+
+class ColumnBatch(object):
+    """
+    Batch of log messages stored column by column
+
+    batch['@fields.url'] returns a column of values of a given field.
+    """
+    def __init__(self, fields):
+        """
+        :type fields list
+        """
+        self.columns = OrderedDict((field, None) for field in fields)
+        self.num_rows = 0
+
+    def append(self, source):
+        """
+        Add a log message (_source of Elasticsearch hit) to the batch
+
+        :type source dict
+        """
+        for field, column in list(self.columns.items()):
+            value = get_field(source, field)
+
+            if column is None:
+                if value is None:
+                    continue  # the type of the column is not known yet
+
+                column = self._create_column(value)
+                self.columns[field] = column
+
+            self._append(field, column, value)
+
+        self.num_rows += 1
+
+    def _create_column(self, value):
+        """
+        Create the column matching the type of the first value and fill it with missing values of previous rows
+        """
+        if is_number(value):
+            column = NumericColumn('l' if is_integer(value) else 'd')
+        else:
+            column = DictionaryColumn()
+
+        for _ in range(self.num_rows):
+            column.append(None)
+
+        return column
+
+    def _append(self, field, column, value):
+        if isinstance(column, NumericColumn):
+            if value is None or is_number(value):
+                column.append(value)
+                return
+
+            # not a number - store the column as strings from now on
+            strings = DictionaryColumn()
+            for number in column.to_list():
+                if number != number:  # NaN marks a missing value
+                    strings.append(None)
+                else:
+                    strings.append(to_string(int(number) if column.has_only_integers else number))
+
+            column = strings
+            self.columns[field] = column
+
+        column.append(to_string(value))
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, field):
+        column = self.columns[field]
+
+        # none of the rows have this field set
+        if column is None:
+            column = DictionaryColumn()
+            for _ in range(self.num_rows):
+                column.append(None)
+            self.columns[field] = column
+
+        return column
+
+    def to_rows(self):
+        """
+        Return the batch as a list of dicts (field -> value)
+
+        :rtype: list
+        """
+        columns = [(field, self[field]) for field in self.columns]
+        return [dict((field, column[index]) for field, column in columns) for index in range(self.num_rows)]
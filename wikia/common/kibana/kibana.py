@@ -2,10 +2,14 @@
 Run queries against Kibana's elasticsearch
 @see http://elasticsearch-py.readthedocs.org/en/master/
 """
+import hashlib
 import json
 import logging
+import os
+import threading
 import time
 
+from collections import OrderedDict
 from datetime import datetime
 from dateutil import tz
 from itertools import islice
@@ -13,23 +17,53 @@ from itertools import islice
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import scan
 
+from .client import get_client
+from .columnar import ColumnBatch
+from .serializer import DEFAULT_SERIALIZER
+
+try:
+    from queue import Queue, Full
+except ImportError:  # Python 2
+    from Queue import Queue, Full
+
 
 class KibanaError(Exception):
     pass
 
 
-class Kibana(object):
+class _SliceError(object):
+    """ Wraps an exception raised by the sliced scroll worker, so that it can be re-raised by the consumer """
+    def __init__(self, error):
+        self.error = error
+
+
+class BaseKibana(object):
+    """
+    Time range, indices and query building logic shared by Kibana and AsyncKibana clients
+    """
+
     # give 5 seconds for all log messages to reach logstash and be stored in elasticsearch
     SHORT_DELAY = 5
 
-    # seconds in 24h used to get the es index for yesterday
+    # seconds in 24h - Elasticsearch indices are created daily
     DAY = 86400
 
+    # aggregations are cached only for time ranges that ended at least 5 minutes ago (late log messages may still come)
+    CACHE_MIN_AGE = 300
+
+    # index.max_result_window - queries returning more rows than that need to use the scroll API
+    MAX_RESULT_WINDOW = 10000
+
     ELASTICSEARCH_HOST = 'logs-prod.es.service.sjc.consul'  # ES5
 
-    """ Interface for querying Kibana's storage """
+    # sampling methods
+    SAMPLING_RANDOM_SCORE = 'random_score'  # filter documents by their (seeded) random score
+    SAMPLING_SCRIPT = 'script'  # filter documents by the hash of their _id calculated by painless script
+
     def __init__(self, since=None, period=900, es_host=None, read_timeout=10, index_prefix='logstash-other',
-                 batch_size=1000):
+                 batch_size=1000, scroll_slices=1, check_indices=False, sampling_method=SAMPLING_RANDOM_SCORE,
+                 sampling_seed=42, shared_client=True, pool_size=10, to=None, cache=None,
+                 serializer=DEFAULT_SERIALIZER):
         """
         :type since int
         :type period int
@@ -37,16 +71,47 @@ class Kibana(object):
         :type read_timeout int
         :type index_prefix str
         :type batch_size int
+        :type scroll_slices int
+        :type check_indices bool
+        :type sampling_method str
+        :type sampling_seed int
+        :type shared_client bool
+        :type pool_size int
+        :type to int
+        :type cache wikia.common.kibana.cache.MemoryCache|wikia.common.kibana.cache.FileCache
+        :type serializer elasticsearch.serializer.JSONSerializer
 
         :arg since: UNIX timestamp data should be fetched since
-        :arg period: period (in seconds) before now() to be used when since is empty (defaults to last 15 minutes)
+        :arg period: period (in seconds) before to (or now()) to be used when since is empty (defaults to 15 minutes)
         :arg es_host: customize Elasticsearch host(s) that should be used for querying
         :arg read_timeout: customize Elasticsearch read timeout (defaults to 10 s)
         :arg index_prefix name of the Elasticsearch index (defaults to 'logstash-other')
         :arg batch_size size of the batch sent in every requests of the ELK scroll API (defaults to 1000)
+        :arg scroll_slices number of sliced scrolls to be run in parallel threads (defaults to 1 - a single scroll)
+        :arg check_indices skip daily indices that do not exist in Elasticsearch (defaults to False)
+        :arg sampling_method how to sample rows - either Kibana.SAMPLING_RANDOM_SCORE (the default)
+            or Kibana.SAMPLING_SCRIPT (runs a script per document, always samples the same rows for a given percentage)
+        :arg sampling_seed seed used by Kibana.SAMPLING_RANDOM_SCORE method (defaults to 42)
+        :arg shared_client reuse Elasticsearch client (and its connections) created by other instances for the same
+            es_host, read_timeout and pool_size (defaults to True)
+        :arg pool_size maximum number of persistent connections kept per Elasticsearch host (defaults to 10)
+        :arg to: UNIX timestamp data should be fetched until (defaults to now)
+        :arg cache: cache aggregations results for time ranges that have already ended (not cached by default)
+        :arg serializer: JSON serializer used by Elasticsearch client (defaults to FastJSONSerializer that decodes
+            responses with the fastest JSON library installed)
         """
-        self._es = Elasticsearch(hosts=es_host if es_host else self.ELASTICSEARCH_HOST, timeout=read_timeout)
+        if sampling_method not in (self.SAMPLING_RANDOM_SCORE, self.SAMPLING_SCRIPT):
+            raise KibanaError("Unknown sampling method: {}".format(sampling_method))
+
+        self._shared_client = shared_client
+        self._pool_size = pool_size
+        self._serializer = serializer
+        self._es = self._create_client(hosts=es_host if es_host else self.ELASTICSEARCH_HOST, timeout=read_timeout)
         self._batch_size = batch_size
+        self._scroll_slices = scroll_slices
+        self._sampling_method = sampling_method
+        self._sampling_seed = sampling_seed
+        self._cache = cache
 
         self._logger = logging.getLogger('kibana')
 
@@ -54,25 +119,66 @@ class Kibana(object):
         now = int(time.time())
 
         if since is None:
-            since = now - period
+            since = (to if to is not None else now) - period
         else:
             since += 1
             self._logger.info("Using provided {0} timestamp as since ({1} seconds ago)".format(since, now - since))
 
+        self._index_prefix = index_prefix
+        self._check_indices = check_indices
+
+        if to is None:
+            to = now - self.SHORT_DELAY  # give logs some time to reach Logstash
+
+        self._set_time_range(since, to)
+
+    def _set_time_range(self, since, to):
+        """
+        Set the time range to query and the Elasticsearch indices that cover it
+
+        :type since int
+        :type to int
+        """
         self._since = since
-        self._to = now - self.SHORT_DELAY  # give logs some time to reach Logstash
+        self._to = to
 
-        # Elasticsearch index to query
-        # from today and yesterday
-        self._index = ','.join([
-            self.format_index(index_prefix, now-self.DAY),
-            self.format_index(index_prefix, now),
-        ])
+        indices = self.get_indices(self._index_prefix, since, to)
+
+        # an empty index list would make Elasticsearch search all indices of the cluster
+        if not indices:
+            raise KibanaError("Invalid time range: {} - {}".format(since, to))
+
+        if self._check_indices:
+            indices = self._filter_indices(indices)
+
+            if not indices:
+                raise KibanaError("No {}-* indices exist for the requested time range".format(self._index_prefix))
+
+        self._index = ','.join(indices)
 
         self._logger.info("Using {} indices".format(self._index))
         self._logger.info("Querying for messages from between {} and {}".
                           format(self.format_timestamp(self._since), self.format_timestamp(self._to)))
 
+    @classmethod
+    def get_indices(cls, prefix, since, to):
+        """
+        Return names of daily indices that cover the given time range (both ends included)
+
+        :type prefix str
+        :type since int
+        :type to int
+        :rtype: list
+        """
+        day = since - since % cls.DAY  # midnight (UTC) of the first day
+
+        indices = []
+        while day <= to:
+            indices.append(cls.format_index(prefix, day))
+            day += cls.DAY
+
+        return indices
+
     @staticmethod
     def format_index(prefix, ts):
         """
@@ -96,6 +202,39 @@ class Kibana(object):
         tz_info = tz.tzutc()
         return datetime.fromtimestamp(ts, tz=tz_info).strftime("%Y-%m-%dT%H:%M:%S.000Z")
 
+    def _create_client(self, hosts, timeout):
+        """
+        Create Elasticsearch client instance
+
+        :type hosts str|list
+        :type timeout int
+        """
+        raise NotImplementedError('Inheritors must override BaseKibana._create_client')
+
+    def _filter_indices(self, indices):
+        """
+        Return only indices that exist in Elasticsearch (called when check_indices is set)
+
+        :type indices list
+        :rtype: list
+        """
+        raise NotImplementedError('Inheritors must override BaseKibana._filter_indices')
+
+    def _get_cache_key(self, body):
+        """
+        Return the key the response for a given aggregations request is cached under
+
+        None is returned when the response should not be cached (no cache or the time range is still open).
+
+        :type body dict
+        :rtype: str|None
+        """
+        if self._cache is None or self._to > int(time.time()) - self.CACHE_MIN_AGE:
+            return None
+
+        request = json.dumps({'index': self._index, 'body': body}, sort_keys=True)
+        return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
     def _get_timestamp_filer(self):
         return {
             "range": {
@@ -106,17 +245,20 @@ class Kibana(object):
             }
         }
 
-    def _search(self, query, limit=50000, sampling=None):
+    def _get_search_body(self, query, sampling=None, fields=None, exclude_fields=None):
         """
-        Perform the search and return raw rows
+        Build the body of the search request for a given query
 
         :type query object
-        :type limit int
         :type sampling int or None
+        :type fields list or None
+        :type exclude_fields list or None
 
         :arg sampling: Percentage of results to be returned (0,100)
+        :arg fields: fields of the log messages to be returned (all by default)
+        :arg exclude_fields: fields of the log messages to be skipped
 
-        :rtype: list
+        :rtype: dict
         """
         body = {
             "query": {
@@ -135,7 +277,28 @@ class Kibana(object):
 
         # sample the results if needed
         if sampling is not None:
-            body['query']['bool']['must'].append({
+            body['query']['bool']['must'].append(self._get_sampling_query(sampling))
+
+        # return only the requested parts of log messages
+        # @see https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-request-source-filtering.html
+        if fields is not None or exclude_fields is not None:
+            body['_source'] = {
+                'includes': list(fields or []),
+                'excludes': list(exclude_fields or []),
+            }
+
+        return body
+
+    def _get_sampling_query(self, sampling):
+        """
+        Return the query that matches given percentage of documents
+
+        :type sampling int
+        :rtype: dict
+        """
+        if self._sampling_method == self.SAMPLING_SCRIPT:
+            # runs a painless script for every document in the time range
+            return {
                 'script': {
                     'script': {
                         'lang': 'painless',
@@ -145,86 +308,175 @@ class Kibana(object):
                         }
                     }
                 }
-            })
+            }
 
-        self._logger.debug("Running {} query (limit set to {:d})".format(json.dumps(body), body.get('size', 0)))
+        # random_score gives every document a score uniformly distributed in [0, 1)
+        # keep only documents with the score above the threshold
+        # @see function-random section of
+        # https://www.elastic.co/guide/en/elasticsearch/reference/6.8/query-dsl-function-score-query.html
+        return {
+            'function_score': {
+                'random_score': {
+                    'seed': self._sampling_seed,
+                    'field': '_seq_no',
+                },
+                'boost_mode': 'replace',
+                'min_score': 1 - sampling / 100.0,
+            }
+        }
 
-        # use Scroll API to be able to fetch more than 10k results and prevent "search_phase_execution_exception":
-        # "Result window is too large, from + size must be less than or equal to: [10000] but was [500000].
-        # See the scroll api for a more efficient way to request large data sets."
-        #
-        # @see http://elasticsearch-py.readthedocs.io/en/master/helpers.html#scan
-        rows = scan(
-            client=self._es,
-            clear_scroll=False,  # True causes "403 Forbidden: You don't have access to this resource"
-            index=self._index,
-            query=body,
-            sort=["_doc"],  # return the next batch of results from every shard that still has results to return.
-            size=self._batch_size,  # batch size
-        )
+    @staticmethod
+    def _get_match_query(match):
+        return {
+            "match": match,
+        }
 
-        # get only requested amount of entries and cast them to a list
-        rows = islice(rows, 0, limit)
-        rows = [entry['_source'] for entry in rows]  # get data
+    @staticmethod
+    def _get_query_string_query(query):
+        return {
+            "query_string": {
+                "query": query,
+            }
+        }
 
-        self._logger.info("{:d} rows returned".format(len(rows)))
-        return rows
+    @staticmethod
+    def _get_multi_query_item(item):
+        """
+        Normalize multi_query() item - a query string or a dict with query_by_string() / get_aggregations() arguments
 
-    def get_rows(self, match, limit=10, sampling=None):
+        :type item str|dict
+        :rtype: dict
         """
-        Returns raw rows that matches given query
+        if not isinstance(item, dict):
+            item = {'query': item}
 
-        :arg match: query to be run against Kibana log messages (ex. {"@message": "Foo Bar DB queries"})
-        :arg limit: the number of results (defaults to 10)
-        :type sampling int or None
-        :arg sampling: Percentage of results to be returned (0,100)
+        if 'group_by' in item:
+            defaults = {'stats_field': None, 'percents': (50, 95, 99, 99.9), 'size': 100}
+        else:
+            defaults = {'limit': 10, 'sampling': None, 'fields': None, 'exclude_fields': None}
+
+        defaults.update(item)
+        return defaults
+
+    def _prepare_multi_query(self, queries):
         """
-        query = {
-            "match": match,
-        }
+        Split multi_query() items into searches sent in a single _msearch request and the ones to be scrolled
+        separately (aggregations found in the cache are put into results right away)
+
+        :type queries list
+        :rtype: tuple
+        :return: results list, searches - (position, is aggregation, body, cache key), scrolled - (position, item)
+        """
+        results = [None] * len(queries)
+        searches = []
+        scrolled = []
+
+        for position, item in enumerate(queries):
+            item = self._get_multi_query_item(item)
+
+            if 'group_by' in item:
+                body = self._get_aggregations_body(item['query'], item['group_by'], item['stats_field'],
+                                                   item['percents'], item['size'])
+                cache_key = self._get_cache_key(body)
+
+                res = self._cache.get(cache_key) if cache_key is not None else None
+                if res is not None:
+                    results[position] = self._parse_aggregations_response(res)
+                    continue
+
+                body['size'] = 0  # no rows needed, stats is all we need here
+                searches.append((position, True, body, cache_key))
 
-        return self._search(query, limit, sampling)
+            elif item['limit'] > self.MAX_RESULT_WINDOW:
+                scrolled.append((position, item))
 
-    def query_by_string(self, query, limit=10, sampling=None):
+            else:
+                body = self._get_search_body(self._get_query_string_query(item['query']), item['sampling'],
+                                             item['fields'], item['exclude_fields'])
+                body['size'] = item['limit']
+                searches.append((position, False, body, None))
+
+        return results, searches, scrolled
+
+    @staticmethod
+    def _get_multi_search_body(searches, header=None):
         """
-        Returns raw rows that matches the given query string
+        :type searches list
+        :type header dict or None
+        :rtype: list
+        """
+        request = []
+        for _, _, body, _ in searches:
+            request.append(header or {})  # indices are passed in the URL
+            request.append(body)
 
-        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
-        :arg limit: the number of results (defaults to 10)
-        :type sampling int or None
-        :arg sampling: Percentage of results to be returned (0,100)
+        return request
+
+    def _parse_multi_search_response(self, res, searches, results):
         """
-        query = {
-            "query_string": {
-                "query": query,
-            }
-        }
+        Put rows (or parsed aggregations) from _msearch responses into results
+
+        :type res dict
+        :type searches list
+        :type results list
+        """
+        for (position, is_aggregation, _, cache_key), response in zip(searches, res['responses']):
+            if 'error' in response:
+                raise KibanaError("Query #{:d} failed: {}".format(position, json.dumps(response['error'])))
 
-        return self._search(query, limit, sampling)
+            if is_aggregation:
+                response = {'aggregations': response['aggregations']}
 
-    def get_to_timestamp(self):
-        """ Return the upper time boundary to returned data """
-        return self._to
+                if cache_key is not None:
+                    self._cache.set(cache_key, response)
 
-    def get_aggregations(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), size=100):
+                results[position] = self._parse_aggregations_response(response)
+            else:
+                results[position] = [hit['_source'] for hit in response['hits']['hits']]
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path):
         """
-        Returns aggregations (rows count + percentile stats) for a given query
+        Return the end of the last followed time range and _id's of rows from its last second
 
-        This is basically the same as the following pseudo-SQL query:
-        SELECT PERCENTILE(stats_field, 75) FROM query GROUP BY group_by LIMIT size
+        :type checkpoint_path str
+        :rtype: tuple
+        """
+        if not os.path.exists(checkpoint_path):
+            return None, set()
 
-        https://www.elastic.co/guide/en/elasticsearch/reference/5.5/search-aggregations-bucket-terms-aggregation.html
-        https://www.elastic.co/guide/en/elasticsearch/reference/5.5/search-aggregations-metrics-percentile-aggregation.html
+        with open(checkpoint_path) as fp:
+            checkpoint = json.load(fp)
 
-        Please note that group_by should be provided by a "keyword" field:
+        return checkpoint['to'], set(checkpoint['ids'])
 
-        Fielddata is disabled on text fields by default. Set fielddata=true on [@context.caller] in order to load
-        fielddata in memory by uninverting the inverted index. Note that this can however use significant memory.\
-        Alternatively use a keyword field instead.
+    @staticmethod
+    def _save_checkpoint(checkpoint_path, to, ids):
+        """
+        Atomically replace the checkpoint file
+
+        :type checkpoint_path str
+        :type to int
+        :type ids list
+        """
+        tmp_path = checkpoint_path + '.tmp'
+
+        with open(tmp_path, 'w') as fp:
+            json.dump({'to': to, 'ids': ids}, fp)
+
+        os.rename(tmp_path, checkpoint_path)
+
+    def get_to_timestamp(self):
+        """ Return the upper time boundary to returned data """
+        return self._to
+
+    def _get_aggregations_body(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), size=100):
+        """
+        Build the body of the terms + percentiles aggregation request
 
         :type query str
         :type group_by str
-        :type stats_field str
+        :type stats_field str or None
         :type percents set
         :type size int
         :rtype: dict
@@ -245,31 +497,24 @@ class Kibana(object):
                         "field": group_by,
                         "size": size,  # how many term buckets should be returned out of the overall terms list
                     },
-                    "aggregations": {
-                        "field_stats": {
-                            "percentiles": {
-                                "field": stats_field,
-                                "percents": percents
-                            }
-                        }
-                    }
                 }
             }
         }
 
+        # only rows count is returned when there's no field to calculate percentiles for
+        if stats_field is not None:
+            body['aggregations']['group_by_agg']['aggregations'] = self._get_stats_aggregation(stats_field, percents)
+
         # add @timestamp range
         body['query']['bool']['must'].append(self._get_timestamp_filer())
 
-        self._logger.info("Getting aggregations for {} field when grouped by {}".format(group_by, stats_field))
-
-        res = self._es.search(
-            body=body,
-            index=self._index,
-            size=0,  # we don need any rows from the index, stats is all we need here
-        )
-
-        # print(json.dumps(res, indent=True))
+        return body
 
+    def _parse_aggregations_response(self, res):
+        """
+        :type res dict
+        :rtype: dict
+        """
         aggs = {}
 
         """
@@ -287,11 +532,738 @@ class Kibana(object):
         }
         """
         for bucket in res['aggregations']['group_by_agg']['buckets']:
-            entry = {
-                "count": bucket['doc_count']
+            aggs[bucket['key']] = self._get_bucket_stats(bucket)
+
+        return aggs
+
+    @staticmethod
+    def _get_stats_aggregation(stats_field, percents):
+        """
+        Return percentiles sub-aggregation for a given field
+
+        :type stats_field str or None
+        :type percents set
+        :rtype: dict
+        """
+        return {
+            "field_stats": {
+                "percentiles": {
+                    "field": stats_field,
+                    "percents": percents
+                }
+            }
+        }
+
+    def _get_composite_aggregations_body(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9),
+                                         page_size=100, after_key=None):
+        """
+        Build the body of the composite aggregation request that returns a single page of buckets
+
+        :type query str
+        :type group_by str
+        :type stats_field str or None
+        :type percents set
+        :type page_size int
+        :type after_key dict or None
+        :rtype: dict
+        """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        composite = {
+            "size": page_size,
+            "sources": [{
+                "group_by": {
+                    "terms": {
+                        "field": group_by,
+                    }
+                }
+            }],
+        }
+
+        if after_key is not None:
+            composite['after'] = after_key
+
+        body['aggregations'] = {
+            "group_by_agg": {
+                "composite": composite,
             }
+        }
+
+        if stats_field is not None:
+            body['aggregations']['group_by_agg']['aggregations'] = self._get_stats_aggregation(stats_field, percents)
+
+        return body
+
+    def _parse_composite_response(self, res, page_size):
+        """
+        Return a page of aggregations and the key to fetch the next page after (None for the last page)
+
+        :type res dict
+        :type page_size int
+        :rtype: tuple
+        """
+        # no matching rows at all
+        if 'aggregations' not in res:
+            return {}, None
+
+        """
+        bucket = {
+            "key": {
+                "group_by": "Wikia\\Service\\Gateway\\ConsulUrlProvider:getUrl"
+            },
+            "doc_count": 8912859,
+            "field_stats": {...}
+        }
+        """
+        buckets = res['aggregations']['group_by_agg']['buckets']
+        page = dict((bucket['key']['group_by'], self._get_bucket_stats(bucket)) for bucket in buckets)
+
+        if len(buckets) < page_size:
+            return page, None
+
+        # after_key is returned since Elasticsearch 6.3, fall back to the key of the last bucket
+        return page, res['aggregations']['group_by_agg'].get('after_key', buckets[-1]['key'])
+
+    @staticmethod
+    def _get_bucket_stats(bucket):
+        """
+        Return rows count and percentiles (if requested) for a given aggregation bucket
+
+        :type bucket dict
+        :rtype: dict
+        """
+        entry = {
+            "count": bucket['doc_count']
+        }
+
+        if 'field_stats' in bucket:
             entry.update(bucket['field_stats']['values'])
 
-            aggs[bucket['key']] = entry
+        return entry
 
-        return aggs
+    def _get_histogram_body(self, query, interval, stats_field=None, group_by=None, percents=(50, 95, 99, 99.9),
+                            size=100):
+        """
+        Build the body of the date_histogram aggregation request
+
+        :type query str
+        :type interval str|int
+        :type stats_field str or None
+        :type group_by str or None
+        :type percents set
+        :type size int
+        :rtype: dict
+        """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        # interval given in seconds
+        if isinstance(interval, int):
+            interval = '{:d}s'.format(interval)
+
+        histogram = {
+            "date_histogram": {
+                "field": "@timestamp",
+                "interval": interval,
+                "min_doc_count": 0,  # return empty buckets as well
+                "extended_bounds": {
+                    "min": self._since * 1000,
+                    "max": self._to * 1000,
+                },
+            },
+        }
+
+        stats = self._get_stats_aggregation(stats_field, percents)
+
+        if group_by is not None:
+            histogram['aggregations'] = {
+                "group_by_agg": {
+                    "terms": {
+                        "field": group_by,
+                        "size": size,
+                    },
+                }
+            }
+
+            if stats_field is not None:
+                histogram['aggregations']['group_by_agg']['aggregations'] = stats
+        elif stats_field is not None:
+            histogram['aggregations'] = stats
+
+        body['aggregations'] = {
+            "histogram_agg": histogram
+        }
+
+        return body
+
+    def _parse_histogram_response(self, res):
+        """
+        :type res dict
+        :rtype: OrderedDict
+        """
+        histogram = OrderedDict()
+
+        """
+        bucket = {
+            "key_as_string": "2017-05-09T10:00:00.000Z",
+            "key": 1494324000000,
+            "doc_count": 1042,
+            "group_by_agg": {
+                "buckets": [...]
+            }
+        }
+        """
+        for bucket in res['aggregations']['histogram_agg']['buckets']:
+            timestamp = bucket['key'] // 1000
+
+            if 'group_by_agg' in bucket:
+                histogram[timestamp] = OrderedDict(
+                    (group['key'], self._get_bucket_stats(group)) for group in bucket['group_by_agg']['buckets']
+                )
+            else:
+                histogram[timestamp] = self._get_bucket_stats(bucket)
+
+        return histogram
+
+
+class Kibana(BaseKibana):
+    """ Interface for querying Kibana's storage """
+
+    def _create_client(self, hosts, timeout):
+        if self._shared_client:
+            return get_client(hosts=hosts, timeout=timeout, pool_size=self._pool_size, serializer=self._serializer)
+
+        return Elasticsearch(hosts=hosts, timeout=timeout, maxsize=self._pool_size, serializer=self._serializer)
+
+    def _filter_indices(self, indices):
+        return [index for index in indices if self._es.indices.exists(index=index)]
+
+    def _scan(self, query, limit=50000, sampling=None, fields=None, exclude_fields=None):
+        """
+        Perform the search and return an iterator over raw hits
+
+        Hits are fetched lazily, one scroll page (of batch_size entries) at a time.
+
+        :type query object
+        :type limit int
+        :type sampling int or None
+        :type fields list or None
+        :type exclude_fields list or None
+
+        :arg sampling: Percentage of results to be returned (0,100)
+        :arg fields: fields of the log messages to be returned (all by default)
+        :arg exclude_fields: fields of the log messages to be skipped
+
+        :rtype: collections.Iterator
+        """
+        body = self._get_search_body(query, sampling, fields, exclude_fields)
+
+        self._logger.debug("Running {} query (limit set to {})".format(json.dumps(body), limit))
+
+        if self._scroll_slices > 1:
+            hits = self._sliced_scan(body, self._scroll_slices)
+        else:
+            hits = self._scroll(body)
+
+        # get only requested amount of entries
+        return islice(hits, 0, limit)
+
+    def _scroll(self, body):
+        """
+        Iterate over all hits matching the given search body using a single scroll
+
+        :type body dict
+        :rtype: collections.Iterator
+        """
+        # use Scroll API to be able to fetch more than 10k results and prevent "search_phase_execution_exception":
+        # "Result window is too large, from + size must be less than or equal to: [10000] but was [500000].
+        # See the scroll api for a more efficient way to request large data sets."
+        #
+        # @see http://elasticsearch-py.readthedocs.io/en/master/helpers.html#scan
+        return scan(
+            client=self._es,
+            clear_scroll=False,  # True causes "403 Forbidden: You don't have access to this resource"
+            index=self._index,
+            query=body,
+            sort=["_doc"],  # return the next batch of results from every shard that still has results to return.
+            size=self._batch_size,  # batch size
+        )
+
+    def _sliced_scan(self, body, slices):
+        """
+        Split the scroll into slices that are consumed by parallel threads and merge hits into a single iterator
+
+        Hits are returned in the order they arrive from the slices. Worker threads are stopped as soon as
+        the returned iterator is closed (e.g. when the requested limit of rows is reached).
+
+        @see https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-request-scroll.html#sliced-scroll
+
+        :type body dict
+        :type slices int
+        :rtype: collections.Iterator
+        """
+        hits = Queue(maxsize=slices * self._batch_size)
+        stop = threading.Event()
+        done = object()  # put by each worker when its slice is consumed
+
+        def put(item):
+            # do not block forever when the consumer is gone
+            while not stop.is_set():
+                try:
+                    hits.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def worker(slice_id):
+            slice_body = dict(body, slice={'id': slice_id, 'max': slices})
+
+            try:
+                for hit in self._scroll(slice_body):
+                    if not put(hit):
+                        return
+            except Exception as ex:  # pylint: disable=broad-except
+                put(_SliceError(ex))
+            finally:
+                put(done)
+
+        self._logger.info("Running {:d} sliced scrolls in parallel".format(slices))
+
+        for slice_id in range(slices):
+            thread = threading.Thread(target=worker, args=(slice_id,), name='kibana-slice-{:d}'.format(slice_id))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < slices:
+                item = hits.get()
+
+                if item is done:
+                    finished += 1
+                elif isinstance(item, _SliceError):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+    def _iter_search(self, query, limit=50000, sampling=None, fields=None, exclude_fields=None):
+        """
+        Perform the search and yield raw rows as they are fetched from Elasticsearch
+
+        :type query object
+        :type limit int
+        :type sampling int or None
+        :type fields list or None
+        :type exclude_fields list or None
+
+        :arg sampling: Percentage of results to be returned (0,100)
+        :arg fields: fields of the log messages to be returned (all by default)
+        :arg exclude_fields: fields of the log messages to be skipped
+
+        :rtype: collections.Iterator
+        """
+        count = 0
+
+        for entry in self._scan(query, limit, sampling, fields, exclude_fields):
+            count += 1
+            yield entry['_source']  # get data
+
+        self._logger.info("{:d} rows returned".format(count))
+
+    def _search(self, query, limit=50000, sampling=None, fields=None, exclude_fields=None):
+        """
+        Perform the search and return raw rows
+
+        :type query object
+        :type limit int
+        :type sampling int or None
+        :type fields list or None
+        :type exclude_fields list or None
+
+        :arg sampling: Percentage of results to be returned (0,100)
+        :arg fields: fields of the log messages to be returned (all by default)
+        :arg exclude_fields: fields of the log messages to be skipped
+
+        :rtype: list
+        """
+        return list(self._iter_search(query, limit, sampling, fields, exclude_fields))
+
+    def get_rows(self, match, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """
+        Returns raw rows that matches given query
+
+        :arg match: query to be run against Kibana log messages (ex. {"@message": "Foo Bar DB queries"})
+        :arg limit: the number of results (defaults to 10)
+        :type sampling int or None
+        :arg sampling: Percentage of results to be returned (0,100)
+        :type fields list or None
+        :arg fields: fields of the log messages to be returned (ex. ["@timestamp", "@fields.url"], all by default)
+        :type exclude_fields list or None
+        :arg exclude_fields: fields of the log messages to be skipped (ex. ["@context.backtrace"])
+        """
+        return self._search(self._get_match_query(match), limit, sampling, fields, exclude_fields)
+
+    def iter_rows(self, match, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """
+        Streaming version of get_rows() - yields rows as scroll pages are fetched
+
+        Only a single scroll page is kept in memory, regardless of the limit.
+
+        :arg match: query to be run against Kibana log messages (ex. {"@message": "Foo Bar DB queries"})
+        :arg limit: the number of results (defaults to 10)
+        :type sampling int or None
+        :arg sampling: Percentage of results to be returned (0,100)
+        :type fields list or None
+        :arg fields: fields of the log messages to be returned (ex. ["@timestamp", "@fields.url"], all by default)
+        :type exclude_fields list or None
+        :arg exclude_fields: fields of the log messages to be skipped (ex. ["@context.backtrace"])
+        """
+        return self._iter_search(self._get_match_query(match), limit, sampling, fields, exclude_fields)
+
+    def query_by_string(self, query, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """
+        Returns raw rows that matches the given query string
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+        :arg limit: the number of results (defaults to 10)
+        :type sampling int or None
+        :arg sampling: Percentage of results to be returned (0,100)
+        :type fields list or None
+        :arg fields: fields of the log messages to be returned (ex. ["@timestamp", "@fields.url"], all by default)
+        :type exclude_fields list or None
+        :arg exclude_fields: fields of the log messages to be skipped (ex. ["@context.backtrace"])
+        """
+        return self._search(self._get_query_string_query(query), limit, sampling, fields, exclude_fields)
+
+    def iter_query_by_string(self, query, limit=10, sampling=None, fields=None, exclude_fields=None):
+        """
+        Streaming version of query_by_string() - yields rows as scroll pages are fetched
+
+        Only a single scroll page is kept in memory, regardless of the limit.
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+        :arg limit: the number of results (defaults to 10)
+        :type sampling int or None
+        :arg sampling: Percentage of results to be returned (0,100)
+        :type fields list or None
+        :arg fields: fields of the log messages to be returned (ex. ["@timestamp", "@fields.url"], all by default)
+        :type exclude_fields list or None
+        :arg exclude_fields: fields of the log messages to be skipped (ex. ["@context.backtrace"])
+        """
+        return self._iter_search(self._get_query_string_query(query), limit, sampling, fields, exclude_fields)
+
+    def count(self, query):
+        """
+        Returns the number of rows that match the given query string (no rows are fetched)
+
+        https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-count.html
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+
+        :type query str
+        :rtype: int
+        """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        return self._es.count(body=body, index=self._index)['count']
+
+    def exists(self, query):
+        """
+        Checks whether there's at least one row that matches the given query string (no rows are fetched)
+
+        Each shard stops searching as soon as it finds the first matching row.
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+
+        :type query str
+        :rtype: bool
+        """
+        body = self._get_search_body(self._get_query_string_query(query))
+
+        res = self._es.search(body=body, index=self._index, size=0, terminate_after=1, filter_path=['hits.total'])
+        return res['hits']['total'] > 0
+
+    def iter_columns(self, query, fields, limit=50000, sampling=None, batch_size=None):
+        """
+        Yields rows that match the given query string as batches stored column by column
+
+        Numeric fields are stored in typed arrays and strings are dictionary-encoded (see columnar module),
+        which takes much less memory than a list of dicts and allows vectorized calculations:
+
+        for batch in source.iter_columns('@message:"^PHP Fatal"', fields=['@timestamp', '@context.requestTimeMS']):
+            times = batch['@context.requestTimeMS'].to_numpy()
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+        :arg fields: fields of the log messages to be returned (ex. ["@timestamp", "@fields.url"])
+        :arg limit: the number of results (defaults to 50000)
+        :arg sampling: Percentage of results to be returned (0,100)
+        :arg batch_size: the number of rows in a single batch (defaults to batch_size the instance was created with)
+
+        :type query str
+        :type fields list
+        :type limit int
+        :type sampling int or None
+        :type batch_size int or None
+        :rtype: collections.Iterator
+        """
+        batch_size = batch_size or self._batch_size
+        batch = ColumnBatch(fields)
+
+        for row in self._iter_search(self._get_query_string_query(query), limit, sampling, fields):
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = ColumnBatch(fields)
+
+        if len(batch) > 0:
+            yield batch
+
+    def follow(self, query, checkpoint_path, poll_interval=60, fields=None, max_polls=None):
+        """
+        Yields new rows matching the given query string as they arrive to Elasticsearch
+
+        Elasticsearch is polled every poll_interval seconds for rows from the time range that follows the previous one
+        (starting with the time range this instance was created for). The end of the last time range is stored in
+        checkpoint_path file after all its rows were yielded, so that a restarted follower starts where the previous
+        one stopped. Rows from the boundary second of two time ranges are de-duplicated by their _id.
+
+        Please note that this method changes the time range this instance queries.
+
+        :arg query: query string to be run against Kibana log messages (ex. @message:"^PHP Fatal").
+        :arg checkpoint_path: path to the file the checkpoint is stored in
+        :arg poll_interval: number of seconds to wait between polls (defaults to 60)
+        :arg fields: fields of the log messages to be returned (all by default)
+        :arg max_polls: stop after a given number of polls (defaults to None - follow forever)
+
+        :type query str
+        :type checkpoint_path str
+        :type poll_interval int
+        :type fields list or None
+        :type max_polls int or None
+        :rtype: collections.Iterator
+        """
+        since, seen_ids = self._load_checkpoint(checkpoint_path)
+
+        if since is None:
+            since = self._since
+
+        # timestamps are needed to find rows from the boundary second
+        if fields is not None and '@timestamp' not in fields:
+            fields = list(fields) + ['@timestamp']
+
+        polls = 0
+
+        while True:
+            to = int(time.time()) - self.SHORT_DELAY  # give logs some time to reach Logstash
+
+            if to > since:
+                self._set_time_range(since, to)
+
+                # the next time range will start at "to" (inclusive), remember rows we've already seen there
+                boundary = self.format_timestamp(to)[:19]  # ex. 2014-07-09T08:37:18
+                boundary_ids = []
+
+                for hit in self._scan(self._get_query_string_query(query), limit=None, fields=fields):
+                    if hit['_id'] in seen_ids:
+                        continue
+
+                    if hit['_source'].get('@timestamp', '').startswith(boundary):
+                        boundary_ids.append(hit['_id'])
+
+                    yield hit['_source']
+
+                self._save_checkpoint(checkpoint_path, to, boundary_ids)
+                since, seen_ids = to, set(boundary_ids)
+
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                return
+
+            time.sleep(poll_interval)
+
+    def _aggregate(self, body):
+        """
+        Run the aggregations request and return the response (cached one when available)
+
+        :type body dict
+        :rtype: dict
+        """
+        cache_key = self._get_cache_key(body)
+
+        if cache_key is not None:
+            res = self._cache.get(cache_key)
+
+            if res is not None:
+                self._logger.info("Using cached aggregations")
+                return res
+
+        res = self._es.search(
+            body=body,
+            index=self._index,
+            size=0,  # we don need any rows from the index, stats is all we need here
+            filter_path=['aggregations'],  # skip hits and shards metadata in the response
+        )
+
+        if cache_key is not None:
+            self._cache.set(cache_key, res)
+
+        return res
+
+    def multi_query(self, queries):
+        """
+        Run many queries at once and return their results in the same order
+
+        Every item is either a query string (up to 10 rows are returned), a dict with query_by_string() arguments
+        or a dict with get_aggregations() arguments:
+
+        source.multi_query([
+            '@message:"^PHP Fatal"',
+            {'query': '@message:"^PHP Warning"', 'limit': 100, 'fields': ['@timestamp', '@message']},
+            {'query': '"Http request"', 'group_by': '@context.caller.keyword', 'stats_field': '@context.requestTimeMS'},
+        ])
+
+        A list of rows (or a dict with aggregations) is returned for each item. All queries are sent in a single
+        _msearch request, except the ones with limit above MAX_RESULT_WINDOW that are scrolled separately.
+
+        https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-multi-search.html
+
+        :type queries list
+        :rtype: list
+        """
+        results, searches, scrolled = self._prepare_multi_query(queries)
+
+        for position, item in scrolled:
+            results[position] = self._search(self._get_query_string_query(item['query']), item['limit'],
+                                             item['sampling'], item['fields'], item['exclude_fields'])
+
+        if searches:
+            self._logger.info("Running {:d} queries in a single multi search request".format(len(searches)))
+
+            res = self._es.msearch(body=self._get_multi_search_body(searches), index=self._index)
+            self._parse_multi_search_response(res, searches, results)
+
+        return results
+
+        self._logger.info("Running {:d} queries in a single multi search request".format(len(searches)))
+
+        request = []
+        for _, _, body, _ in searches:
+            request.append({})  # header - indices are passed in the URL
+            request.append(body)
+
+        res = self._es.msearch(body=request, index=self._index)
+
+        for (position, is_aggregation, _, cache_key), response in zip(searches, res['responses']):
+            if 'error' in response:
+                raise KibanaError("Query #{:d} failed: {}".format(position, json.dumps(response['error'])))
+
+            if is_aggregation:
+                response = {'aggregations': response['aggregations']}
+
+                if cache_key is not None:
+                    self._cache.set(cache_key, response)
+
+                results[position] = self._parse_aggregations_response(response)
+            else:
+                results[position] = [hit['_source'] for hit in response['hits']['hits']]
+
+        return results
+
+    def get_aggregations(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), size=100):
+        """
+        Returns aggregations (rows count + percentile stats) for a given query
+
+        This is basically the same as the following pseudo-SQL query:
+        SELECT PERCENTILE(stats_field, 75) FROM query GROUP BY group_by LIMIT size
+
+        https://www.elastic.co/guide/en/elasticsearch/reference/5.5/search-aggregations-bucket-terms-aggregation.html
+        https://www.elastic.co/guide/en/elasticsearch/reference/5.5/search-aggregations-metrics-percentile-aggregation.html
+
+        Please note that group_by should be provided by a "keyword" field:
+
+        Fielddata is disabled on text fields by default. Set fielddata=true on [@context.caller] in order to load
+        fielddata in memory by uninverting the inverted index. Note that this can however use significant memory.\
+        Alternatively use a keyword field instead.
+
+        :type query str
+        :type group_by str
+        :type stats_field str or None
+        :type percents set
+        :type size int
+        :rtype: dict
+        """
+        body = self._get_aggregations_body(query, group_by, stats_field, percents, size)
+
+        self._logger.info("Getting aggregations for {} field when grouped by {}".format(group_by, stats_field))
+
+        return self._parse_aggregations_response(self._aggregate(body))
+
+    def iter_aggregations(self, query, group_by, stats_field, percents=(50, 95, 99, 99.9), page_size=100):
+        """
+        Paginated version of get_aggregations() for high-cardinality group_by fields
+
+        Yields pages (of up to page_size buckets) of aggregations in the same format as get_aggregations() does.
+        All terms are returned, page by page, without keeping them in Elasticsearch coordinating node's memory at once.
+
+        https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-aggregations-bucket-composite-aggregation.html
+
+        :type query str
+        :type group_by str
+        :type stats_field str or None
+        :type percents set
+        :type page_size int
+        :rtype: collections.Iterator
+        """
+        self._logger.info("Getting paginated aggregations for {} field when grouped by {}".
+                          format(stats_field, group_by))
+
+        after_key = None
+
+        while True:
+            body = self._get_composite_aggregations_body(query, group_by, stats_field, percents, page_size, after_key)
+
+            page, after_key = self._parse_composite_response(self._aggregate(body), page_size)
+
+            if page:
+                yield page
+
+            if after_key is None:
+                return
+
+    def get_histogram(self, query, interval, stats_field=None, group_by=None, percents=(50, 95, 99, 99.9), size=100):
+        """
+        Returns rows count (and optionally percentile stats) for a given query in time buckets
+
+        This is basically the same as the following pseudo-SQL query:
+        SELECT COUNT(*), PERCENTILE(stats_field, 75) FROM query GROUP BY time_bucket(interval)[, group_by]
+
+        https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-aggregations-bucket-datehistogram-aggregation.html
+
+        Results are ordered by time and keyed by UNIX timestamp of the beginning of each bucket:
+
+        {1494324000: {"count": 1042, "50.0": 1.0, ...}, ...}
+
+        or when group_by is provided:
+
+        {1494324000: {"Foo:getUrl": {"count": 1042, "50.0": 1.0, ...}, ...}, ...}
+
+        :arg interval: bucket size - either Elasticsearch time unit expression (ex. "5m", "1h") or number of seconds
+        :arg stats_field: field to calculate percentiles for
+        :arg group_by: "keyword" field to split every time bucket by (up to size terms are returned)
+
+        :type query str
+        :type interval str|int
+        :type stats_field str or None
+        :type group_by str or None
+        :type percents set
+        :type size int
+        :rtype: OrderedDict
+        """
+        body = self._get_histogram_body(query, interval, stats_field, group_by, percents, size)
+
+        self._logger.info("Getting {} histogram for {} query".format(interval, query))
+
+        return self._parse_histogram_response(self._aggregate(body))
@@ -0,0 +1,61 @@
+"""
+JSON serializer for Elasticsearch client that decodes responses with the fastest JSON library available
+
+orjson, ujson and simplejson are tried (in this order), stdlib json module is used when none of them is installed.
+"""
+import json
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+
+def _get_json_decoder():
+    """
+    Return the name and loads function of the fastest JSON library installed
+
+    :rtype: tuple
+    """
+    try:
+        import orjson
+        return 'orjson', orjson.loads
+    except ImportError:
+        pass
+
+    try:
+        import ujson
+        return 'ujson', ujson.loads
+    except ImportError:
+        pass
+
+    try:
+        import simplejson
+        return 'simplejson', simplejson.loads
+    except ImportError:
+        pass
+
+    return 'json', json.loads
+
+
+class FastJSONSerializer(JSONSerializer):
+    """
+    Decodes Elasticsearch responses using the fastest JSON library available
+
+    Requests are still encoded by the default serializer (it handles dates, UUIDs, decimals etc.).
+    """
+    def __init__(self, decoder=None):
+        """
+        :type decoder tuple or None
+
+        :arg decoder: (name, loads function) tuple to use instead of the fastest JSON library installed
+        """
+        self.decoder_name, self._loads = decoder or _get_json_decoder()
+
+    def loads(self, s):
+        try:
+            return self._loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+
+# used by all clients created by Kibana, unless a custom serializer is provided
+DEFAULT_SERIALIZER = FastJSONSerializer()
@@ -0,0 +1,4 @@
+import sys
+
+# asyncio tests use async/await syntax
+collect_ignore = ['test_async_kibana.py'] if sys.version_info < (3, 6) else []
@@ -0,0 +1,233 @@
+"""
+Set of unit tests for async_kibana.py
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+try:
+    from .. import async_kibana
+except (ImportError, AttributeError):  # elasticsearch-async uses asyncio.coroutine removed in Python 3.11
+    async_kibana = None
+
+
+class AsyncElasticsearchStub(object):
+    """
+    Serves scroll pages of {'slice': slice_id, 'id': n} documents (pages_count pages of batch size each per slice)
+    """
+    def __init__(self, **kwargs):
+        self.pages_count = 3
+        self.failing_slice = None
+        self.searches = []
+        self.scrolls = []
+        self.msearches = []
+
+    def _page(self, slice_id, page, size):
+        if page >= self.pages_count:
+            hits = []
+        else:
+            ids = range(page * size, (page + 1) * size)
+            hits = [{'_id': '{}-{}'.format(slice_id, i), '_source': {'slice': slice_id, 'id': i}} for i in ids]
+
+        return {'_scroll_id': '{}:{}:{}'.format(slice_id, page, size), 'hits': {'hits': hits}}
+
+    async def search(self, body, size, **kwargs):
+        self.searches.append(dict(kwargs, body=body, size=size))
+        slice_id = body['slice']['id'] if 'slice' in body else None
+        return self._page(slice_id, 0, size)
+
+    async def msearch(self, body, index):
+        self.msearches.append((body, index))
+        responses = []
+
+        for search in body[1::2]:
+            if search['size'] == 0:
+                responses.append({'hits': {'hits': []}, 'aggregations': {'group_by_agg': {'buckets': [
+                    {'key': 'foo', 'doc_count': 3, 'field_stats': {'values': {'50.0': 1.0}}}]}}})
+            else:
+                responses.append({'hits': {'hits': [{'_source': {'id': i}} for i in range(search['size'])]}})
+
+        return {'responses': responses}
+
+    async def scroll(self, scroll_id, scroll):
+        self.scrolls.append(scroll_id)
+        slice_id, page, size = scroll_id.split(':')
+        slice_id = None if slice_id == 'None' else int(slice_id)
+        await asyncio.sleep(0)  # let other slices run
+
+        if slice_id is not None and slice_id == self.failing_slice:
+            raise RuntimeError('scroll of slice {} failed'.format(slice_id))
+
+        return self._page(slice_id, int(page) + 1, int(size))
+
+
+@unittest.skipIf(async_kibana is None, 'elasticsearch-async is not installed or not supported')
+class AsyncKibanaTestClass(unittest.TestCase):
+    """
+    Unit tests for AsyncKibana class
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    @staticmethod
+    def get_instance(pages_count=3, failing_slice=None, **kwargs):
+        with mock.patch.object(async_kibana, 'AsyncElasticsearch', AsyncElasticsearchStub):
+            instance = async_kibana.AsyncKibana(**kwargs)
+
+        instance._es.pages_count = pages_count
+        instance._es.failing_slice = failing_slice
+        return instance
+
+    def assert_no_pending_tasks(self):
+        self.run_async(asyncio.sleep(0.01))  # let cancelled tasks finish
+        assert not asyncio.all_tasks(self.loop)
+
+    def test_scroll(self):
+        instance = self.get_instance(batch_size=2)
+
+        rows = self.run_async(instance.query_by_string('foo', limit=100))
+        assert rows == [{'slice': None, 'id': i} for i in range(6)]
+
+        search, = instance._es.searches
+        assert search['scroll'] == async_kibana.AsyncKibana.SCROLL_TIMEOUT
+        assert search['sort'] == ['_doc']
+        assert search['size'] == 2
+        assert search['index'] == instance._index
+        assert 'slice' not in search['body']
+
+        # the scroll is followed until an empty page is returned
+        assert instance._es.scrolls == ['None:0:2', 'None:1:2', 'None:2:2']
+
+    def test_limit(self):
+        instance = self.get_instance(batch_size=2)
+
+        assert self.run_async(instance.query_by_string('foo', limit=3)) == [{'slice': None, 'id': i} for i in range(3)]
+        assert instance._es.scrolls == ['None:0:2']  # the next page is not fetched
+
+        assert self.run_async(instance.query_by_string('foo', limit=0)) == []
+
+    def test_sliced_scan(self):
+        instance = self.get_instance(batch_size=2, scroll_slices=3)
+
+        rows = self.run_async(instance.query_by_string('foo', limit=100))
+        assert sorted((row['slice'], row['id']) for row in rows) == [(s, i) for s in range(3) for i in range(6)]
+
+        assert sorted(search['body']['slice']['id'] for search in instance._es.searches) == [0, 1, 2]
+        assert all(search['body']['slice']['max'] == 3 for search in instance._es.searches)
+        self.assert_no_pending_tasks()
+
+    def test_sliced_scan_limit(self):
+        instance = self.get_instance(batch_size=2, scroll_slices=3, pages_count=100)
+
+        assert len(self.run_async(instance.query_by_string('foo', limit=5))) == 5
+
+        # slices still running when the limit is reached are cancelled
+        scrolls = len(instance._es.scrolls)
+        self.assert_no_pending_tasks()
+        assert len(instance._es.scrolls) == scrolls
+
+    def test_sliced_scan_error(self):
+        instance = self.get_instance(batch_size=2, scroll_slices=3, pages_count=100, failing_slice=1)
+
+        with self.assertRaises(RuntimeError) as context:
+            self.run_async(instance.query_by_string('foo', limit=1000))
+
+        assert str(context.exception) == 'scroll of slice 1 failed'
+        self.assert_no_pending_tasks()
+
+    def test_early_exit(self):
+        instance = self.get_instance()
+        closed = []
+
+        async def scroll(body):
+            try:
+                for i in range(10):
+                    yield {'_source': {'id': i}}
+            finally:
+                closed.append(True)
+
+        instance._scroll = scroll
+
+        async def first_row():
+            rows = instance.iter_query_by_string('foo', limit=100)
+            row = await rows.__anext__()
+            await rows.aclose()
+            return row
+
+        assert self.run_async(first_row()) == {'id': 0}
+        assert closed == [True]
+
+        # hits are closed when the limit is reached as well
+        assert len(self.run_async(instance.query_by_string('foo', limit=2))) == 2
+        assert closed == [True, True]
+
+    def test_iter_columns(self):
+        instance = self.get_instance(batch_size=2)
+
+        async def collect():
+            return [batch async for batch in instance.iter_columns('foo', fields=['id'], limit=5)]
+
+        batches = self.run_async(collect())
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert batches[1]['id'].to_list() == [2, 3]
+
+    def test_follow(self):
+        instance = self.get_instance(batch_size=2)
+        now = int(time.time())
+        tmp_dir = tempfile.mkdtemp()
+
+        async def collect(checkpoint_path):
+            return [row async for row in instance.follow('foo', checkpoint_path, fields=['id'], max_polls=1)]
+
+        try:
+            checkpoint_path = os.path.join(tmp_dir, 'checkpoint.json')
+
+            with open(checkpoint_path, 'w') as fp:
+                json.dump({'to': now - 100, 'ids': ['None-0']}, fp)
+
+            rows = self.run_async(collect(checkpoint_path))
+
+            # "None-0" was already returned by the previous poll
+            assert [row['id'] for row in rows] == [1, 2, 3, 4, 5]
+
+            # time range starts where the previous one ended, @timestamp is fetched to find the boundary rows
+            assert instance._since == now - 100
+            assert instance._es.searches[0]['body']['_source']['includes'] == ['id', '@timestamp']
+
+            with open(checkpoint_path) as fp:
+                assert json.load(fp)['to'] == instance._to
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_multi_query(self):
+        instance = self.get_instance(batch_size=2)
+
+        res = self.run_async(instance.multi_query([
+            {'query': 'foo', 'limit': 2},
+            {'query': 'bar', 'group_by': '@context.caller.keyword', 'stats_field': '@context.requestTimeMS'},
+            {'query': 'baz', 'limit': async_kibana.AsyncKibana.MAX_RESULT_WINDOW + 1},
+        ]))
+
+        assert res == [
+            [{'id': 0}, {'id': 1}],
+            {'foo': {'count': 3, '50.0': 1.0}},
+            [{'slice': None, 'id': i} for i in range(6)],  # scrolled
+        ]
+
+        # a single request with header + body pairs, the scrolled query is not there
+        (body, index), = instance._es.msearches
+        assert index == instance._index
+        assert len(body) == 4
+        assert [search['size'] for search in body[1::2]] == [2, 0]
+        assert len(instance._es.searches) == 1
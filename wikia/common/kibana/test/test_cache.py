@@ -0,0 +1,68 @@
+"""
+Set of unit tests for cache.py
+"""
+import shutil
+import tempfile
+import time
+import unittest
+
+from ..cache import MemoryCache, FileCache
+
+
+class MemoryCacheTestClass(unittest.TestCase):
+    """
+    Unit tests for MemoryCache class
+    """
+    @staticmethod
+    def test_lru():
+        cache = MemoryCache(max_size=2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+
+        assert cache.get('foo') == 1  # foo is now the most recently used entry
+
+        cache.set('baz', 3)
+        assert len(cache) == 2
+        assert cache.get('bar') is None
+        assert cache.get('foo') == 1
+        assert cache.get('baz') == 3
+
+    @staticmethod
+    def test_ttl():
+        cache = MemoryCache(ttl=-1)
+        cache.set('foo', 1)
+
+        assert cache.get('foo') is None
+
+
+class FileCacheTestClass(unittest.TestCase):
+    """
+    Unit tests for FileCache class
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_set(self):
+        cache = FileCache(self.directory)
+        assert cache.get('foo') is None
+
+        cache.set('foo', {'aggregations': {'group_by_agg': {'buckets': []}}})
+        assert cache.get('foo') == {'aggregations': {'group_by_agg': {'buckets': []}}}
+
+        # entries are kept between instances
+        assert FileCache(self.directory).get('foo') is not None
+        assert FileCache(self.directory, ttl=-1).get('foo') is None
+
+    def test_max_size(self):
+        cache = FileCache(self.directory, max_size=2)
+
+        for key in ('foo', 'bar', 'baz'):
+            cache.set(key, key)
+            time.sleep(0.01)  # make modification times differ
+
+        assert cache.get('foo') is None
+        assert cache.get('bar') == 'bar'
+        assert cache.get('baz') == 'baz'
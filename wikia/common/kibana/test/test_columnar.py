@@ -0,0 +1,76 @@
+"""
+Set of unit tests for columnar.py
+"""
+import math
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ..columnar import ColumnBatch, DictionaryColumn, NumericColumn, MISSING_CODE, get_field
+
+
+class ColumnarTestClass(unittest.TestCase):
+    """
+    Unit tests for ColumnBatch class
+    """
+    @staticmethod
+    def test_get_field():
+        source = {'@fields': {'url': '/wiki/Foo'}, '@context.caller': 'Foo::bar'}
+
+        assert get_field(source, '@fields.url') == '/wiki/Foo'
+        assert get_field(source, '@context.caller') == 'Foo::bar'
+        assert get_field(source, '@fields.foo') is None
+        assert get_field(source, '@fields.url.foo') is None
+
+    @staticmethod
+    def test_batch():
+        batch = ColumnBatch(['time', 'caller', 'size', 'missing'])
+        batch.append({'time': 12, 'caller': 'foo', 'size': 1})
+        batch.append({'time': 15, 'caller': 'bar'})
+        batch.append({'time': 10, 'caller': 'foo', 'size': 2.5})
+
+        assert len(batch) == 3
+
+        assert isinstance(batch['time'], NumericColumn)
+        assert batch['time'].is_integer
+        assert batch['time'].to_list() == [12, 15, 10]
+
+        # a missing value upcasts integers to floats
+        assert not batch['size'].is_integer
+        assert batch['size'][0] == 1.0
+        assert math.isnan(batch['size'][1])
+
+        assert isinstance(batch['caller'], DictionaryColumn)
+        assert batch['caller'].dictionary == ['foo', 'bar']
+        assert batch['caller'].codes.tolist() == [0, 1, 0]
+
+        assert batch['missing'].codes.tolist() == [MISSING_CODE] * 3
+
+        assert batch.to_rows()[0] == {'time': 12, 'caller': 'foo', 'size': 1.0, 'missing': None}
+
+    @staticmethod
+    def test_mixed_types():
+        batch = ColumnBatch(['status'])
+        batch.append({'status': 200})
+        batch.append({})
+        batch.append({'status': 'error'})
+        batch.append({'status': {'code': 500}})
+
+        assert isinstance(batch['status'], DictionaryColumn)
+        assert batch['status'].to_list() == ['200', None, 'error', '{"code": 500}']
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_to_numpy(self):
+        batch = ColumnBatch(['time', 'size', 'caller'])
+        batch.append({'time': 12, 'size': 1.5, 'caller': 'foo'})
+        batch.append({'time': 15, 'caller': 'bar'})
+
+        # dtypes follow the platform size of C long
+        assert batch['time'].to_numpy().tolist() == [12, 15]
+        assert batch['time'].to_numpy().dtype.itemsize == batch['time'].values.itemsize
+        assert batch['size'].to_numpy()[0] == 1.5
+        assert math.isnan(batch['size'].to_numpy()[1])
+        assert batch['caller'].to_numpy().tolist() == [0, 1]
@@ -1,10 +1,15 @@
 """
 Set of unit tests for kibana.py
 """
+import json
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
-from ..kibana import Kibana
+from ..cache import MemoryCache
+from ..kibana import Kibana, KibanaError
 
 
 class KibanaTestClass(unittest.TestCase):
@@ -44,6 +49,22 @@ class KibanaTestClass(unittest.TestCase):
         for case in cases:
             self.check_time(**case)
 
+    @staticmethod
+    def test_time_to_without_since():
+        to = int(time.time()) - 2 * Kibana.DAY
+        instance = Kibana(period=3600, to=to)
+
+        # the period ends at "to", not now
+        assert instance._since == to - 3600
+        assert instance.get_to_timestamp() == to
+        assert instance._index == ','.join(Kibana.get_indices('logstash-other', to - 3600, to))
+
+    def test_invalid_time_range(self):
+        now = int(time.time())
+
+        # an empty index list would query all indices of the cluster
+        self.assertRaises(KibanaError, Kibana, since=now - 600, to=now - 3 * Kibana.DAY)
+
     @staticmethod
     def check_time(since, expected_since, expected_to, period):
         instance = Kibana(since, period)
@@ -59,3 +80,342 @@ class KibanaTestClass(unittest.TestCase):
         assert res['range']['@timestamp'] is not None
         assert res['range']['@timestamp']['from'] == '1970-01-02T10:17:37.000Z'
         assert res['range']['@timestamp']['to'] is not None
+
+    @staticmethod
+    def test_iter_query_by_string():
+        instance = Kibana()
+        fetched = []
+
+        def scan(query, limit, *args):
+            for i in range(limit):
+                fetched.append(i)
+                yield {'_source': {'id': i}, 'query': query}
+
+        instance._scan = scan
+
+        rows = instance.iter_query_by_string('@message:"^PHP Fatal"', limit=5)
+        assert fetched == []  # nothing is fetched until the caller asks for rows
+
+        assert next(rows) == {'id': 0}
+        assert fetched == [0]
+
+        assert list(rows) == [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}]
+        assert instance.query_by_string('foo', limit=2) == [{'id': 0}, {'id': 1}]
+
+    @staticmethod
+    def test_sliced_scan():
+        instance = Kibana(scroll_slices=3, batch_size=2)
+
+        def scroll(body):
+            slice_id = body['slice']['id']
+            assert body['slice']['max'] == 3
+
+            for i in range(10):
+                yield {'_source': {'slice': slice_id, 'id': i}}
+
+        instance._scroll = scroll
+
+        rows = instance.query_by_string('foo', limit=100)
+        assert len(rows) == 30
+        assert sorted((row['slice'], row['id']) for row in rows) == [(s, i) for s in range(3) for i in range(10)]
+
+        # the limit still holds
+        assert len(instance.query_by_string('foo', limit=7)) == 7
+
+    @staticmethod
+    def test_get_search_body_fields():
+        instance = Kibana()
+        query = Kibana._get_query_string_query('foo')
+
+        assert '_source' not in instance._get_search_body(query)
+
+        body = instance._get_search_body(query, fields=['@timestamp', '@fields.url'])
+        assert body['_source'] == {'includes': ['@timestamp', '@fields.url'], 'excludes': []}
+
+        body = instance._get_search_body(query, exclude_fields=('@context.backtrace',))
+        assert body['_source'] == {'includes': [], 'excludes': ['@context.backtrace']}
+
+    @staticmethod
+    def test_get_indices():
+        # 2014-08-19 12:19:55 - 2014-08-19 12:34:55 (a single day)
+        assert Kibana.get_indices('logstash-other', 1408450795, 1408451695) == ['logstash-other-2014.08.19']
+
+        # 2014-08-18 23:59:59 - 2014-08-19 00:00:00 (partial days on both edges)
+        assert Kibana.get_indices('logstash-other', 1408406399, 1408406400) == [
+            'logstash-other-2014.08.18',
+            'logstash-other-2014.08.19',
+        ]
+
+        # three days long backfill
+        assert Kibana.get_indices('logstash-other', 1408450795, 1408450795 + 3 * Kibana.DAY) == [
+            'logstash-other-2014.08.19',
+            'logstash-other-2014.08.20',
+            'logstash-other-2014.08.21',
+            'logstash-other-2014.08.22',
+        ]
+
+    @staticmethod
+    def test_get_histogram_body():
+        instance = Kibana(123456, 60)
+
+        body = instance._get_histogram_body('foo', 300)
+        histogram = body['aggregations']['histogram_agg']
+        assert histogram['date_histogram']['interval'] == '300s'
+        assert histogram['date_histogram']['extended_bounds']['min'] == 123457000
+        assert 'aggregations' not in histogram
+
+        body = instance._get_histogram_body('foo', '1h', stats_field='@context.requestTimeMS')
+        assert body['aggregations']['histogram_agg']['aggregations']['field_stats']['percentiles']['field'] == \
+            '@context.requestTimeMS'
+
+        body = instance._get_histogram_body('foo', '1h', stats_field='@context.requestTimeMS',
+                                            group_by='@context.caller.keyword', size=5)
+        terms = body['aggregations']['histogram_agg']['aggregations']['group_by_agg']
+        assert terms['terms'] == {'field': '@context.caller.keyword', 'size': 5}
+        assert 'field_stats' in terms['aggregations']
+
+    @staticmethod
+    def test_parse_histogram_response():
+        instance = Kibana()
+
+        res = instance._parse_histogram_response({'aggregations': {'histogram_agg': {'buckets': [
+            {'key': 1494324000000, 'doc_count': 2, 'field_stats': {'values': {'50.0': 1.0}}},
+            {'key': 1494324060000, 'doc_count': 0, 'field_stats': {'values': {'50.0': None}}},
+        ]}}})
+        assert list(res.items()) == [
+            (1494324000, {'count': 2, '50.0': 1.0}),
+            (1494324060, {'count': 0, '50.0': None}),
+        ]
+
+        res = instance._parse_histogram_response({'aggregations': {'histogram_agg': {'buckets': [
+            {'key': 1494324000000, 'doc_count': 3, 'group_by_agg': {'buckets': [
+                {'key': 'foo', 'doc_count': 2},
+                {'key': 'bar', 'doc_count': 1},
+            ]}},
+        ]}}})
+        assert res == {1494324000: {'foo': {'count': 2}, 'bar': {'count': 1}}}
+
+    @staticmethod
+    def test_iter_aggregations():
+        instance = Kibana()
+        requests = []
+
+        pages = [
+            [{'key': {'group_by': 'foo'}, 'doc_count': 3, 'field_stats': {'values': {'50.0': 1.0}}},
+             {'key': {'group_by': 'bar'}, 'doc_count': 2, 'field_stats': {'values': {'50.0': 2.0}}}],
+            [{'key': {'group_by': 'baz'}, 'doc_count': 1, 'field_stats': {'values': {'50.0': 3.0}}}],
+        ]
+
+        class ElasticsearchMock(object):
+            @staticmethod
+            def search(body, **kwargs):
+                requests.append(body['aggregations']['group_by_agg']['composite'])
+                buckets = pages[len(requests) - 1]
+                return {'aggregations': {'group_by_agg': {'buckets': buckets, 'after_key': buckets[-1]['key']}}}
+
+        instance._es = ElasticsearchMock()
+
+        res = list(instance.iter_aggregations('foo', '@context.caller.keyword', '@context.requestTimeMS', page_size=2))
+        assert res == [
+            {'foo': {'count': 3, '50.0': 1.0}, 'bar': {'count': 2, '50.0': 2.0}},
+            {'baz': {'count': 1, '50.0': 3.0}},
+        ]
+
+        assert 'after' not in requests[0]
+        assert requests[1]['after'] == {'group_by': 'bar'}
+
+    def test_multi_query(self):
+        instance = Kibana()
+        requests = []
+
+        class ElasticsearchMock(object):
+            @staticmethod
+            def msearch(body, index):
+                requests.append(body)
+                return {'responses': [
+                    {'hits': {'hits': [{'_source': {'id': 1}}, {'_source': {'id': 2}}]}},
+                    {'hits': {'hits': []}, 'aggregations': {'group_by_agg': {'buckets': [
+                        {'key': 'foo', 'doc_count': 3, 'field_stats': {'values': {'50.0': 1.0}}}]}}},
+                    {'hits': {'hits': [{'_source': {'id': 3}}]}},
+                ]}
+
+        def search(query, limit, sampling, fields, exclude_fields):
+            return [{'scrolled': query['query_string']['query'], 'limit': limit}]
+
+        instance._es = ElasticsearchMock()
+        instance._search = search
+
+        res = instance.multi_query([
+            'foo',
+            {'query': 'bar', 'group_by': '@context.caller.keyword', 'stats_field': '@context.requestTimeMS'},
+            {'query': 'baz', 'limit': Kibana.MAX_RESULT_WINDOW + 1},
+            {'query': 'qux', 'limit': 5, 'fields': ['id']},
+        ])
+
+        assert res == [
+            [{'id': 1}, {'id': 2}],
+            {'foo': {'count': 3, '50.0': 1.0}},
+            [{'scrolled': 'baz', 'limit': Kibana.MAX_RESULT_WINDOW + 1}],
+            [{'id': 3}],
+        ]
+
+        # a single request with header + body pairs, the scrolled query is not there
+        assert len(requests) == 1
+        assert len(requests[0]) == 6
+        assert requests[0][1]['size'] == 10
+        assert requests[0][3]['size'] == 0
+        assert requests[0][5]['size'] == 5
+        assert requests[0][5]['_source']['includes'] == ['id']
+
+        # errors of a single query are reported
+        ElasticsearchMock.msearch = staticmethod(lambda body, index: {'responses': [
+            {'error': {'type': 'query_shard_exception'}, 'status': 400}]})
+
+        with self.assertRaises(KibanaError):
+            instance.multi_query(['foo:'])
+
+    @staticmethod
+    def test_multi_query_without_stats_field():
+        instance = Kibana()
+        requests = []
+
+        class ElasticsearchMock(object):
+            @staticmethod
+            def msearch(body, index):
+                requests.append(body)
+                return {'responses': [
+                    {'hits': {'hits': []}, 'aggregations': {'group_by_agg': {'buckets': [
+                        {'key': 'foo', 'doc_count': 3}]}}},
+                ]}
+
+        instance._es = ElasticsearchMock()
+
+        res = instance.multi_query([{'query': 'bar', 'group_by': '@context.caller.keyword'}])
+        assert res == [{'foo': {'count': 3}}]
+
+        # no percentiles sub-aggregation with "field": null
+        assert 'aggregations' not in requests[0][1]['aggregations']['group_by_agg']
+        assert 'aggregations' not in \
+            instance._get_composite_aggregations_body('bar', 'foo', None)['aggregations']['group_by_agg']
+
+    @staticmethod
+    def test_count_and_exists():
+        instance = Kibana(since=1494320400, to=1494324000)
+        requests = []
+
+        class ElasticsearchMock(object):
+            @staticmethod
+            def count(body, index):
+                requests.append(('count', body, index, {}))
+                return {'count': 42}
+
+            @staticmethod
+            def search(body, index, **kwargs):
+                requests.append(('search', body, index, kwargs))
+                return {'hits': {'total': 0}}
+
+        instance._es = ElasticsearchMock()
+
+        assert instance.count('@message:"^PHP Fatal"') == 42
+        assert instance.exists('@message:"^PHP Fatal"') is False
+
+        for _, body, index, _ in requests:
+            assert index == instance._index
+            assert body['query']['bool']['must'][0] == {'query_string': {'query': '@message:"^PHP Fatal"'}}
+            assert body['query']['bool']['must'][1] == instance._get_timestamp_filer()
+
+        assert requests[1][3]['size'] == 0
+        assert requests[1][3]['terminate_after'] == 1
+
+    @staticmethod
+    def test_get_sampling_query():
+        query = Kibana(sampling_seed=123)._get_sampling_query(25)
+        assert query['function_score']['random_score']['seed'] == 123
+        assert query['function_score']['min_score'] == 0.75
+
+        query = Kibana(sampling_method=Kibana.SAMPLING_SCRIPT)._get_sampling_query(25)
+        assert query['script']['script']['params']['sampling'] == 25
+
+        try:
+            Kibana(sampling_method='foo')
+            assert False, 'KibanaError should be raised'
+        except KibanaError:
+            pass
+
+    @staticmethod
+    def test_shared_client():
+        assert Kibana()._es is Kibana(period=60)._es
+        assert Kibana()._es is not Kibana(read_timeout=30)._es
+        assert Kibana()._es is not Kibana(pool_size=20)._es
+        assert Kibana()._es is not Kibana(shared_client=False)._es
+
+    @staticmethod
+    def test_follow():
+        instance = Kibana()
+        now = int(time.time())
+        to = now - Kibana.SHORT_DELAY
+        windows = []
+
+        def scan(query, limit, fields=None):
+            windows.append((instance._since, instance._to))
+            yield {'_id': 'a', '_source': {'id': 'a', '@timestamp': Kibana.format_timestamp(now - 100)}}
+            yield {'_id': 'b', '_source': {'id': 'b', '@timestamp': Kibana.format_timestamp(now - 50)}}
+            yield {'_id': 'c', '_source': {'id': 'c', '@timestamp': Kibana.format_timestamp(to)}}
+
+        instance._scan = scan
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint_path = os.path.join(tmp_dir, 'checkpoint.json')
+
+            with open(checkpoint_path, 'w') as fp:
+                json.dump({'to': now - 100, 'ids': ['a']}, fp)
+
+            rows = list(instance.follow('foo', checkpoint_path, max_polls=1))
+
+            # "a" was already returned by the previous poll
+            assert [row['id'] for row in rows] == ['b', 'c']
+
+            # time range starts where the previous one ended
+            assert windows[0][0] == now - 100
+            assert windows[0][1] in (to, to + 1)
+
+            with open(checkpoint_path) as fp:
+                checkpoint = json.load(fp)
+
+            assert checkpoint['to'] == windows[0][1]
+            assert checkpoint['ids'] in (['c'], [])  # "c" is from the boundary second (if time has not passed)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @staticmethod
+    def test_get_cache_key():
+        now = int(time.time())
+
+        # no cache
+        assert Kibana(since=now - 3600, to=now - 600)._get_cache_key({}) is None
+
+        # time range is still open
+        assert Kibana(since=now - 3600, cache=MemoryCache())._get_cache_key({}) is None
+
+        instance = Kibana(since=now - 3600, to=now - 600, cache=MemoryCache())
+        assert instance.get_to_timestamp() == now - 600
+        assert instance._get_cache_key({'foo': 1, 'bar': 2}) == instance._get_cache_key({'bar': 2, 'foo': 1})
+        assert instance._get_cache_key({'foo': 1}) != instance._get_cache_key({'foo': 2})
+
+    @staticmethod
+    def test_iter_columns():
+        instance = Kibana()
+
+        def scan(query, limit, sampling, fields, *args):
+            assert fields == ['id', 'url']
+
+            for i in range(limit):
+                yield {'_source': {'id': i, 'url': '/wiki/{}'.format(i % 2)}}
+
+        instance._scan = scan
+
+        batches = list(instance.iter_columns('foo', fields=['id', 'url'], limit=5, batch_size=2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert batches[1]['id'].to_list() == [2, 3]
+        assert batches[1]['url'].dictionary == ['/wiki/0', '/wiki/1']
@@ -0,0 +1,44 @@
+"""
+Set of unit tests for serializer.py
+"""
+import json
+import unittest
+
+from elasticsearch.exceptions import SerializationError
+
+from ..kibana import Kibana
+from ..serializer import FastJSONSerializer, DEFAULT_SERIALIZER
+
+
+class FastJSONSerializerTestClass(unittest.TestCase):
+    """
+    Unit tests for FastJSONSerializer class
+    """
+    @staticmethod
+    def test_loads():
+        serializer = FastJSONSerializer()
+        page = {'_scroll_id': 'foo', 'hits': {'hits': [{'_source': {'@message': u'Za\u017c\xf3\u0142\u0107', 'n': 1}}]}}
+
+        assert serializer.loads(json.dumps(page)) == page
+        assert serializer.loads(serializer.dumps(page)) == page
+        assert serializer.mimetype == 'application/json'
+
+    def test_loads_error(self):
+        with self.assertRaises(SerializationError):
+            FastJSONSerializer().loads('{"foo": ')
+
+    @staticmethod
+    def test_decoder():
+        serializer = FastJSONSerializer(decoder=('json', json.loads))
+
+        assert serializer.decoder_name == 'json'
+        assert serializer.loads('{"foo": [1, 2.5, null]}') == {'foo': [1, 2.5, None]}
+
+    @staticmethod
+    def test_client():
+        assert Kibana()._es.transport.serializer is DEFAULT_SERIALIZER
+        assert Kibana(shared_client=False)._es.transport.serializer is DEFAULT_SERIALIZER
+
+        serializer = FastJSONSerializer(decoder=('json', json.loads))
+        assert Kibana(serializer=serializer)._es.transport.serializer is serializer
+        assert Kibana(serializer=serializer)._es is not Kibana()._es
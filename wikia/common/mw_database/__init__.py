@@ -1,2 +1,13 @@
-from .load_balancer import LoadBalancer
-from .sqlliterals import SqlLiteral, SqlCondition
\ No newline at end of file
+import sys
+
+from .sqlliterals import SqlLiteral, SqlCondition
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # LoadBalancer (and MySQLdb) is imported on first use, AsyncLoadBalancer does not need a blocking driver
+        if name == 'LoadBalancer':
+            from .load_balancer import LoadBalancer
+            return LoadBalancer
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+else:
+    from .load_balancer import LoadBalancer
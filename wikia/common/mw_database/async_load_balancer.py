@@ -0,0 +1,365 @@
+"""
+Asyncio version of LoadBalancer and Connection (Python 3.6+)
+
+Requires aiomysql package (install wikia-common-mw-database[async])
+@see https://github.com/aio-libs/aiomysql
+"""
+import asyncio
+import logging
+import time
+
+import aiomysql
+
+from .result import QueryResult
+from .dbconfig import DatabaseConfig
+from .instrumentation import HealthReportingHook, run_query_hooks
+from .query_builder import SqlBuilderMixin
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnection(SqlBuilderMixin):
+    """
+    Provides the same API as Connection, but query methods are coroutines (stream methods are async generators)
+
+    SQL statements are built by SqlBuilderMixin, hence select(), insert(), update() and delete() return coroutines.
+    """
+    def __init__(self, raw_connection, connection_info=None, release_fn=None, health_reporter=None, query_hooks=None):
+        """
+        :param raw_connection: aiomysql connection
+        :param connection_info: Connection details the connection was made with
+        :param release_fn: Coroutine function the raw connection is released with on close() (default: close it)
+        :param health_reporter: Object query times and errors are reported to (see DatabaseConfig.report_success)
+        :param query_hooks: QueryHook instances called before and after every query (see instrumentation module)
+        """
+        self.raw_connection = raw_connection
+        self.connection_info = connection_info
+        self.release_fn = release_fn
+        self.health_reporter = health_reporter
+        self.query_hooks = list(query_hooks or ())
+        if health_reporter is not None:
+            self.query_hooks.append(HealthReportingHook(health_reporter, aiomysql.OperationalError))
+
+    async def close(self):
+        if self.raw_connection is None:
+            return
+
+        if self.release_fn is None:
+            self.raw_connection.close()
+        else:
+            await self.release_fn(self.raw_connection)
+
+        self.raw_connection = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def escape_string(self, s):
+        return self.raw_connection.escape_string(s)
+
+    async def query(self, query, args=None):
+        logger.debug('SQL Query: {}'.format(query))
+        if self.query_hooks:
+            run_query_hooks(self.query_hooks, 'before_query', self, query, args)
+        time_started = time.time()
+
+        try:
+            async with self.raw_connection.cursor() as cursor:
+                await cursor.execute(query, args)
+                affected = cursor.rowcount
+                rows = await cursor.fetchall()
+                description = cursor.description
+        except Exception as e:
+            if self.query_hooks:
+                run_query_hooks(self.query_hooks, 'after_query', self, query, args, time.time() - time_started,
+                                None, e)
+            raise
+
+        if self.query_hooks:
+            run_query_hooks(self.query_hooks, 'after_query', self, query, args, time.time() - time_started,
+                            affected, None)
+
+        return QueryResult(query, (), {'args': args}, affected, description, rows)
+
+    async def stream(self, query, args=None, batch_size=1000, batches=False):
+        """ See Connection.stream() - this is an async generator """
+        logger.debug('SQL Query (streamed): {}'.format(query))
+
+        if self.query_hooks:
+            run_query_hooks(self.query_hooks, 'before_query', self, query, args)
+        # time rows are processed by the caller is not measured (see Connection.stream())
+        elapsed = 0.0
+        time_started = time.time()
+        num_rows = 0
+        error = None
+
+        try:
+            async with self.raw_connection.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(query, args)
+
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    elapsed += time.time() - time_started
+                    time_started = None
+                    if not rows:
+                        break
+                    num_rows += len(rows)
+
+                    if batches:
+                        yield list(rows)
+                    else:
+                        for row in rows:
+                            yield row
+                    time_started = time.time()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if time_started is not None:  # execute() or fetchmany() failed
+                elapsed += time.time() - time_started
+            if self.query_hooks:
+                run_query_hooks(self.query_hooks, 'after_query', self, query, args, elapsed,
+                                num_rows if error is None else None, error)
+
+    async def query_as_dicts(self, *args, **kwargs):
+        return (await self.query(*args, **kwargs)).rows_as_dicts
+
+    async def select_as_dicts(self, table, what, where):
+        return (await self.select(table, what, where)).rows_as_dicts
+
+    async def select_field(self, table, what, where):
+        res = await self.select(table, what, where)
+        if res.num_rows != 1:
+            raise ValueError("Query in select_field() returned {} rows instead of 1".format(res.num_rows))
+        return res.rows[0][0]
+
+    async def insert_many(self, table, rows, chunk_size=1000, ignore_errors=False, on_duplicate_update=None,
+                          max_packet_size=None):
+        """ See SqlBuilderMixin.insert_many() """
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        if max_packet_size is None:
+            max_packet_size = await self.max_allowed_packet()
+
+        affected = 0
+        for sql, sql_data in self.insert_many_sql(table, rows, chunk_size, ignore_errors, on_duplicate_update,
+                                                  max_packet_size):
+            affected += (await self.query(sql, args=sql_data)).affected
+            await self.commit()
+
+        return affected
+
+    async def max_allowed_packet(self):
+        if getattr(self, '_max_allowed_packet', None) is None:
+            self._max_allowed_packet = int((await self.query('SELECT @@max_allowed_packet')).rows[0][0])
+        return self._max_allowed_packet
+
+    def last_insert_id(self):
+        return self.raw_connection.insert_id()
+
+    async def commit(self):
+        await self.raw_connection.commit()
+
+
+class _ConnectContext(object):
+    """
+    Result of AsyncLoadBalancer.connect() - can be either awaited or used as an async context manager
+    """
+    def __init__(self, coro):
+        self._coro = coro
+        self._conn = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._conn = await self._coro
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._conn.close()
+
+
+class AsyncLoadBalancer(object):
+    """
+    Asyncio version of LoadBalancer - connects to the same databases using the same DB.yml config
+
+    Connections are pooled per host and user (the database is switched when the connection is taken from the pool).
+    Up to cluster_concurrency connections to a single cluster are used at once, other connect() calls wait
+    for them to be closed. Many wikis can be queried concurrently:
+
+    async def count_pages(load_balancer, dbname):
+        async with load_balancer.connect(dbname) as conn:
+            return await conn.select_field('page', 'COUNT(*)', None)
+
+    counts = await asyncio.gather(*[count_pages(load_balancer, dbname) for dbname in dbnames])
+    """
+    CONNECTION_CLASS = AsyncConnection
+
+    def __init__(self, db_config_file=None, service_name=None, override_consul_dc=None, cluster_concurrency=20,
+                 host_selector=None, query_hooks=None):
+        """
+        :param db_config_file: Path to DB.yml (default: use WIKIA_DB_YML environment variable)
+        :param service_name: Service name (used for using service-specific username and password)
+        :param override_consul_dc: Consul datacenter to connect to
+        :param cluster_concurrency: Maximum number of connections to a single cluster used at once (default: 20)
+        :param host_selector: Picks the replica to connect to (default: RandomHostSelector)
+        :param query_hooks: QueryHook instances called before and after every query (see instrumentation module)
+        """
+        self.db_config_file = db_config_file
+        self.db_config = DatabaseConfig(self.db_config_file,
+                                        self._blocking_connect, self._replace_consul_dc, service_name,
+                                        host_selector=host_selector)
+        self.override_consul_dc = override_consul_dc
+        self.cluster_concurrency = cluster_concurrency
+        self.query_hooks = list(query_hooks or ())
+        self._pools = {}
+        self._semaphores = {}
+
+    def _blocking_connect(self, conn_details):
+        # wiki clusters are looked up in wikicities before DatabaseConfig is asked for connection details
+        raise RuntimeError('AsyncLoadBalancer can not make blocking connections')
+
+    def _replace_consul_dc(self, conn_details):
+        if self.override_consul_dc is not None:
+            conn_details = conn_details._replace(
+                hostname=conn_details.hostname.replace(
+                    '.service.consul',
+                    '.service.{}.consul'.format(self.override_consul_dc)))
+        return conn_details
+
+    async def get_connection_details(self, dbname, master=False, wc_master=False, external=False, **kwargs):
+        if external:
+            return self.db_config.get_external_connection_details(dbname, master=master, **kwargs)
+
+        if dbname not in self.db_config.mw_config['sectionsByDB'] and \
+                (wc_master or dbname not in self.db_config.cluster_cache):
+            await self._fetch_wiki_cluster(dbname, wc_master)
+
+        # the cluster is cached now
+        return self.db_config.get_connection_details(dbname, master=master, **kwargs)
+
+    async def _fetch_wiki_cluster(self, dbname, master):
+        async with self.connect('wikicities', master=master) as conn:
+            res = await conn.query('SELECT city_cluster FROM city_list WHERE city_dbname = %(db_name)s',
+                                   args={'db_name': dbname})
+
+        if res.num_rows == 0:
+            raise RuntimeError('Could not find wiki database: {}'.format(dbname))
+
+        self.db_config.cluster_cache.set(dbname, res.rows[0][0])
+
+    async def preload_wiki_clusters(self, dbnames=None, master=False):
+        """ See DatabaseConfig.preload_wiki_clusters() """
+        if dbnames is not None:
+            dbnames = list(dbnames)
+            if not dbnames:
+                return 0
+
+        sql, args = self.db_config.wiki_clusters_query(dbnames)
+
+        async with self.connect('wikicities', master=master) as conn:
+            res = await conn.query(sql, args=args)
+
+        return self.db_config.cache_wiki_clusters(res.rows)
+
+    def connect(self, *args, **kwargs):
+        """
+        Connect to the database - the result can be awaited or used as an async context manager:
+
+        async with load_balancer.connect('muppet') as conn:
+            await conn.query('SELECT 1')
+
+        :rtype: AsyncConnection
+        """
+        return _ConnectContext(self._connect(*args, **kwargs))
+
+    async def _connect(self, *args, **kwargs):
+        conn_details = await self.get_connection_details(*args, **kwargs)
+
+        semaphore = self._get_semaphore(conn_details.cluster)
+        await semaphore.acquire()
+
+        try:
+            pool = await self._get_pool(conn_details)
+            raw_connection = await pool.acquire()
+        except aiomysql.OperationalError:
+            semaphore.release()
+            self.db_config.report_error(conn_details.hostname)
+            raise
+        except BaseException:
+            semaphore.release()
+            raise
+
+        try:
+            await raw_connection.select_db(conn_details.dbname)
+        except BaseException:
+            pool.release(raw_connection)
+            semaphore.release()
+            raise
+
+        async def release(connection):
+            try:
+                await connection.rollback()  # pool closes connections with transactions open
+            finally:
+                pool.release(connection)
+                semaphore.release()
+
+        return self.CONNECTION_CLASS(raw_connection, conn_details, release_fn=release,
+                                     health_reporter=self.db_config, query_hooks=self.query_hooks)
+
+    def _get_semaphore(self, cluster):
+        if cluster not in self._semaphores:
+            self._semaphores[cluster] = asyncio.Semaphore(self.cluster_concurrency)
+        return self._semaphores[cluster]
+
+    async def _get_pool(self, conn_details):
+        key = (conn_details.hostname, conn_details.username)
+
+        if key not in self._pools:
+            self._pools[key] = asyncio.ensure_future(aiomysql.create_pool(
+                minsize=0,
+                maxsize=self.cluster_concurrency,
+                host=conn_details.hostname,
+                user=conn_details.username,
+                password=conn_details.password,
+                db=conn_details.dbname,
+            ))
+
+        try:
+            return await self._pools[key]
+        except Exception:
+            self._pools.pop(key, None)  # try again on the next connect()
+            raise
+
+    async def close(self):
+        """
+        Close all pooled connections
+        """
+        pools, self._pools = self._pools, {}
+
+        for pool in pools.values():
+            try:
+                pool = await pool
+            except Exception:
+                continue
+            pool.close()
+            await pool.wait_closed()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def connect_wikicities(self, *args, **kwargs):
+        return self.connect('wikicities', *args, **kwargs)
+
+    def connect_external(self, *args, **kwargs):
+        return self.connect(*args, external=True, **kwargs)
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    def __init__(self, max_size=100000, ttl=3600):
+        """
+        Thread-safe in-process LRU cache with entries expiring after a given time
+
+        :param max_size: Maximum number of entries kept, least recently used ones are evicted first (default: 100000)
+        :param ttl: Number of seconds entries are kept for (default: 1 hour)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[0] < time.time():
+                return default
+
+            # mark as the most recently used one
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def __len__(self):
+        return len(self._entries)
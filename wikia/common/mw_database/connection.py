@@ -1,22 +1,42 @@
 from contextlib import closing
 import logging
 import random
+import re
 import MySQLdb
+import MySQLdb.cursors
 import time
-import six
 import sys
 
+from .instrumentation import HealthReportingHook, run_query_hooks
 from .query_builder import SqlBuilderMixin
+from .result import QueryResult
 import wikia.common.logger
 
 
 logger = logging.getLogger(__name__)
 
+# queries setting session state that is not reset when the connection is released to the pool (named locks,
+# temporary tables, session and user variables)
+SESSION_STATE_REGEX = re.compile(r'\bGET_LOCK\s*\(|\bTEMPORARY\s+TABLE\b|^\s*SET\b|@\w+\s*:=', re.IGNORECASE)
+
 
 class Connection(SqlBuilderMixin):
-    def __init__(self, raw_connection, connection_info=None):
+    def __init__(self, raw_connection, connection_info=None, pool=None, health_reporter=None, query_hooks=None):
+        """
+        :param raw_connection: MySQLdb connection
+        :param connection_info: Connection details the connection was made with
+        :param pool: ConnectionPool the raw connection is released to on close() (default: close it)
+        :param health_reporter: Object query times and errors are reported to (see DatabaseConfig.report_success)
+        :param query_hooks: QueryHook instances called before and after every query (see instrumentation module)
+        """
         self.raw_connection = raw_connection
         self.connection_info = connection_info
+        self.pool = pool
+        self.health_reporter = health_reporter
+        self.query_hooks = list(query_hooks or ())
+        if health_reporter is not None:
+            self.query_hooks.append(HealthReportingHook(health_reporter, MySQLdb.OperationalError))
+        self.session_changed = False  # the connection is closed instead of being released to the pool
         self.__logger = None
 
     @property
@@ -26,7 +46,24 @@ class Connection(SqlBuilderMixin):
         return self.__logger
 
     def close(self):
-        self.raw_connection.close()
+        if self.pool is None:
+            self.raw_connection.close()
+        elif self.raw_connection is not None:
+            if self.session_changed:
+                self.raw_connection.close()  # session state can not be reset, do not let anyone else see it
+            else:
+                self.pool.release(self.raw_connection)
+            self.raw_connection = None  # the connection can be used by someone else now
+
+    def _check_session_state(self, query):
+        if self.pool is not None and not self.session_changed and SESSION_STATE_REGEX.search(query):
+            self.session_changed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def escape_string(self, s):
         return self.raw_connection.escape_string(s)
@@ -36,17 +73,32 @@ class Connection(SqlBuilderMixin):
 
     def query(self, query, *args, **kwargs):
         log_text = 'SQL Query: {}'.format(query)
-        if 'args' in kwargs and len(kwargs['args']) > 0:
+        if kwargs.get('args'):
             if "\n" in query:
                 log_text += "\n"
             log_text += ' (with args: {})'.format(kwargs['args'])
         logger.debug(log_text)
+        query_args = kwargs['args'] if 'args' in kwargs else (args[0] if args else None)
+        self._check_session_state(query)
+
         def do_exec_query(cursor):
+            if self.query_hooks:
+                run_query_hooks(self.query_hooks, 'before_query', self, query, query_args)
             time_started = time.time()
 
-            returned = cursor.execute(query, *args, **kwargs)
-            affected = cursor.rowcount
-            rows = cursor.fetchall()
+            try:
+                returned = cursor.execute(query, *args, **kwargs)
+                affected = cursor.rowcount
+                rows = cursor.fetchall()
+            except Exception as e:
+                if self.query_hooks:
+                    run_query_hooks(self.query_hooks, 'after_query', self, query, query_args,
+                                    time.time() - time_started, None, e)
+                raise
+
+            if self.query_hooks:
+                run_query_hooks(self.query_hooks, 'after_query', self, query, query_args, time.time() - time_started,
+                                affected, None)
 
             # log SQL - sampled at 1%
             if random.random() < 0.01:
@@ -74,6 +126,59 @@ class Connection(SqlBuilderMixin):
             with closing(self.cursor()) as cursor:
                 return do_exec_query(cursor)
 
+    def stream(self, query, args=None, batch_size=1000, batches=False):
+        """
+        Execute query and yield rows as they are received from the server (the result is not buffered in memory)
+
+        Unbuffered cursor (SSCursor) is used. Make sure to consume all rows or close the generator - no other query
+        can be run on this connection until then. Closing the generator early makes MySQLdb read (and discard) the
+        rest of the result, consider adding LIMIT to the query.
+
+        :param query: SQL query text
+        :param args: SQL query values
+        :param batch_size: Number of rows fetched from the server at once (default: 1000)
+        :param batches: Yield lists of up to batch_size rows instead of single rows (default: False)
+        """
+        logger.debug('SQL Query (streamed): {}'.format(query))
+        self._check_session_state(query)
+
+        if self.query_hooks:
+            run_query_hooks(self.query_hooks, 'before_query', self, query, args)
+        # only the time spent on executing the query and fetching rows is measured, not the time rows
+        # are processed by the caller (a slow consumer would make the host look slow)
+        elapsed = 0.0
+        time_started = time.time()
+        num_rows = 0
+        error = None
+
+        try:
+            with closing(self.raw_connection.cursor(MySQLdb.cursors.SSCursor)) as cursor:
+                cursor.execute(query, args)
+
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    elapsed += time.time() - time_started
+                    time_started = None
+                    if not rows:
+                        break
+                    num_rows += len(rows)
+
+                    if batches:
+                        yield list(rows)
+                    else:
+                        for row in rows:
+                            yield row
+                    time_started = time.time()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if time_started is not None:  # execute() or fetchmany() failed
+                elapsed += time.time() - time_started
+            if self.query_hooks:
+                run_query_hooks(self.query_hooks, 'after_query', self, query, args, elapsed,
+                                num_rows if error is None else None, error)
+
     def query_as_dicts(self, *args, **kwargs):
         return self.query(*args, **kwargs).rows_as_dicts
 
@@ -115,28 +220,3 @@ class Connection(SqlBuilderMixin):
 
     def commit(self):
         self.raw_connection.commit()
-
-
-class QueryResult(object):
-    def __init__(self, query, query_args, query_kwargs, affected, description, rows):
-        self.query = query
-        self.query_args = query_args
-        self.query_kwargs = query_kwargs
-        self.affected = affected
-        self.description = description
-        self.rows = rows
-        self.num_rows = len(rows)
-
-    @property
-    def rows_as_dicts(self):
-        column_names = [column[0] for column in self.description]
-        column_range = range(len(column_names))
-        res = []
-        for row in self.rows:
-            res.append({column_names[i]: row[i] if not isinstance(row[i], (str, six.text_type)) else str(row[i])
-                        for i in column_range
-                        })
-        return res
-
-    def __iter__(self):
-        return iter(self.rows)
@@ -1,19 +1,32 @@
 import collections
+import logging
 import os
-import random
 import yaml
 
+from .cache import TTLCache
+from .host_selector import RandomHostSelector
+
+
+logger = logging.getLogger(__name__)
+
 
 ConnectionDetails = collections.namedtuple('ConnectionDetails', ['hostname', 'username', 'password', 'dbname', 'cluster', 'master'])
 
+# marks wikis missing in the cluster cache (city_cluster can be NULL)
+_NOT_CACHED = object()
+
 
 class DatabaseConfig(object):
-    def __init__(self, config_file, connect_fn, conn_details_postprocess_fn, service_name=None):
+    def __init__(self, config_file, connect_fn, conn_details_postprocess_fn, service_name=None,
+                 cluster_cache_size=100000, cluster_cache_ttl=3600, host_selector=None):
         """
         :param config_file: Path to DB.yml (default: use WIKIA_DB_YML environment variable)
         :param connect_fn: Callback function to make actual connection from connection details
         :param conn_details_postprocess_fn: Callback function to postprocess connection details
         :param service_name: Service name (used for using service-specific username and password)
+        :param cluster_cache_size: Number of wikis whose clusters are cached (default: 100000)
+        :param cluster_cache_ttl: Number of seconds wiki clusters are cached for (default: 1 hour, 0 - no caching)
+        :param host_selector: Picks the replica to connect to (default: RandomHostSelector)
         """
         if config_file is None:
             config_file = os.environ['WIKIA_DB_YML']
@@ -28,6 +41,9 @@ class DatabaseConfig(object):
         self.connect_fn = connect_fn
         self.conn_details_postprocess_fn = conn_details_postprocess_fn
         self.service_name = service_name
+        self.cluster_cache = TTLCache(max_size=cluster_cache_size, ttl=cluster_cache_ttl)
+        self.host_selector = host_selector or RandomHostSelector()
+        self._hostnames = {}  # postprocessed hostname -> hostname from the config
 
     def get_connection_details(self, dbname, master=False, wc_master=False, override_db_name=None, username=None,
                                password=None):
@@ -77,7 +93,65 @@ class DatabaseConfig(object):
         return conn_details
 
     def postprocess_connection_details(self, conn_details):
-        return self.conn_details_postprocess_fn(conn_details)
+        postprocessed = self.conn_details_postprocess_fn(conn_details)
+        self._hostnames[postprocessed.hostname] = conn_details.hostname
+        return postprocessed
+
+    def report_success(self, hostname, elapsed):
+        """
+        Report the query time to the host selector
+
+        :param hostname: Host the query was run on (as in ConnectionDetails)
+        :param elapsed: Query time (in seconds)
+        """
+        self.host_selector.report_success(self._hostnames.get(hostname, hostname), elapsed)
+
+    def report_error(self, hostname):
+        """
+        Report the failed connection or query to the host selector
+
+        :param hostname: Host the connection or query failed on (as in ConnectionDetails)
+        """
+        self.host_selector.report_error(self._hostnames.get(hostname, hostname))
+
+    def check_replication_lag(self, cluster, external=False):
+        """
+        Check replication lag of all replicas of the cluster and report it to the host selector
+
+        :param cluster: Cluster name
+        :param external: Is it an external cluster?
+        :return: Dictionary with replication lag (in seconds, None when replication is not running) of each replica
+                 (replicas that could not be checked are skipped)
+        """
+        cluster_data = self.external_cluster_config[cluster] if external else self.cluster_config[cluster]
+        lags = {}
+
+        for hostname in cluster_data[1:]:
+            hostname, dbname, username, password = self.expand_credentials(hostname, None, cluster)
+            conn_details = self.postprocess_connection_details(ConnectionDetails(
+                hostname=hostname, username=username, password=password, dbname=dbname, cluster=cluster, master=False))
+
+            # failed checks are not reported as host errors - e.g. the user may lack REPLICATION CLIENT privilege
+            # on healthy replicas
+            try:
+                conn = self.connect_fn(conn_details)
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute('SHOW SLAVE STATUS')
+                    row = cursor.fetchone()
+                    columns = [column[0] for column in cursor.description or []]
+                    cursor.close()
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.warning('Could not check replication lag of {}: {}'.format(hostname, e))
+                continue
+
+            lag = dict(zip(columns, row)).get('Seconds_Behind_Master') if row is not None else None
+            lags[hostname] = lag
+            self.host_selector.report_lag(hostname, lag)
+
+        return lags
 
     def cluster_from_dbname(self, dbname, master):
         if dbname in self.mw_config['sectionsByDB']:
@@ -87,9 +161,21 @@ class DatabaseConfig(object):
         return cluster
 
     def cluster_from_wiki_dbname(self, dbname, master):
+        """
+        Return the cluster wiki database lives on (cached, the cache is bypassed when asking wikicities master)
+
+        :param dbname: Wiki database name
+        :param master: Ask wikicities master?
+        :return: Cluster name
+        """
         if dbname == 'wikicities':  # sanity check
             raise RuntimeError('Invalid db config - no wikicities entry')
 
+        if not master:
+            cluster = self.cluster_cache.get(dbname, _NOT_CACHED)
+            if cluster is not _NOT_CACHED:
+                return cluster
+
         wikicities_details = self.get_connection_details('wikicities', master=master)
         connect_fn = self.connect_fn
         wikicities_conn = connect_fn(wikicities_details)
@@ -104,8 +190,76 @@ class DatabaseConfig(object):
         cursor.close()
         wikicities_conn.close()
 
+        self.cluster_cache.set(dbname, cluster)
+
         return cluster
 
+    def preload_wiki_clusters(self, dbnames=None, master=False):
+        """
+        Fetch clusters of many wikis from wikicities with a single query and cache them
+
+        :param dbnames: Wiki database names (default: all wikis - make sure cluster_cache_size is big enough)
+        :param master: Ask wikicities master? (default: False)
+        :return: Number of wikis found
+        """
+        return self.cache_wiki_clusters(self.fetch_wiki_clusters(dbnames, master))
+
+    def fetch_wiki_clusters(self, dbnames=None, master=False):
+        """
+        Fetch clusters of many wikis from wikicities with a single query (they are not cached)
+
+        :param dbnames: Wiki database names (default: all wikis)
+        :param master: Ask wikicities master? (default: False)
+        :return: (wiki database name, cluster) rows
+        """
+        if dbnames is not None:
+            dbnames = list(dbnames)
+            if not dbnames:
+                return ()
+
+        sql, args = self.wiki_clusters_query(dbnames)
+
+        wikicities_details = self.get_connection_details('wikicities', master=master)
+        wikicities_conn = self.connect_fn(wikicities_details)
+        cursor = wikicities_conn.cursor()
+        cursor.execute(sql, args=args)
+        rows = cursor.fetchall()
+        cursor.close()
+        wikicities_conn.close()
+
+        return rows
+
+    @staticmethod
+    def wiki_clusters_query(dbnames=None):
+        """
+        Build the query for clusters of given (or all) wikis
+
+        :return: SQL query text and values
+        """
+        sql = 'SELECT city_dbname, city_cluster FROM city_list'
+        args = None
+
+        if dbnames is not None:
+            args = {'db_name_{}'.format(i): dbname for i, dbname in enumerate(dbnames)}
+            sql += ' WHERE city_dbname IN ({})'.format(
+                ', '.join('%(db_name_{})s'.format(i) for i in range(len(dbnames))))
+
+        return sql, args
+
+    def cache_wiki_clusters(self, rows):
+        """
+        :param rows: (wiki database name, cluster) rows from city_list
+        :return: Number of rows
+        """
+        if len(rows) > self.cluster_cache.max_size:
+            logger.warning('Preloaded clusters of {} wikis, only {} of them are cached'.format(
+                len(rows), self.cluster_cache.max_size))
+
+        for dbname, cluster in rows:
+            self.cluster_cache.set(dbname, cluster)
+
+        return len(rows)
+
     def host_from_external_cluster_and_type(self, cluster, master=False):
         return self.host_from_cluster_data_and_type(self.external_cluster_config[cluster], master=master)
 
@@ -114,10 +268,8 @@ class DatabaseConfig(object):
 
     def host_from_cluster_data_and_type(self, cluster_data, master=False):
         if master is True or len(cluster_data) <= 1:
-            index = 0
-        else:
-            index = random.randrange(1, len(cluster_data))
-        return cluster_data[index]
+            return cluster_data[0]
+        return self.host_selector.select(cluster_data[1:])
 
     def expand_credentials(self, hostname, dbname, cluster=None, username=None, password=None):
         if username is None or password is None:
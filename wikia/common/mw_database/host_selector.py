@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class RandomHostSelector(object):
+    """
+    Picks a random replica (the default)
+    """
+    def select(self, hosts):
+        """
+        :param hosts: Replicas of the cluster
+        :return: Hostname
+        """
+        return random.choice(hosts)
+
+    def report_success(self, hostname, elapsed):
+        """
+        :param hostname: Host the query was run on
+        :param elapsed: Query time (in seconds)
+        """
+        pass
+
+    def report_error(self, hostname):
+        """
+        :param hostname: Host the connection or query failed on
+        """
+        pass
+
+    def report_lag(self, hostname, lag):
+        """
+        :param hostname: Replica
+        :param lag: Replication lag (in seconds, None when replication is not running)
+        """
+        pass
+
+
+class HostHealth(object):
+    def __init__(self):
+        self.latency = None  # exponentially weighted moving average of query time
+        self.errors = 0  # consecutive errors
+        self.open_until = 0  # circuit breaker - do not use the host until then
+        self.lag = 0
+        self.lag_checked_at = None
+
+
+class HealthAwareHostSelector(RandomHostSelector):
+    WEIGHTED = 'weighted'
+    LEAST_LATENCY = 'least_latency'
+
+    def __init__(self, strategy=WEIGHTED, decay=0.2, failure_threshold=3, cooldown=30, max_lag=30, lag_ttl=60):
+        """
+        Picks replicas based on their recent query latency, errors and replication lag
+
+        Hosts that failed failure_threshold times in a row are not used for cooldown seconds (after that a single
+        connection is let through - the host is used again when it succeeds). Replicas lagging more than max_lag
+        seconds are skipped. When no replica is healthy a random one is picked.
+
+        :param strategy: WEIGHTED - random replica with the probability inversely proportional to its latency,
+                         LEAST_LATENCY - the replica with the lowest latency (default: WEIGHTED)
+        :param decay: Weight of the latest query time in the latency moving average (default: 0.2)
+        :param failure_threshold: Number of consecutive errors that make the host skipped (default: 3)
+        :param cooldown: Number of seconds failing host is skipped for (default: 30)
+        :param max_lag: Maximum replication lag (in seconds) of the replica to be used (default: 30)
+        :param lag_ttl: Number of seconds reported replication lag is taken into account for (default: 60)
+        """
+        if strategy not in (self.WEIGHTED, self.LEAST_LATENCY):
+            raise ValueError('Unknown host selection strategy: {}'.format(strategy))
+
+        self.strategy = strategy
+        self.decay = decay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_lag = max_lag
+        self.lag_ttl = lag_ttl
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _get_health(self, hostname):
+        if hostname not in self._health:
+            self._health[hostname] = HostHealth()
+        return self._health[hostname]
+
+    def _is_available(self, health, now):
+        if health.open_until > now:
+            return False
+
+        lag_is_known = health.lag_checked_at is not None and health.lag_checked_at + self.lag_ttl >= now
+        if lag_is_known and (health.lag is None or health.lag > self.max_lag):
+            return False
+
+        return True
+
+    def select(self, hosts):
+        now = time.time()
+
+        with self._lock:
+            available = []
+            for hostname in hosts:
+                health = self._get_health(hostname)
+                if self._is_available(health, now):
+                    available.append((hostname, health.latency))
+
+            if not available:
+                logger.warning('No healthy hosts out of {}, picking a random one'.format(', '.join(hosts)))
+                return random.choice(hosts)
+
+            # let a single connection through to the host with the circuit half-open
+            for hostname, _ in available:
+                health = self._health[hostname]
+                if health.errors >= self.failure_threshold:
+                    health.open_until = now + self.cooldown
+                    return hostname
+
+        known = [latency for _, latency in available if latency is not None]
+        if not known:
+            return random.choice(available)[0]
+
+        # hosts with no queries measured yet are treated as the fastest ones, so that they get traffic
+        fastest = min(known)
+        latencies = [(hostname, latency if latency is not None else fastest) for hostname, latency in available]
+
+        if self.strategy == self.LEAST_LATENCY:
+            return min(latencies, key=lambda host_latency: host_latency[1])[0]
+
+        weights = [1.0 / max(latency, 1e-6) for _, latency in latencies]
+        point = random.uniform(0, sum(weights))
+        for (hostname, _), weight in zip(latencies, weights):
+            point -= weight
+            if point <= 0:
+                return hostname
+        return latencies[-1][0]
+
+    def report_success(self, hostname, elapsed):
+        with self._lock:
+            health = self._get_health(hostname)
+            health.errors = 0
+            health.open_until = 0
+
+            if health.latency is None:
+                health.latency = elapsed
+            else:
+                health.latency = self.decay * elapsed + (1 - self.decay) * health.latency
+
+    def report_error(self, hostname):
+        with self._lock:
+            health = self._get_health(hostname)
+            health.errors += 1
+
+            if health.errors >= self.failure_threshold:
+                logger.warning('{} failed {} times in a row, skipping it for {} seconds'.format(
+                    hostname, health.errors, self.cooldown))
+                health.open_until = time.time() + self.cooldown
+
+    def report_lag(self, hostname, lag):
+        with self._lock:
+            health = self._get_health(hostname)
+            health.lag = lag
+            health.lag_checked_at = time.time()
@@ -0,0 +1,231 @@
+import bisect
+import logging
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryHook(object):
+    """
+    Base class of query hooks - they are called by connections before and after every query
+
+    Exceptions raised by hooks are logged and ignored.
+    """
+    def before_query(self, connection, query, args):
+        """
+        :param connection: Connection the query is run on
+        :param query: SQL query text
+        :param args: SQL query values
+        """
+        pass
+
+    def after_query(self, connection, query, args, elapsed, num_rows=None, error=None):
+        """
+        :param connection: Connection the query was run on
+        :param query: SQL query text
+        :param args: SQL query values
+        :param elapsed: Query time (in seconds), for streamed queries the time spent on executing them and fetching
+                        rows (the time rows are processed by the caller is not included)
+        :param num_rows: Number of returned (or affected) rows, None when the query failed
+        :param error: Exception raised by the query (None when it succeeded)
+        """
+        pass
+
+
+def run_query_hooks(hooks, method, *args):
+    """
+    Call the method of all hooks, exceptions raised by them are logged and ignored
+    """
+    for hook in hooks:
+        try:
+            getattr(hook, method)(*args)
+        except Exception:
+            logger.exception('Query hook {} failed'.format(hook))
+
+
+class HealthReportingHook(QueryHook):
+    def __init__(self, health_reporter, errors):
+        """
+        Reports query times and errors of the connection host (see DatabaseConfig.report_success)
+
+        :param health_reporter: Object query times and errors are reported to
+        :param errors: Exception classes that make the host reported as failing (e.g. MySQLdb.OperationalError)
+        """
+        self.health_reporter = health_reporter
+        self.errors = errors
+
+    def after_query(self, connection, query, args, elapsed, num_rows=None, error=None):
+        if connection.connection_info is None:
+            return
+
+        if error is None:
+            self.health_reporter.report_success(connection.connection_info.hostname, elapsed)
+        elif isinstance(error, self.errors):
+            self.health_reporter.report_error(connection.connection_info.hostname)
+
+
+class QueryStats(object):
+    """
+    Statistics of a single normalized query
+    """
+    def __init__(self, query, buckets):
+        self.query = query
+        self.buckets = buckets
+        self.histogram = [0] * (len(buckets) + 1)  # the last one counts queries slower than all buckets
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed, num_rows, error):
+        self.count += 1
+        self.histogram[bisect.bisect_left(self.buckets, elapsed)] += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if error is not None:
+            self.errors += 1
+        if num_rows is not None:
+            self.rows += num_rows
+
+    def percentile(self, percent):
+        """
+        Return the upper bound of query time (in seconds) of the given percent of queries (based on the histogram)
+        """
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in zip(self.buckets, self.histogram):
+            seen += count
+            if seen >= threshold:
+                return min(bucket, self.max_time)
+        return self.max_time
+
+    def as_dict(self):
+        return {
+            'query': self.query,
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'time_total': self.total_time,
+            'time_max': self.max_time,
+            'time_p50': self.percentile(50),
+            'time_p95': self.percentile(95),
+            'time_p99': self.percentile(99),
+        }
+
+
+class QueryStatsAggregator(QueryHook):
+    # upper bounds of query time histogram buckets (in seconds)
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    # queries not tracked because of max_queries are counted as this one
+    OTHER_QUERIES = '<other>'
+
+    NORMALIZE_REGEXES = (
+        (re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\""), '?'),  # string literals
+        (re.compile(r'%\([^)]+\)[sd]|%[sd]'), '?'),  # placeholders
+        (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # numbers
+        (re.compile(r'\(\?(?:\s*,\s*\?)*\)(?:\s*,\s*\(\?(?:\s*,\s*\?)*\))+'), '(?), ...'),  # multi-row VALUES
+        (re.compile(r'\bIN\s*\(\?(?:\s*,\s*\?)*\)', re.IGNORECASE), 'IN (...)'),
+        (re.compile(r'\s+'), ' '),
+    )
+
+    def __init__(self, sink=None, flush_interval=60, buckets=DEFAULT_BUCKETS, max_queries=1000):
+        """
+        Keeps query time histograms, row and error counts per normalized query (values replaced by "?")
+        and flushes them to the sink periodically
+
+        Stats are flushed after the query that comes when flush_interval elapses (there's no background thread),
+        call flush() to flush them on demand (e.g. when the script ends).
+
+        :param sink: logging.Logger (default: logger of this module), PerfMonitoring (a point is pushed
+                     per query) or a callable taking a list of QueryStats
+        :param flush_interval: Number of seconds stats are collected for (default: 60, None - flush manually)
+        :param buckets: Upper bounds of query time histogram buckets (in seconds)
+        :param max_queries: Maximum number of distinct normalized queries tracked (default: 1000)
+        """
+        if sink is None:
+            sink = logger
+        if not isinstance(sink, logging.Logger) and not hasattr(sink, 'push') and not callable(sink):
+            raise ValueError('Unsupported query stats sink: {}'.format(sink))
+
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.buckets = tuple(sorted(buckets))
+        self.max_queries = max_queries
+        self._stats = {}
+        self._normalized = {}
+        self._flush_at = time.time() + flush_interval if flush_interval is not None else None
+        self._lock = threading.Lock()
+
+    def normalize(self, query):
+        """
+        Return the query with values replaced by "?" (results are cached)
+        """
+        normalized = self._normalized.get(query)
+        if normalized is None:
+            normalized = query
+            for regex, replacement in self.NORMALIZE_REGEXES:
+                normalized = regex.sub(replacement, normalized)
+            normalized = normalized.strip()
+
+            if len(self._normalized) >= 10 * self.max_queries:
+                self._normalized.clear()
+            self._normalized[query] = normalized
+        return normalized
+
+    def after_query(self, connection, query, args, elapsed, num_rows=None, error=None):
+        normalized = self.normalize(query)
+
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                if len(self._stats) >= self.max_queries:
+                    normalized = self.OTHER_QUERIES
+                stats = self._stats.get(normalized)
+                if stats is None:
+                    stats = self._stats[normalized] = QueryStats(normalized, self.buckets)
+            stats.add(elapsed, num_rows, error)
+
+            flush = self._flush_at is not None and time.time() >= self._flush_at
+
+        if flush:
+            self.flush()
+
+    def get_stats(self):
+        """
+        Return stats collected since the last flush (sorted by the total query time)
+
+        :rtype: list[QueryStats]
+        """
+        with self._lock:
+            stats = list(self._stats.values())
+        return sorted(stats, key=lambda query_stats: query_stats.total_time, reverse=True)
+
+    def flush(self):
+        """
+        Send collected stats to the sink and start collecting them from scratch
+        """
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            if self.flush_interval is not None:
+                self._flush_at = time.time() + self.flush_interval
+
+        if not stats:
+            return
+
+        stats = sorted(stats.values(), key=lambda query_stats: query_stats.total_time, reverse=True)
+
+        if isinstance(self.sink, logging.Logger):
+            for query_stats in stats:
+                self.sink.info('SQL stats {}'.format(query_stats.query), extra=query_stats.as_dict())
+        elif hasattr(self.sink, 'push'):
+            for query_stats in stats:
+                for name, value in query_stats.as_dict().items():
+                    self.sink.set(name, value)
+                self.sink.push()
+        else:
+            self.sink(stats)
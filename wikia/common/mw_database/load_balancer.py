@@ -1,18 +1,39 @@
+import collections
+import threading
+
 import MySQLdb
+from six.moves import queue
 
 from .dbconfig import ConnectionDetails
 from .connection import Connection
-from .dbconfig import DatabaseConfig
+from .dbconfig import DatabaseConfig, _NOT_CACHED
+from .pool import ConnectionPool
 
 
 class LoadBalancer(object):
     CONNECTION_CLASS = Connection
 
-    def __init__(self, db_config_file=None, service_name=None, override_consul_dc=None):
+    def __init__(self, db_config_file=None, service_name=None, override_consul_dc=None, pool_size=10,
+                 pool_idle_timeout=300, host_selector=None, query_hooks=None):
+        """
+        :param db_config_file: Path to DB.yml (default: use WIKIA_DB_YML environment variable)
+        :param service_name: Service name (used for using service-specific username and password)
+        :param override_consul_dc: Consul datacenter to connect to
+        :param pool_size: Number of idle connections kept per host, user and database (default: 10, 0 - no pooling)
+        :param pool_idle_timeout: Pooled connections idle for longer than that (in seconds) are closed (default: 300)
+        :param host_selector: Picks the replica to connect to (default: RandomHostSelector)
+        :param query_hooks: QueryHook instances called before and after every query (see instrumentation module)
+        """
         self.db_config_file = db_config_file
         self.db_config = DatabaseConfig(self.db_config_file,
-                                        self._raw_connect, self._replace_consul_dc, service_name)
+                                        self._raw_connect, self._replace_consul_dc, service_name,
+                                        host_selector=host_selector)
         self.override_consul_dc = override_consul_dc
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.query_hooks = list(query_hooks or ())
+        self._pools = {}
+        self._pools_lock = threading.Lock()
 
     def get_connection_details(self, *args, **kwargs):
         external = kwargs.pop('external', False)
@@ -24,8 +45,57 @@ class LoadBalancer(object):
         return conn_details
 
     def connect(self, *args, **kwargs):
+        """
+        Connect to the database, the connection is taken from the pool when pooling is enabled
+
+        Call close() on the returned connection (or use it as a context manager) to release it back to the pool:
+
+        with load_balancer.connect('muppet') as conn:
+            conn.query('SELECT 1')
+
+        :rtype: Connection
+        """
         conn_details = self.get_connection_details(*args, **kwargs)
-        return self._create_connection(self._raw_connect(conn_details), conn_details)
+        pool = self._get_pool(conn_details) if self.pool_size > 0 else None
+
+        try:
+            raw_connection = pool.acquire() if pool is not None else self._raw_connect(conn_details)
+        except MySQLdb.OperationalError:
+            self.db_config.report_error(conn_details.hostname)
+            raise
+
+        return self._create_connection(raw_connection, conn_details, pool=pool, health_reporter=self.db_config,
+                                       query_hooks=self.query_hooks)
+
+    def _get_pool(self, conn_details):
+        """
+        Return the pool of connections for a given host, user and database (create it when needed)
+
+        :rtype: ConnectionPool
+        """
+        key = (conn_details.hostname, conn_details.username, conn_details.dbname)
+
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(self._raw_connect, conn_details, max_size=self.pool_size,
+                                                  idle_timeout=self.pool_idle_timeout)
+            return self._pools[key]
+
+    def check_replication_lag(self, *args, **kwargs):
+        """
+        Check replication lag of cluster replicas, see DatabaseConfig.check_replication_lag()
+        """
+        return self.db_config.check_replication_lag(*args, **kwargs)
+
+    def close(self):
+        """
+        Close all idle pooled connections
+        """
+        with self._pools_lock:
+            pools = list(self._pools.values())
+
+        for pool in pools:
+            pool.close()
 
     def _replace_consul_dc(self, conn_details):
         if self.override_consul_dc is not None:
@@ -39,13 +109,142 @@ class LoadBalancer(object):
         return self.CONNECTION_CLASS(*args, **kwargs)
 
     def _raw_connect(self, conn_details):
+        kwargs = {}
+        if conn_details.dbname is not None:  # no database is selected e.g. when checking replication lag
+            kwargs['db'] = conn_details.dbname
+
         raw_connection = MySQLdb.connect(
-            conn_details.hostname,
-            conn_details.username,
-            conn_details.password,
-            conn_details.dbname)
+            host=conn_details.hostname,
+            user=conn_details.username,
+            passwd=conn_details.password,
+            **kwargs)
         return raw_connection
 
+    def preload_wiki_clusters(self, *args, **kwargs):
+        """
+        Cache clusters of many wikis at once, see DatabaseConfig.preload_wiki_clusters()
+        """
+        return self.db_config.preload_wiki_clusters(*args, **kwargs)
+
+    def map_query(self, dbnames, sql, args=None, workers=4, master=False):
+        """
+        Run the query on many wikis and yield (dbname, QueryResult) tuples as results come
+
+        Wikis are grouped by cluster and clusters are queried in parallel by worker threads. Each thread uses
+        a single connection for all wikis of the cluster and switches the database before every query.
+        The exception is yielded instead of QueryResult for wikis the query failed on:
+
+        for dbname, result in load_balancer.map_query(dbnames, 'SELECT COUNT(*) FROM page'):
+            if isinstance(result, Exception):
+                ...
+
+        :param dbnames: Wiki database names
+        :param sql: SQL query text
+        :param args: SQL query values
+        :param workers: Number of clusters queried at once (default: 4)
+        :param master: Connect to cluster masters? (default: False)
+        """
+        # validated here, as the generator would not run until the first result is requested
+        if workers < 1:
+            raise ValueError('map_query requires at least one worker, got {}'.format(workers))
+
+        return self._map_query(list(dbnames), sql, args, workers, master)
+
+    def _map_query(self, dbnames, sql, args, workers, master):
+        results = queue.Queue()
+        stop = threading.Event()
+
+        # look up clusters of all wikis with a single query - they are kept locally, as the batch may not fit
+        # in the cluster cache (or its entries may expire before they are used)
+        wiki_clusters = dict(self.db_config.mw_config['sectionsByDB'])
+        cluster_cache = self.db_config.cluster_cache
+
+        missing = []
+        for dbname in dbnames:
+            if dbname not in wiki_clusters:
+                cluster = cluster_cache.get(dbname, _NOT_CACHED)
+                if cluster is _NOT_CACHED:
+                    missing.append(dbname)
+                else:
+                    wiki_clusters[dbname] = cluster
+
+        if missing:
+            rows = self.db_config.fetch_wiki_clusters(missing)
+            self.db_config.cache_wiki_clusters(rows)
+            wiki_clusters.update(rows)
+
+        clusters = collections.OrderedDict()
+        for dbname in dbnames:
+            if dbname not in wiki_clusters:
+                results.put((dbname, RuntimeError('Could not find wiki database: {}'.format(dbname))))
+                continue
+            clusters.setdefault(wiki_clusters[dbname], []).append(dbname)
+
+        tasks = queue.Queue()
+        for cluster_dbnames in clusters.values():
+            tasks.put(cluster_dbnames)
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    cluster_dbnames = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                self._map_query_on_cluster(cluster_dbnames, sql, args, master, results, stop)
+
+        threads = []
+        for i in range(min(workers, len(clusters))):
+            thread = threading.Thread(target=worker, name='map-query-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for _ in range(len(dbnames)):  # every wiki is reported exactly once
+                yield results.get()
+
+            # the last results are reported before workers release their connections, wait for them
+            for thread in threads:
+                thread.join()
+        finally:
+            stop.set()
+
+    def _map_query_on_cluster(self, dbnames, sql, args, master, results, stop):
+        conn = None
+
+        try:
+            for dbname in dbnames:
+                if stop.is_set():
+                    return
+
+                try:
+                    if conn is None:
+                        conn = self.connect(dbname, master=master)
+                    conn.raw_connection.select_db(dbname)
+                    result = conn.query(sql, args=args)
+                except Exception as e:
+                    result = e
+                    if conn is not None and isinstance(e, MySQLdb.OperationalError):
+                        # the connection may be broken - make a new one for the next wiki
+                        self._close_switched_connection(conn, broken=True)
+                        conn = None
+
+                results.put((dbname, result))
+        finally:
+            if conn is not None:
+                self._close_switched_connection(conn)
+
+    @staticmethod
+    def _close_switched_connection(conn, broken=False):
+        # the pool switches the connection back to the database it was made for
+        if broken:
+            conn.pool = None  # do not return the connection to the pool
+
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
     def connect_wikicities(self, *args, **kwargs):
         return self.connect('wikicities', *args, **kwargs)
 
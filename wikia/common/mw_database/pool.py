@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    def __init__(self, connect_fn, conn_details, max_size=10, idle_timeout=300):
+        """
+        Thread-safe pool of raw MySQL connections to a single database on a single host
+
+        Connections are never shared - each one is used by a single caller between acquire() and release().
+        There is no limit on the number of connections checked out at once, max_size limits the number
+        of idle connections kept open for later use.
+
+        The pool is fork-safe: idle connections inherited by a forked process are dropped (without being closed,
+        as they're still used by the parent process) and the child makes its own connections.
+
+        :param connect_fn: Callback function to make actual connection from connection details
+        :param conn_details: Connection details new connections are made with
+        :param max_size: Maximum number of idle connections kept in the pool (default: 10)
+        :param idle_timeout: Connections idle for longer than that (in seconds) are closed (default: 300)
+        """
+        self.connect_fn = connect_fn
+        self.conn_details = conn_details
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (raw connection, released at), the most recently released one is the last
+        self._lock = threading.Lock()
+        self._pid = os.getpid()  # process the idle connections were made by
+        self._inherited = []  # idle connections of the parent process, never used nor closed
+
+    def acquire(self):
+        """
+        Return a warm connection from the pool (a new one is made when there are no idle connections left)
+
+        Idle connections are checked with ping before being returned, dead ones are closed.
+
+        :return: Raw MySQL connection
+        """
+        while True:
+            with self._lock:
+                self._check_pid()
+                if not self._idle:
+                    break
+                raw_connection, released_at = self._idle.pop()
+
+            if released_at + self.idle_timeout < time.time():
+                self._close(raw_connection)
+                continue
+
+            try:
+                raw_connection.ping()
+            except Exception:
+                logger.debug('Discarding dead connection to {}'.format(self.conn_details.hostname))
+                self._close(raw_connection)
+                continue
+
+            return raw_connection
+
+        return self.connect_fn(self.conn_details)
+
+    def release(self, raw_connection):
+        """
+        Return the connection to the pool (it's closed when the pool is full or can not be reset)
+
+        Session state the next user of the connection could see is reset: uncommitted transaction is rolled back,
+        table locks are released and the database the pool was created for is selected again. Named locks,
+        temporary tables and session variables are not reset - Connection closes connections that set them
+        instead of releasing them to the pool.
+
+        :param raw_connection: Raw MySQL connection returned by acquire()
+        """
+        try:
+            self._reset(raw_connection)
+        except Exception:
+            self._close(raw_connection)
+            return
+
+        with self._lock:
+            self._check_pid()
+            self._evict_idle()
+
+            if len(self._idle) < self.max_size:
+                self._idle.append((raw_connection, time.time()))
+                return
+
+        self._close(raw_connection)
+
+    def _reset(self, raw_connection):
+        raw_connection.rollback()
+
+        cursor = raw_connection.cursor()
+        try:
+            cursor.execute('UNLOCK TABLES')
+        finally:
+            cursor.close()
+
+        if self.conn_details.dbname is not None:
+            raw_connection.select_db(self.conn_details.dbname)  # USE may have switched it
+
+    def _check_pid(self):
+        """
+        Drop idle connections inherited from the parent process (has to be called with the lock held)
+
+        Closing them would end MySQL sessions the parent process still uses. They're kept referenced, as MySQLdb
+        closes the session when the connection object is garbage collected as well.
+        """
+        pid = os.getpid()
+        if pid != self._pid:
+            logger.debug('Dropping {} idle connections inherited from process {}'.format(len(self._idle), self._pid))
+            self._inherited.extend(raw_connection for raw_connection, _ in self._idle)
+            self._idle = []
+            self._pid = pid
+
+    def _evict_idle(self):
+        """
+        Close connections idle for longer than idle_timeout (has to be called with the lock held)
+        """
+        expired_before = time.time() - self.idle_timeout
+        while self._idle and self._idle[0][1] < expired_before:
+            self._close(self._idle.pop(0)[0])
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for raw_connection, _ in idle:
+            self._close(raw_connection)
+
+    @staticmethod
+    def _close(raw_connection):
+        try:
+            raw_connection.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self._idle)
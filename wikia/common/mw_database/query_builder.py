@@ -1,4 +1,12 @@
+import six
+
+
 class SqlBuilderMixin(object):
+    # SQL text of statements built by select(), insert(), update() and delete(), shared by all connections
+    # and keyed by the statement shape (None - no caching). It is emptied when it gets full.
+    sql_cache = {}
+    sql_cache_size = 10000
+
     def query(self, *args, **kwargs):
         """
         Execute query
@@ -10,6 +18,23 @@ class SqlBuilderMixin(object):
         """
         raise NotImplementedError('Inheritors must overrie SqlBuilderMixin.query')
 
+    def stream(self, query, args=None, batch_size=1000, batches=False):
+        """
+        Execute query and yield rows without buffering the whole result in memory
+
+        :param query: SQL query text
+        :param args: SQL query values
+        :param batch_size: Number of rows fetched from the server at once
+        :param batches: Yield lists of up to batch_size rows instead of single rows
+        """
+        raise NotImplementedError('Inheritors must override SqlBuilderMixin.stream')
+
+    def commit(self):
+        """
+        Commit the current transaction
+        """
+        raise NotImplementedError('Inheritors must override SqlBuilderMixin.commit')
+
     def select_as_dicts(self, table, what, where):
         return self.select(table, what, where).rows_as_dicts
 
@@ -22,12 +47,39 @@ class SqlBuilderMixin(object):
         :return:
         :rtype: QueryResult
         """
-        sql_data = {}
-        where_clause = self.where(where, sql_data)
-        sql = 'SELECT {} FROM {} WHERE {};'.format(what, table, where_clause)
+        sql, sql_data = self.select_sql(table, what, where)
 
         return self.query(sql, args=sql_data)
 
+    def stream_select(self, table, what, where, batch_size=1000, batches=False):
+        """
+        Execute SELECT statement and yield rows without buffering the whole result in memory
+
+        :param table:
+        :param what:
+        :param where:
+        :param batch_size: Number of rows fetched from the server at once (default: 1000)
+        :param batches: Yield lists of up to batch_size rows instead of single rows (default: False)
+        """
+        sql, sql_data = self.select_sql(table, what, where)
+
+        return self.stream(sql, args=sql_data, batch_size=batch_size, batches=batches)
+
+    def select_sql(self, table, what, where):
+        """
+        Build SELECT statement
+
+        :return: SQL query text and values
+        :rtype: tuple
+        """
+        def build():
+            sql_data = {}
+            where_clause = self.where(where, sql_data)
+            sql = 'SELECT {} FROM {} WHERE {};'.format(what, table, where_clause)
+            return sql, sql_data
+
+        return self.cached_sql(('SELECT', table, what), build, (where, ''))
+
     def insert(self, table, data, ignore_errors=False):
         """
         Execute INSERT statement
@@ -38,22 +90,136 @@ class SqlBuilderMixin(object):
         :return:
         :rtype: QueryResult
         """
-        columns = []
-        values = []
-        sql_data = {}
-        for column, value in data.items():
-            columns.append('`{}`'.format(column))
-            sql_value, is_value = self.add_value(value, sql_data, column)
-            if not is_value:
-                raise ValueError('insert accepts only value literals')
-            values.append(sql_value)
+        def build():
+            columns = []
+            values = []
+            sql_data = {}
+            for column, value in data.items():
+                columns.append('`{}`'.format(column))
+                sql_value, is_value = self.add_value(value, sql_data, column)
+                if not is_value:
+                    raise ValueError('insert accepts only value literals')
+                values.append(sql_value)
+            ignore = ''
+            if ignore_errors:
+                ignore = 'IGNORE '
+
+            sql = 'INSERT {}INTO {}({}) VALUES ({});'.format(ignore, table, ', '.join(columns), ', '.join(values))
+            return sql, sql_data
+
+        sql, sql_data = self.cached_sql(('INSERT', table, bool(ignore_errors)), build, (data, ''))
+
+        return self.query(sql, args=sql_data)
+
+    def insert_many(self, table, rows, chunk_size=1000, ignore_errors=False, on_duplicate_update=None,
+                    max_packet_size=None):
+        """
+        Execute multi-row INSERT statements (each one inserts up to chunk_size rows) and commit after each of them
+
+        :param table: Table name
+        :param rows: List of dictionaries with data (all of them with the same keys)
+        :param chunk_size: Maximum number of rows inserted by a single statement (default: 1000)
+        :param ignore_errors: Option flag to ignore duplicated-class errors durign query execution
+        :param on_duplicate_update: Columns to be updated with inserted values when the row already exists
+                                    (True - all of them)
+        :param max_packet_size: Maximum size of a single statement in bytes (default: max_allowed_packet
+                                of the server)
+        :return: Number of affected rows
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        if max_packet_size is None:
+            max_packet_size = self.max_allowed_packet()
+
+        affected = 0
+        for sql, sql_data in self.insert_many_sql(table, rows, chunk_size, ignore_errors, on_duplicate_update,
+                                                  max_packet_size):
+            affected += self.query(sql, args=sql_data).affected
+            self.commit()
+
+        return affected
+
+    def insert_many_sql(self, table, rows, chunk_size, ignore_errors, on_duplicate_update, max_packet_size):
+        """
+        Build multi-row INSERT statements, see insert_many()
+
+        :return: Iterator of SQL query text and values tuples
+        """
+        columns = list(rows[0].keys())
+
         ignore = ''
         if ignore_errors:
             ignore = 'IGNORE '
 
-        sql = 'INSERT {}INTO {}({}) VALUES ({});'.format(ignore, table, ', '.join(columns), ', '.join(values))
+        sql_head = 'INSERT {}INTO {}({}) VALUES '.format(ignore, table,
+                                                         ', '.join('`{}`'.format(column) for column in columns))
 
-        return self.query(sql, args=sql_data)
+        sql_tail = ';'
+        if on_duplicate_update:
+            if on_duplicate_update is True:
+                on_duplicate_update = columns
+            sql_tail = ' ON DUPLICATE KEY UPDATE {};'.format(
+                ', '.join('`{0}` = VALUES(`{0}`)'.format(column) for column in on_duplicate_update))
+
+        # leave some room for the protocol overhead
+        max_values_size = max_packet_size - len(sql_head) - len(sql_tail) - 1024
+
+        values, values_size, sql_data = [], 0, {}
+
+        for row_index, row in enumerate(rows):
+            if set(row.keys()) != set(columns):
+                raise ValueError('insert_many requires all rows to have the same columns')
+
+            row_values = []
+            row_data = {}
+            row_size = 4  # "(", ")" and ", " separator
+            for column_index, column in enumerate(columns):
+                value = row[column]
+                sql_value, is_value = self.add_value(value, row_data, 'r{}_c{}'.format(row_index, column_index))
+                if not is_value:
+                    raise ValueError('insert_many accepts only value literals')
+                row_values.append(sql_value)
+                row_size += self._estimate_value_size(value, sql_value) + 2  # ", " separator
+
+            if set(row_data) & set(sql_data):
+                raise ValueError('insert_many got SqlLiterals with conflicting argument names')
+
+            if values and (len(values) >= chunk_size or values_size + row_size > max_values_size):
+                yield sql_head + ', '.join(values) + sql_tail, sql_data
+                values, values_size, sql_data = [], 0, {}
+
+            values.append('({})'.format(', '.join(row_values)))
+            values_size += row_size
+            sql_data.update(row_data)
+
+        yield sql_head + ', '.join(values) + sql_tail, sql_data
+
+    def max_allowed_packet(self):
+        """
+        Return max_allowed_packet setting of the server (fetched once)
+
+        :rtype: int
+        """
+        if getattr(self, '_max_allowed_packet', None) is None:
+            self._max_allowed_packet = int(self.query('SELECT @@max_allowed_packet').rows[0][0])
+        return self._max_allowed_packet
+
+    @staticmethod
+    def _estimate_value_size(value, sql_value):
+        """
+        Return the maximum size (in bytes) of the value after being escaped and put into the SQL statement
+        """
+        if hasattr(value, 'IS_SQL_LITERAL'):
+            return len(sql_value)
+        if value is None:
+            return len('NULL')
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        if isinstance(value, six.binary_type):
+            return 2 * len(value) + 2  # every byte can be escaped, plus quotes
+        return len(str(value)) + 2
 
     def update(self, table, data, conds):
         """
@@ -65,14 +231,17 @@ class SqlBuilderMixin(object):
         :return:
         :rtype: QueryResult
         """
-        sql_data = {}
-        set_clause = []
-        where_clause = []
-        for k, v in data.items():
-            self.add_condition(k, v, set_clause, sql_data, 'data_')
-        where_clause = self.where(conds, sql_data, 'conds_')
+        def build():
+            sql_data = {}
+            set_clause = []
+            for k, v in data.items():
+                self.add_condition(k, v, set_clause, sql_data, 'data_')
+            where_clause = self.where(conds, sql_data, 'conds_')
 
-        sql = 'UPDATE {} SET {} WHERE {};'.format(table, ', '.join(set_clause), where_clause)
+            sql = 'UPDATE {} SET {} WHERE {};'.format(table, ', '.join(set_clause), where_clause)
+            return sql, sql_data
+
+        sql, sql_data = self.cached_sql(('UPDATE', table), build, (data, 'data_'), (conds, 'conds_'))
 
         return self.query(sql, args=sql_data)
 
@@ -85,11 +254,57 @@ class SqlBuilderMixin(object):
         :return:
         :rtype: QueryResult
         """
-        sql_data = {}
-        sql = 'DELETE FROM {} WHERE {};'.format(table, self.where(conds, sql_data))
+        def build():
+            sql_data = {}
+            sql = 'DELETE FROM {} WHERE {};'.format(table, self.where(conds, sql_data))
+            return sql, sql_data
+
+        sql, sql_data = self.cached_sql(('DELETE', table), build, (conds, ''))
 
         return self.query(sql, args=sql_data)
 
+    def cached_sql(self, key, build_fn, *sections):
+        """
+        Return SQL text and values of the statement, SQL text is taken from sql_cache when a statement of the same
+        shape was built before
+
+        The shape consists of the key and names of values in each section (in order), SQL literals are identified
+        by their text. Values are named after their keys (with a section prefix), hence they are collected
+        while the shape is computed.
+
+        :param key: Statement type, table and other parameters the SQL text depends on
+        :param build_fn: Function building SQL text and values of the statement (called on cache misses)
+        :param sections: (dictionary with values, argument names prefix) tuples the statement is built from
+        :return: SQL query text and values
+        :rtype: tuple
+        """
+        if self.sql_cache is None:
+            return build_fn()
+
+        shape = list(key)
+        sql_data = {}
+        for section, prefix in sections:
+            if section:
+                for name, value in section.items():
+                    if hasattr(value, 'IS_SQL_LITERAL'):
+                        shape.append((name, value.text, value.is_value))
+                        sql_data.update(value.args)
+                    else:
+                        shape.append(name)
+                        sql_data[prefix + name] = value
+            shape.append(None)  # sections separator
+
+        shape = tuple(shape)
+        sql = self.sql_cache.get(shape)
+
+        if sql is None:
+            sql, sql_data = build_fn()
+            if len(self.sql_cache) >= self.sql_cache_size:
+                self.sql_cache.clear()
+            self.sql_cache[shape] = sql
+
+        return sql, sql_data
+
     def where(self, conds, sql_data, prefix=''):
         clause = []
         if conds is not None:
@@ -0,0 +1,86 @@
+import collections
+
+import six
+
+
+class QueryResult(object):
+    """
+    Rows returned by the query
+
+    Rows are kept as returned by the driver (tuples). Other views of the result (dicts, records, columns) are built
+    on the first access and cached - do not modify them.
+    """
+    __slots__ = ('query', 'query_args', 'query_kwargs', 'affected', 'description', 'rows', 'num_rows',
+                 '_column_names', '_rows_as_dicts', '_record_class', '_records', '_rows_as_columns')
+
+    def __init__(self, query, query_args, query_kwargs, affected, description, rows):
+        self.query = query
+        self.query_args = query_args
+        self.query_kwargs = query_kwargs
+        self.affected = affected
+        self.description = description
+        self.rows = rows
+        self.num_rows = len(rows)
+        self._column_names = None
+        self._rows_as_dicts = None
+        self._record_class = None
+        self._records = None
+        self._rows_as_columns = None
+
+    @property
+    def column_names(self):
+        if self._column_names is None:
+            self._column_names = tuple(column[0] for column in self.description or ())
+        return self._column_names
+
+    def _converted_rows(self):
+        """
+        Yield rows with unicode values converted to str (Python 2 only, on Python 3 they're str already)
+        """
+        if six.PY3:
+            return iter(self.rows)
+
+        text_type = six.text_type
+        return (tuple(str(value) if isinstance(value, text_type) else value for value in row) for row in self.rows)
+
+    @property
+    def rows_as_dicts(self):
+        """
+        Rows as dicts (column name -> value), text values are converted to str
+        """
+        if self._rows_as_dicts is None:
+            column_names = self.column_names
+            self._rows_as_dicts = [dict(zip(column_names, row)) for row in self._converted_rows()]
+        return self._rows_as_dicts
+
+    @property
+    def record_class(self):
+        """
+        namedtuple class of records, invalid column names (e.g. "COUNT(*)") are replaced by positional ones ("_0")
+        """
+        if self._record_class is None:
+            self._record_class = collections.namedtuple('Record', self.column_names, rename=True)
+        return self._record_class
+
+    @property
+    def records(self):
+        """
+        Rows as namedtuples (values are accessible by column names as attributes), text values are converted to str
+        """
+        if self._records is None:
+            make = self.record_class._make
+            self._records = [make(row) for row in self._converted_rows()]
+        return self._records
+
+    @property
+    def rows_as_columns(self):
+        """
+        Result as a dict of columns (column name -> tuple of values), text values are converted to str
+        """
+        if self._rows_as_columns is None:
+            columns = list(zip(*self._converted_rows())) or [()] * len(self.column_names)
+            self._rows_as_columns = dict(zip(self.column_names, columns))
+        return self._rows_as_columns
+
+    def __iter__(self):
+        return iter(self.rows)
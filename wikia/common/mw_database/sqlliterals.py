@@ -23,6 +23,12 @@ class SqlCondition(SqlLiteral):
 
 
 class SqlLiteralBuilder(object):
+    ARG_REGEX = re.compile(r'%(?:\(([^)]+)\))?([sd])')
+
+    # parsed SQL literals: (text, arg prefix) -> (new text, ((arg name, key or index in args), ...))
+    parsed = {}
+    parsed_size = 10000
+
     def __init__(self, text, args, arg_prefix):
         self.input_text = text
         self.input_args = args
@@ -30,26 +36,39 @@ class SqlLiteralBuilder(object):
         self.build()
 
     def build(self):
-        self.arg_index = 0
-        self.args_list = []
+        key = (self.input_text, self.arg_prefix)
+        parsed = self.parsed.get(key)
+        if parsed is None:
+            parsed = self.parse()
+            if len(self.parsed) >= self.parsed_size:
+                self.parsed.clear()
+            self.parsed[key] = parsed
 
-        self.text = re.sub(r'%(?:\(([^)]+)\))?([sd])', self.register_arg, self.input_text)
+        self.text, arg_names = parsed
+        self.args_list = [[arg_name, self.input_args[arg_key]] for arg_name, arg_key in arg_names]
         self.args = dict(self.args_list)
 
         if len(self.input_args) != len(self.args):
             raise ValueError('SQL literal parsing error: arguments counts do not match (got {}, found {})'.format(
                 len(self.input_args), len(self.args)))
 
+    def parse(self):
+        self.arg_index = 0
+        self.arg_names = []
+
+        text = self.ARG_REGEX.sub(self.register_arg, self.input_text)
+
+        return text, tuple(self.arg_names)
+
     def register_arg(self, m):
         if m.group(1):
-            value = self.input_args[m.group(1)]
+            arg_key = m.group(1)
             arg_name = '{}_key_{}'.format(self.arg_prefix, m.group(1))
-            self.args_list.append([arg_name, value])
         else:
-            value = self.input_args[self.arg_index]
+            arg_key = self.arg_index
             arg_name = '{}_index_{}'.format(self.arg_prefix, self.arg_index)
-            self.args_list.append([arg_name, value])
             self.arg_index += 1
+        self.arg_names.append((arg_name, arg_key))
 
         new_text = '%({}){}'.format(arg_name, m.group(2))
 
@@ -0,0 +1,315 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from ..dbconfig import ConnectionDetails
+from .test_connection import HealthReporterMock, RecordingHook
+from .test_dbconfig import CITY_LIST, write_db_yml
+
+if aiomysql is not None:
+    from ..async_load_balancer import AsyncConnection, AsyncLoadBalancer
+
+
+class AsyncCursorMock(object):
+    def __init__(self, conn, cursor_class=None):
+        self.conn = conn
+        self.cursor_class = cursor_class
+        self.rows = ()
+        self.rowcount = 0
+        self.description = (('value',),)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.conn.closed_cursors += 1
+
+    async def execute(self, sql, args=None):
+        self.conn.queries.append((sql, args))
+
+        if self.conn.db == 'broken':
+            raise aiomysql.OperationalError(2013, 'Lost connection to MySQL server during query')
+
+        if 'WHERE city_dbname = ' in sql:
+            dbname = args['db_name']
+            self.rows = ((CITY_LIST[dbname],),) if dbname in CITY_LIST else ()
+        elif 'FROM city_list' in sql:
+            dbnames = args.values() if args else CITY_LIST.keys()
+            self.rows = tuple((dbname, CITY_LIST[dbname]) for dbname in dbnames if dbname in CITY_LIST)
+        elif 'FROM page' in sql:
+            self.rows = tuple((i,) for i in range(5))
+        else:
+            self.rows = ((self.conn.db,),)
+        self.rowcount = len(self.rows)
+
+    async def fetchall(self):
+        return self.rows
+
+    async def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class AsyncRawConnectionMock(object):
+    def __init__(self, select_db_error=None, rollback_error=None):
+        self.db = None
+        self.queries = []
+        self.closed_cursors = 0
+        self.rollbacks = 0
+        self.select_db_error = select_db_error
+        self.rollback_error = rollback_error
+
+    def cursor(self, cursor_class=None):
+        return AsyncCursorMock(self, cursor_class)
+
+    async def select_db(self, db):
+        if self.select_db_error is not None:
+            raise self.select_db_error
+        self.db = db
+
+    async def rollback(self):
+        self.rollbacks += 1
+        if self.rollback_error is not None:
+            raise self.rollback_error
+
+
+class AsyncPoolMock(object):
+    def __init__(self, acquire_error=None, **kwargs):
+        self.kwargs = kwargs
+        self.acquire_error = acquire_error
+        self.connection_errors = {}
+        self.acquired = []
+        self.released = []
+        self.closed = False
+
+    async def acquire(self):
+        if self.acquire_error is not None:
+            raise self.acquire_error
+        conn = AsyncRawConnectionMock(**self.connection_errors)
+        self.acquired.append(conn)
+        return conn
+
+    def release(self, conn):
+        self.released.append(conn)
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+@unittest.skipIf(aiomysql is None, 'aiomysql is not installed')
+class AsyncLoadBalancerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        self.pools = []
+        self.pool_error = None
+        self.load_balancer = AsyncLoadBalancer(write_db_yml(self.tmp_dir), cluster_concurrency=1)
+        self.load_balancer.db_config.report_error = mock.Mock()
+
+        patcher = mock.patch.object(aiomysql, 'create_pool', self.create_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.tmp_dir)
+
+    async def create_pool(self, **kwargs):
+        if self.pool_error is not None:
+            raise self.pool_error
+        pool = AsyncPoolMock(**kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def assert_released(self, cluster):
+        # cluster_concurrency is 1, the semaphore is locked as long as a connection to the cluster is used
+        assert not self.load_balancer._get_semaphore(cluster).locked()
+
+    def test_connect(self):
+        async def query(dbname):
+            async with self.load_balancer.connect(dbname) as conn:
+                assert self.load_balancer._get_semaphore('c1').locked()
+                return (await conn.query('SELECT DATABASE()')).rows
+
+        assert self.run_async(query('muppet')) == (('muppet',),)
+        assert self.run_async(query('starwars')) == (('starwars',),)
+        self.assert_released('c1')
+
+        # wikicities pool (cluster lookups) and a single c1 pool (the database is switched)
+        assert [pool.kwargs['host'] for pool in self.pools] == ['db-central-slave', 'db-c1-master']
+        c1_pool = self.pools[1]
+        assert len(c1_pool.acquired) == 2
+        assert c1_pool.released == c1_pool.acquired
+        assert [conn.rollbacks for conn in c1_pool.acquired] == [1, 1]
+
+    def test_connect_await(self):
+        conn = self.run_async(self.load_balancer.connect('muppet'))
+        assert isinstance(conn, AsyncConnection)
+        assert conn.connection_info.dbname == 'muppet'
+        assert conn.raw_connection.db == 'muppet'
+
+        self.run_async(conn.close())
+        self.run_async(conn.close())  # no-op
+        self.assert_released('c1')
+        assert len(self.pools[1].released) == 1
+
+    def test_connect_pool_error(self):
+        self.run_async(self.load_balancer.preload_wiki_clusters())
+        self.pool_error = aiomysql.OperationalError(2003, "Can't connect to MySQL server")
+
+        self.assertRaises(aiomysql.OperationalError, self.run_async, self.load_balancer.connect('muppet'))
+        self.assert_released('c1')
+        self.load_balancer.db_config.report_error.assert_called_once_with('db-c1-master')
+
+        # the failed pool is not cached
+        self.pool_error = None
+        self.run_async(self.load_balancer.connect('muppet'))
+        assert self.pools[-1].kwargs['host'] == 'db-c1-master'
+
+    def test_connect_acquire_error(self):
+        self.run_async(self.load_balancer.preload_wiki_clusters())
+        self.run_async(self.load_balancer._get_pool(self.load_balancer.db_config.get_connection_details('muppet')))
+        self.pools[-1].acquire_error = RuntimeError('acquire failed')
+
+        self.assertRaises(RuntimeError, self.run_async, self.load_balancer.connect('muppet'))
+        self.assert_released('c1')
+        assert not self.load_balancer.db_config.report_error.called
+
+    def test_connect_select_db_error(self):
+        self.run_async(self.load_balancer.preload_wiki_clusters())
+        self.run_async(self.load_balancer._get_pool(self.load_balancer.db_config.get_connection_details('muppet')))
+        pool = self.pools[-1]
+        pool.connection_errors = {'select_db_error': aiomysql.OperationalError(1049, "Unknown database 'muppet'")}
+
+        self.assertRaises(aiomysql.OperationalError, self.run_async, self.load_balancer.connect('muppet'))
+        self.assert_released('c1')
+        assert pool.released == pool.acquired
+
+    def test_release_rollback_error(self):
+        self.run_async(self.load_balancer.preload_wiki_clusters())
+        self.run_async(self.load_balancer._get_pool(self.load_balancer.db_config.get_connection_details('muppet')))
+        pool = self.pools[-1]
+        pool.connection_errors = {'rollback_error': aiomysql.OperationalError(2013, 'Lost connection')}
+
+        conn = self.run_async(self.load_balancer.connect('muppet'))
+        self.assertRaises(aiomysql.OperationalError, self.run_async, conn.close())
+        self.assert_released('c1')
+        assert pool.released == pool.acquired
+
+    def test_fetch_wiki_cluster(self):
+        details = self.run_async(self.load_balancer.get_connection_details('glee'))
+        assert details.cluster == 'c2'
+        assert self.load_balancer.db_config.cluster_cache.get('glee') == 'c2'
+
+        wikicities_conn, = self.pools[0].acquired
+        assert wikicities_conn.db == 'wikicities'
+        assert wikicities_conn.queries == [
+            ('SELECT city_cluster FROM city_list WHERE city_dbname = %(db_name)s', {'db_name': 'glee'}),
+        ]
+        assert wikicities_conn.rollbacks == 1
+        self.assert_released('central')
+
+        # cached cluster is not looked up again, unless wikicities master is asked for it
+        self.run_async(self.load_balancer.get_connection_details('glee'))
+        assert len(wikicities_conn.queries) == 1
+        self.run_async(self.load_balancer.get_connection_details('glee', wc_master=True))
+        assert self.pools[-1].kwargs['host'] == 'db-central-master'
+
+        self.assertRaises(RuntimeError, self.run_async, self.load_balancer.get_connection_details('nonexistent'))
+        self.assert_released('central')
+
+    def test_close(self):
+        self.run_async(self.load_balancer.connect('muppet'))
+        self.run_async(self.load_balancer.close())
+        assert self.pools and all(pool.closed for pool in self.pools)
+
+
+@unittest.skipIf(aiomysql is None, 'aiomysql is not installed')
+class AsyncConnectionTest(unittest.TestCase):
+    connection_info = ConnectionDetails(hostname='db-c1-slave', username='user', password='pass', dbname='muppet',
+                                        cluster='c1', master=False)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.raw_connection = AsyncRawConnectionMock()
+        self.raw_connection.db = 'muppet'
+        self.hook = RecordingHook()
+        self.health_reporter = HealthReporterMock()
+        self.conn = AsyncConnection(self.raw_connection, self.connection_info, health_reporter=self.health_reporter,
+                                    query_hooks=[self.hook])
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_query(self):
+        query = 'SELECT page_id FROM page WHERE page_namespace = %(ns)s'
+        result = self.run_async(self.conn.query(query, args={'ns': 0}))
+        assert result.rows == tuple((i,) for i in range(5))
+        assert result.affected == 5
+        assert result.column_names == ('value',)
+        assert result.query_kwargs == {'args': {'ns': 0}}
+        assert self.raw_connection.closed_cursors == 1
+
+        assert self.hook.calls == [
+            ('before', 'SELECT page_id FROM page WHERE page_namespace = %(ns)s', {'ns': 0}),
+            ('after', 'SELECT page_id FROM page WHERE page_namespace = %(ns)s', {'ns': 0}, 5, None),
+        ]
+        assert self.health_reporter.reports == [('success', 'db-c1-slave')]
+
+    def test_query_error(self):
+        self.raw_connection.db = 'broken'
+        self.assertRaises(aiomysql.OperationalError, self.run_async, self.conn.query('SELECT 1'))
+
+        (_, _, _, num_rows, error), = [call for call in self.hook.calls if call[0] == 'after']
+        assert num_rows is None
+        assert isinstance(error, aiomysql.OperationalError)
+        assert self.health_reporter.reports == [('error', 'db-c1-slave')]
+
+    def test_stream(self):
+        async def collect(**kwargs):
+            return [row async for row in self.conn.stream('SELECT page_id FROM page', batch_size=2, **kwargs)]
+
+        assert self.run_async(collect()) == [(i,) for i in range(5)]
+        assert self.run_async(collect(batches=True)) == [[(0,), (1,)], [(2,), (3,)], [(4,)]]
+        assert self.raw_connection.closed_cursors == 2
+        assert self.hook.calls[:2] == [
+            ('before', 'SELECT page_id FROM page', None),
+            ('after', 'SELECT page_id FROM page', None, 5, None),
+        ]
+
+    def test_stream_early_exit(self):
+        async def first_row():
+            rows = self.conn.stream('SELECT page_id FROM page', batch_size=2)
+            row = await rows.__anext__()
+            await rows.aclose()
+            return row
+
+        assert self.run_async(first_row()) == (0,)
+        assert self.raw_connection.closed_cursors == 1
+        assert self.hook.calls[-1] == ('after', 'SELECT page_id FROM page', None, 2, None)
+
+    def test_stream_error(self):
+        async def collect():
+            return [row async for row in self.conn.stream('SELECT page_id FROM page')]
+
+        self.raw_connection.db = 'broken'
+        self.assertRaises(aiomysql.OperationalError, self.run_async, collect())
+        assert self.hook.calls[-1][3] is None
+        assert isinstance(self.hook.calls[-1][4], aiomysql.OperationalError)
+        assert self.health_reporter.reports == [('error', 'db-c1-slave')]
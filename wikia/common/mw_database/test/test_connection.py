@@ -0,0 +1,227 @@
+import time
+import unittest
+
+import MySQLdb
+import MySQLdb.cursors
+
+from ..connection import Connection, QueryResult
+from ..dbconfig import ConnectionDetails
+from ..instrumentation import QueryHook
+
+
+class CursorMock(object):
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = None
+        self.closed = False
+
+    def execute(self, query, args=None):
+        self.executed = (query, args)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return tuple(rows)
+
+    def close(self):
+        self.closed = True
+
+
+class RawConnectionMock(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+
+    def cursor(self, cursorclass=None):
+        assert cursorclass is MySQLdb.cursors.SSCursor
+        cursor = CursorMock(self.rows)
+        self.cursors.append(cursor)
+        return cursor
+
+
+class ConnectionStreamTest(unittest.TestCase):
+    def test_stream(self):
+        raw_connection = RawConnectionMock([(i, 'page_{}'.format(i)) for i in range(5)])
+        conn = Connection(raw_connection)
+
+        rows = list(conn.stream('SELECT page_id, page_title FROM page', batch_size=2))
+        assert rows == [(i, 'page_{}'.format(i)) for i in range(5)]
+        assert raw_connection.cursors[0].closed
+
+        batches = list(conn.stream('SELECT page_id, page_title FROM page', batch_size=2, batches=True))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+
+    def test_stream_early_exit(self):
+        raw_connection = RawConnectionMock([(i,) for i in range(5)])
+        conn = Connection(raw_connection)
+
+        rows = conn.stream('SELECT page_id FROM page', batch_size=2)
+        assert next(rows) == (0,)
+        assert not raw_connection.cursors[0].closed
+
+        rows.close()
+        assert raw_connection.cursors[0].closed
+
+    def test_stream_select(self):
+        raw_connection = RawConnectionMock([(1,)])
+        conn = Connection(raw_connection)
+
+        assert list(conn.stream_select('page', 'page_id', {'page_namespace': 0})) == [(1,)]
+        assert raw_connection.cursors[0].executed == (
+            'SELECT page_id FROM page WHERE page_namespace = %(page_namespace)s;', {'page_namespace': 0})
+
+    def test_stream_hooks(self):
+        hook = RecordingHook()
+        conn = Connection(RawConnectionMock([(i,) for i in range(5)]), query_hooks=[hook])
+
+        rows = conn.stream('SELECT page_id FROM page', batch_size=2)
+        assert next(rows) == (0,)
+        assert [call[0] for call in hook.calls] == ['before']
+
+        rows.close()  # rows read so far are reported
+        assert hook.calls[-1][0] == 'after'
+        assert hook.calls[-1][3:] == (2, None)
+
+    def test_stream_elapsed(self):
+        timings = []
+
+        class TimingHook(QueryHook):
+            def after_query(self, connection, query, args, elapsed, num_rows=None, error=None):
+                timings.append(elapsed)
+
+        conn = Connection(RawConnectionMock([(i,) for i in range(3)]), query_hooks=[TimingHook()])
+
+        for _ in conn.stream('SELECT page_id FROM page', batch_size=1):
+            time.sleep(0.05)  # slow consumer
+
+        # time rows are processed by the caller is not reported
+        assert len(timings) == 1
+        assert timings[0] < 0.05
+
+
+class QueryCursorMock(CursorMock):
+    def __init__(self, rows, error=None):
+        super(QueryCursorMock, self).__init__(rows)
+        self.error = error
+        self.rowcount = len(self.rows)
+        self.description = (('page_id',),)
+
+    def execute(self, query, args=None):
+        if self.error is not None:
+            raise self.error
+        super(QueryCursorMock, self).execute(query, args)
+
+    def fetchall(self):
+        return tuple(self.rows)
+
+
+class QueryRawConnectionMock(object):
+    def __init__(self, rows, error=None):
+        self.rows = rows
+        self.error = error
+
+    def cursor(self):
+        return QueryCursorMock(self.rows, self.error)
+
+
+class RecordingHook(QueryHook):
+    def __init__(self):
+        self.calls = []
+
+    def before_query(self, connection, query, args):
+        self.calls.append(('before', query, args))
+
+    def after_query(self, connection, query, args, elapsed, num_rows=None, error=None):
+        assert elapsed >= 0
+        self.calls.append(('after', query, args, num_rows, error))
+
+
+class HealthReporterMock(object):
+    def __init__(self):
+        self.reports = []
+
+    def report_success(self, hostname, elapsed):
+        self.reports.append(('success', hostname))
+
+    def report_error(self, hostname):
+        self.reports.append(('error', hostname))
+
+
+class ConnectionHooksTest(unittest.TestCase):
+    connection_info = ConnectionDetails(hostname='db-c1-slave', username='user', password='pass', dbname='muppet',
+                                        cluster='c1', master=False)
+
+    def test_query_hooks(self):
+        hook = RecordingHook()
+        conn = Connection(QueryRawConnectionMock([(1,), (2,)]), query_hooks=[hook])
+
+        conn.query('SELECT page_id FROM page WHERE page_namespace = %s', args=[0])
+        assert hook.calls == [
+            ('before', 'SELECT page_id FROM page WHERE page_namespace = %s', [0]),
+            ('after', 'SELECT page_id FROM page WHERE page_namespace = %s', [0], 2, None),
+        ]
+
+    def test_query_error(self):
+        hook = RecordingHook()
+        error = MySQLdb.OperationalError(2013, 'Lost connection to MySQL server during query')
+        conn = Connection(QueryRawConnectionMock([], error), query_hooks=[hook])
+
+        self.assertRaises(MySQLdb.OperationalError, conn.query, 'SELECT 1')
+        assert hook.calls[-1] == ('after', 'SELECT 1', None, None, error)
+
+    def test_failing_hook(self):
+        class FailingHook(QueryHook):
+            def before_query(self, connection, query, args):
+                raise RuntimeError('hook failed')
+
+        conn = Connection(QueryRawConnectionMock([(1,)]), query_hooks=[FailingHook()])
+        assert conn.query('SELECT 1').rows == ((1,),)
+
+    def test_health_reporting(self):
+        health_reporter = HealthReporterMock()
+        conn = Connection(QueryRawConnectionMock([(1,)]), self.connection_info, health_reporter=health_reporter)
+        conn.query('SELECT 1')
+
+        conn.raw_connection = QueryRawConnectionMock([], MySQLdb.OperationalError(2013, 'Lost connection'))
+        self.assertRaises(MySQLdb.OperationalError, conn.query, 'SELECT 1')
+
+        # only connection errors make the host reported as failing
+        conn.raw_connection = QueryRawConnectionMock([], MySQLdb.ProgrammingError(1064, 'Syntax error'))
+        self.assertRaises(MySQLdb.ProgrammingError, conn.query, 'SELEC 1')
+
+        assert health_reporter.reports == [('success', 'db-c1-slave'), ('error', 'db-c1-slave')]
+
+
+class QueryResultTest(unittest.TestCase):
+    def setUp(self):
+        self.result = QueryResult('SELECT page_id, page_title, COUNT(*) FROM page', (), {}, 2,
+                                  (('page_id',), ('page_title',), ('COUNT(*)',)),
+                                  ((1, u'Kermit', 3), (2, 'Gonzo', None)))
+
+    def test_rows_as_dicts(self):
+        rows = self.result.rows_as_dicts
+        assert rows == [
+            {'page_id': 1, 'page_title': 'Kermit', 'COUNT(*)': 3},
+            {'page_id': 2, 'page_title': 'Gonzo', 'COUNT(*)': None},
+        ]
+        assert type(rows[0]['page_title']) is str
+        assert self.result.rows_as_dicts is rows  # cached
+
+    def test_records(self):
+        records = self.result.records
+        assert records[0].page_id == 1
+        assert records[1].page_title == 'Gonzo'
+        assert records[0]._2 == 3
+        assert records[1] == (2, 'Gonzo', None)
+        assert self.result.column_names == ('page_id', 'page_title', 'COUNT(*)')
+
+    def test_rows_as_columns(self):
+        assert self.result.rows_as_columns == {
+            'page_id': (1, 2),
+            'page_title': ('Kermit', 'Gonzo'),
+            'COUNT(*)': (3, None),
+        }
+
+        empty = QueryResult('SELECT page_id FROM page', (), {}, 0, (('page_id',),), ())
+        assert empty.rows_as_columns == {'page_id': ()}
+        assert empty.rows_as_dicts == []
+        assert list(empty) == []
@@ -0,0 +1,248 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import MySQLdb
+
+from ..cache import TTLCache
+from ..dbconfig import DatabaseConfig
+from ..host_selector import HealthAwareHostSelector
+
+
+DB_YML = """
+- sectionsByDB:
+    wikicities: central
+  serverTemplate:
+    user: reader
+    password: secret
+- central:
+  - db-central-master
+  - db-central-slave
+  c1:
+  - db-c1-master
+  c2:
+  - db-c2-master
+  - db-c2-slave-a
+  - db-c2-slave-b
+- {}
+"""
+
+CITY_LIST = {
+    'muppet': 'c1',
+    'starwars': 'c1',
+    'glee': 'c2',
+    'broken': 'c2',  # queries on this database fail
+    'nocluster': None,
+}
+
+
+class CursorMock(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = ()
+        self.rowcount = 0
+        self.description = (('value',),)
+
+    def execute(self, sql, args=None):
+        self.conn.queries.append((sql, args))
+
+        if self.conn.db == 'broken':
+            raise MySQLdb.OperationalError(2013, 'Lost connection to MySQL server during query')
+
+        if 'WHERE city_dbname = ' in sql:
+            dbname = args['db_name']
+            self.rows = ((CITY_LIST[dbname],),) if dbname in CITY_LIST else ()
+        elif 'FROM city_list' in sql:
+            dbnames = args.values() if args else CITY_LIST.keys()
+            self.rows = tuple((dbname, CITY_LIST[dbname]) for dbname in dbnames if dbname in CITY_LIST)
+        else:
+            self.rows = ((self.conn.db, self.conn.conn_details.hostname),)
+        self.rowcount = len(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class RawConnectionMock(object):
+    instances = []
+
+    def __init__(self, conn_details, queries=None):
+        self.conn_details = conn_details
+        self.db = conn_details.dbname
+        self.queries = queries if queries is not None else []
+        self.closed = False
+        RawConnectionMock.instances.append(self)
+
+    def cursor(self):
+        return CursorMock(self)
+
+    def select_db(self, db):
+        self.db = db
+
+    def ping(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def write_db_yml(tmp_dir):
+    """
+    Write DB_YML to the given directory and return the path of the file
+    """
+    db_config_file = os.path.join(tmp_dir, 'DB.yml')
+    with open(db_config_file, 'w') as fp:
+        fp.write(DB_YML)
+    return db_config_file
+
+
+class SlaveStatusConnectionMock(object):
+    """
+    Replica connection returning SHOW SLAVE STATUS results (lags by hostname, an exception to fail the query)
+    """
+    lags = {}
+
+    def __init__(self, conn_details):
+        self.conn_details = conn_details
+        self.rows = []
+        self.description = None
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, args=None):
+        assert sql == 'SHOW SLAVE STATUS'
+        lag = self.lags[self.conn_details.hostname]
+        if isinstance(lag, Exception):
+            raise lag
+        self.rows = [('Yes', lag)]
+        self.description = (('Slave_IO_Running',), ('Seconds_Behind_Master',))
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        self.closed = True
+
+
+class DatabaseConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.queries = []
+
+        db_config_file = write_db_yml(self.tmp_dir)
+        self.db_config = DatabaseConfig(db_config_file,
+                                        lambda conn_details: RawConnectionMock(conn_details, self.queries),
+                                        lambda conn_details: conn_details)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cluster_cache(self):
+        assert self.db_config.cluster_from_dbname('muppet', False) == 'c1'
+        assert self.db_config.cluster_from_dbname('muppet', False) == 'c1'
+        assert self.db_config.cluster_from_dbname('nocluster', False) is None
+        assert self.db_config.cluster_from_dbname('nocluster', False) is None
+        assert len(self.queries) == 2
+
+        # wikicities master is always asked
+        assert self.db_config.cluster_from_dbname('muppet', True) == 'c1'
+        assert len(self.queries) == 3
+
+        self.assertRaises(RuntimeError, self.db_config.cluster_from_dbname, 'notexisting', False)
+
+    def test_preload_wiki_clusters(self):
+        assert self.db_config.preload_wiki_clusters() == len(CITY_LIST)
+        assert self.db_config.get_connection_details('starwars').hostname == 'db-c1-master'
+        assert self.db_config.cluster_from_dbname('nocluster', False) is None
+        assert len(self.queries) == 1
+
+        self.db_config.cluster_cache.clear()
+        assert self.db_config.preload_wiki_clusters(['muppet', 'notexisting']) == 1
+        assert self.queries[1][0].endswith('WHERE city_dbname IN (%(db_name_0)s, %(db_name_1)s)')
+        assert 'muppet' in self.db_config.cluster_cache
+        assert 'starwars' not in self.db_config.cluster_cache
+
+        assert self.db_config.preload_wiki_clusters([]) == 0
+        assert len(self.queries) == 2
+
+    def test_host_selector(self):
+        selector = HealthAwareHostSelector(strategy=HealthAwareHostSelector.LEAST_LATENCY)
+        db_config = DatabaseConfig(os.path.join(self.tmp_dir, 'DB.yml'), None,
+                                   lambda conn_details: conn_details._replace(hostname=conn_details.hostname + '.sjc'),
+                                   host_selector=selector)
+        db_config.mw_config['sectionsByDB']['c2'] = 'c2'
+
+        assert db_config.get_connection_details('c2', master=True).hostname == 'db-c2-master.sjc'
+
+        # reported hostnames are mapped back to the ones from the config
+        assert set(db_config.get_connection_details('c2').hostname for _ in range(100)) == {
+            'db-c2-slave-a.sjc', 'db-c2-slave-b.sjc'}
+        db_config.report_success('db-c2-slave-a.sjc', 0.5)
+        db_config.report_success('db-c2-slave-b.sjc', 0.1)
+        assert db_config.get_connection_details('c2').hostname == 'db-c2-slave-b.sjc'
+
+        for _ in range(selector.failure_threshold):
+            db_config.report_error('db-c2-slave-b.sjc')
+        assert db_config.get_connection_details('c2').hostname == 'db-c2-slave-a.sjc'
+
+    def test_check_replication_lag(self):
+        selector = HealthAwareHostSelector(max_lag=30)
+        connections = []
+
+        def connect(conn_details):
+            connections.append(SlaveStatusConnectionMock(conn_details))
+            return connections[-1]
+
+        db_config = DatabaseConfig(os.path.join(self.tmp_dir, 'DB.yml'), connect, lambda conn_details: conn_details,
+                                   host_selector=selector)
+        db_config.cluster_config['c3'] = ['db-c3-master', 'db-c3-slave-a', 'db-c3-slave-b', 'db-c3-slave-c']
+        SlaveStatusConnectionMock.lags = {
+            'db-c3-slave-a': 0,
+            'db-c3-slave-b': 120,
+            'db-c3-slave-c': Exception('Access denied; you need the REPLICATION CLIENT privilege'),
+        }
+
+        for _ in range(selector.failure_threshold):
+            lags = db_config.check_replication_lag('c3')
+
+        assert lags == {'db-c3-slave-a': 0, 'db-c3-slave-b': 120}
+        assert all(conn.closed for conn in connections)
+        assert connections[0].conn_details.dbname is None
+
+        # the lagging replica is skipped, the one that could not be checked is not treated as failing
+        assert selector._get_health('db-c3-slave-c').errors == 0
+        assert set(db_config.host_from_cluster_and_type('c3') for _ in range(100)) == {
+            'db-c3-slave-a', 'db-c3-slave-c'}
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = TTLCache(max_size=2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        assert cache.get('foo') == 1
+
+        cache.set('baz', 3)
+        assert len(cache) == 2
+        assert cache.get('bar') is None
+        assert cache.get('foo') == 1
+        assert cache.get('baz') == 3
+
+    def test_ttl(self):
+        cache = TTLCache(ttl=-1)
+        cache.set('foo', 1)
+        assert cache.get('foo') is None
+        assert cache.get('foo', 'default') == 'default'
+        assert 'foo' not in cache
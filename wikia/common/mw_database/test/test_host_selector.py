@@ -0,0 +1,75 @@
+import unittest
+
+from ..host_selector import HealthAwareHostSelector
+
+
+HOSTS = ['db-a', 'db-b', 'db-c']
+
+
+class HealthAwareHostSelectorTest(unittest.TestCase):
+    def test_least_latency(self):
+        selector = HealthAwareHostSelector(strategy=HealthAwareHostSelector.LEAST_LATENCY)
+        selector.report_success('db-a', 0.050)
+        selector.report_success('db-b', 0.005)
+        selector.report_success('db-c', 0.020)
+
+        assert selector.select(HOSTS) == 'db-b'
+
+        # db-b degrades
+        for _ in range(20):
+            selector.report_success('db-b', 1.0)
+        assert selector.select(HOSTS) == 'db-c'
+
+    def test_weighted(self):
+        selector = HealthAwareHostSelector()
+        selector.report_success('db-a', 0.001)
+        selector.report_success('db-b', 1.0)
+        selector.report_success('db-c', 1.0)
+
+        picks = [selector.select(HOSTS) for _ in range(1000)]
+        assert picks.count('db-a') > 900
+
+        self.assertRaises(ValueError, HealthAwareHostSelector, strategy='foo')
+
+    def test_circuit_breaker(self):
+        selector = HealthAwareHostSelector(strategy=HealthAwareHostSelector.LEAST_LATENCY, failure_threshold=2)
+        selector.report_success('db-a', 0.001)
+        selector.report_success('db-b', 0.010)
+
+        selector.report_error('db-a')
+        assert selector.select(['db-a', 'db-b']) == 'db-a'
+
+        selector.report_error('db-a')
+        assert selector.select(['db-a', 'db-b']) == 'db-b'
+
+        # cooldown is over - a single connection is let through
+        selector._health['db-a'].open_until = 0
+        assert selector.select(['db-a', 'db-b']) == 'db-a'
+        assert selector.select(['db-a', 'db-b']) == 'db-b'
+
+        selector.report_success('db-a', 0.001)
+        assert selector.select(['db-a', 'db-b']) == 'db-a'
+
+        # no healthy hosts
+        selector.report_error('db-a')
+        selector.report_error('db-a')
+        assert selector.select(['db-a']) == 'db-a'
+
+    def test_lag(self):
+        selector = HealthAwareHostSelector(strategy=HealthAwareHostSelector.LEAST_LATENCY, max_lag=10)
+        selector.report_success('db-a', 0.001)
+        selector.report_success('db-b', 0.010)
+
+        selector.report_lag('db-a', 120)
+        assert selector.select(['db-a', 'db-b']) == 'db-b'
+
+        selector.report_lag('db-a', None)  # replication is not running
+        assert selector.select(['db-a', 'db-b']) == 'db-b'
+
+        selector.report_lag('db-a', 0)
+        assert selector.select(['db-a', 'db-b']) == 'db-a'
+
+        # lag check is outdated
+        selector.report_lag('db-a', 120)
+        selector._health['db-a'].lag_checked_at -= selector.lag_ttl + 1
+        assert selector.select(['db-a', 'db-b']) == 'db-a'
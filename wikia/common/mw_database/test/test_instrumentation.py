@@ -0,0 +1,115 @@
+import logging
+import unittest
+
+from ..instrumentation import QueryStatsAggregator
+
+
+class PerfMonitoringMock(object):
+    def __init__(self):
+        self.metrics = {}
+        self.points = []
+
+    def set(self, name, value):
+        self.metrics[name] = value
+
+    def push(self):
+        self.points.append(dict(self.metrics))
+
+
+class LoggingHandlerMock(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class QueryStatsAggregatorTest(unittest.TestCase):
+    def test_normalize(self):
+        aggregator = QueryStatsAggregator(sink=lambda stats: None)
+        cases = [
+            ("SELECT * FROM page WHERE page_id = 2000", "SELECT * FROM page WHERE page_id = ?"),
+            ("SELECT * FROM page WHERE page_title = 'Kermit' AND page_namespace = %(page_namespace)s",
+             "SELECT * FROM page WHERE page_title = ? AND page_namespace = ?"),
+            ("SELECT *\n  FROM page WHERE page_id IN (1, 2, 3)", "SELECT * FROM page WHERE page_id IN (...)"),
+            ("INSERT INTO log(`a`, `b`) VALUES (%(r0_c0)s, %(r0_c1)s), (%(r1_c0)s, %(r1_c1)s);",
+             "INSERT INTO log(`a`, `b`) VALUES (?), ...;"),
+            ('SELECT * FROM page_2016 WHERE page_title = "Kermit"', "SELECT * FROM page_2016 WHERE page_title = ?"),
+        ]
+
+        for query, normalized in cases:
+            assert aggregator.normalize(query) == normalized
+
+    def test_stats(self):
+        flushed = []
+        aggregator = QueryStatsAggregator(sink=flushed.append, flush_interval=None, buckets=(0.01, 0.1, 1))
+
+        for elapsed in (0.005, 0.006, 0.05, 2):
+            aggregator.after_query(None, 'SELECT * FROM page WHERE page_id = 1', None, elapsed, 1)
+        aggregator.after_query(None, 'SELECT * FROM page WHERE page_id = 2', None, 0.5, None, RuntimeError())
+
+        stats, = aggregator.get_stats()
+        assert stats.query == 'SELECT * FROM page WHERE page_id = ?'
+        assert stats.count == 5
+        assert stats.errors == 1
+        assert stats.rows == 4
+        assert stats.histogram == [2, 1, 1, 1]
+        assert stats.max_time == 2
+        assert stats.percentile(50) == 0.1
+        assert stats.percentile(99) == 2
+
+        aggregator.flush()
+        assert flushed == [[stats]]
+        assert aggregator.get_stats() == []
+
+        aggregator.flush()  # nothing to flush
+        assert len(flushed) == 1
+
+    def test_periodic_flush(self):
+        flushed = []
+        aggregator = QueryStatsAggregator(sink=flushed.append, flush_interval=0)
+
+        aggregator.after_query(None, 'SELECT 1', None, 0.1, 1)
+        aggregator.after_query(None, 'SELECT 1', None, 0.1, 1)
+        assert [[stats.count for stats in batch] for batch in flushed] == [[1], [1]]
+
+    def test_max_queries(self):
+        aggregator = QueryStatsAggregator(sink=lambda stats: None, flush_interval=None, max_queries=2)
+
+        for table in ('page', 'revision', 'text', 'user'):
+            aggregator.after_query(None, 'SELECT * FROM {}'.format(table), None, 0.1, 1)
+
+        counts = dict((stats.query, stats.count) for stats in aggregator.get_stats())
+        assert counts == {'SELECT * FROM page': 1, 'SELECT * FROM revision': 1, '<other>': 2}
+
+    def test_perfmonitoring_sink(self):
+        perf_monitoring = PerfMonitoringMock()
+        aggregator = QueryStatsAggregator(sink=perf_monitoring, flush_interval=None)
+
+        aggregator.after_query(None, 'SELECT 1', None, 0.1, 1)
+        aggregator.after_query(None, 'SELECT * FROM page', None, 0.2, 5)
+        aggregator.flush()
+
+        assert [(point['query'], point['count'], point['rows']) for point in perf_monitoring.points] == [
+            ('SELECT * FROM page', 1, 5),
+            ('SELECT ?', 1, 1),
+        ]
+
+    def test_logger_sink(self):
+        handler = LoggingHandlerMock()
+        sink = logging.getLogger('query_stats_test')
+        sink.addHandler(handler)
+        sink.setLevel(logging.INFO)
+
+        aggregator = QueryStatsAggregator(sink=sink, flush_interval=None)
+        aggregator.after_query(None, 'SELECT 1', None, 0.1, 1)
+        aggregator.flush()
+
+        record, = handler.records
+        assert record.getMessage() == 'SQL stats SELECT ?'
+        assert record.count == 1
+        assert record.time_max == 0.1
+
+    def test_invalid_sink(self):
+        self.assertRaises(ValueError, QueryStatsAggregator, sink='stats.log')
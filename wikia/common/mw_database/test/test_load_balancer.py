@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+import unittest
+
+import MySQLdb
+
+from ..cache import TTLCache
+from ..dbconfig import ConnectionDetails
+from ..load_balancer import LoadBalancer
+from .test_dbconfig import RawConnectionMock, write_db_yml
+
+
+class LoadBalancerMapQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        RawConnectionMock.instances = []
+        self.load_balancer = LoadBalancer(write_db_yml(self.tmp_dir))
+        self.load_balancer._raw_connect = RawConnectionMock
+        self.load_balancer.db_config.connect_fn = RawConnectionMock
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_map_query(self):
+        dbnames = ['muppet', 'glee', 'starwars', 'broken', 'notexisting']
+        results = dict(self.load_balancer.map_query(dbnames, 'SELECT DATABASE(), @@hostname', workers=2))
+
+        assert sorted(results.keys()) == sorted(dbnames)
+        assert results['muppet'].rows == (('muppet', 'db-c1-master'),)
+        assert results['starwars'].rows == (('starwars', 'db-c1-master'),)
+        assert results['glee'].rows[0][0] == 'glee'
+        assert results['glee'].rows[0][1] in ('db-c2-slave-a', 'db-c2-slave-b')
+        assert isinstance(results['broken'], MySQLdb.OperationalError)
+        assert isinstance(results['notexisting'], RuntimeError)
+
+        # wikicities (clusters lookup) + a connection per cluster
+        assert len(RawConnectionMock.instances) == 3
+
+        # connections are back in the pool, switched to their original databases
+        c1_connection = RawConnectionMock.instances[1] if RawConnectionMock.instances[1].conn_details.cluster == 'c1' \
+            else RawConnectionMock.instances[2]
+        assert not c1_connection.closed
+        assert c1_connection.db == c1_connection.conn_details.dbname
+
+        with self.load_balancer.connect(c1_connection.conn_details.dbname) as conn:
+            assert conn.raw_connection is c1_connection
+
+    def test_map_query_small_cluster_cache(self):
+        # the batch does not fit in the cluster cache, clusters that were looked up are still used
+        self.load_balancer.db_config.cluster_cache = TTLCache(max_size=1)
+
+        dbnames = ['muppet', 'glee', 'starwars', 'notexisting']
+        results = dict(self.load_balancer.map_query(dbnames, 'SELECT DATABASE(), @@hostname', workers=2))
+
+        assert results['muppet'].rows[0][0] == 'muppet'
+        assert results['glee'].rows[0][0] == 'glee'
+        assert results['starwars'].rows[0][0] == 'starwars'
+        assert isinstance(results['notexisting'], RuntimeError)
+
+    def test_map_query_workers(self):
+        self.assertRaises(ValueError, self.load_balancer.map_query, ['muppet'], 'SELECT 1', workers=0)
+
+
+class LoadBalancerConnectTest(unittest.TestCase):
+    def test_raw_connect(self):
+        connect_calls = []
+        load_balancer = LoadBalancer.__new__(LoadBalancer)
+        conn_details = ConnectionDetails(hostname='db-c1-slave', username='reader', password='secret',
+                                         dbname='muppet', cluster='c1', master=False)
+
+        connect = MySQLdb.connect
+        MySQLdb.connect = lambda **kwargs: connect_calls.append(kwargs)
+        try:
+            load_balancer._raw_connect(conn_details)
+            load_balancer._raw_connect(conn_details._replace(dbname=None))
+        finally:
+            MySQLdb.connect = connect
+
+        assert connect_calls[0] == {'host': 'db-c1-slave', 'user': 'reader', 'passwd': 'secret', 'db': 'muppet'}
+        assert 'db' not in connect_calls[1]  # no database selected
@@ -0,0 +1,219 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ..connection import Connection
+from ..dbconfig import ConnectionDetails
+from ..load_balancer import LoadBalancer
+from ..pool import ConnectionPool
+
+
+DB_YML = """
+- sectionsByDB:
+    wikicities: central
+  serverTemplate:
+    user: reader
+    password: secret
+- central:
+  - db-central-master
+  - db-central-slave
+- {}
+"""
+
+
+class CursorMock(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.description = None
+
+    def execute(self, query, args=None):
+        self.conn.queries.append(query)
+
+    def fetchall(self):
+        return ()
+
+    def close(self):
+        pass
+
+
+class RawConnectionMock(object):
+    def __init__(self, conn_details):
+        self.conn_details = conn_details
+        self.db = conn_details.dbname
+        self.queries = []
+        self.alive = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def ping(self):
+        if not self.alive:
+            raise Exception('MySQL server has gone away')
+
+    def cursor(self):
+        return CursorMock(self)
+
+    def select_db(self, db):
+        if not self.alive:
+            raise Exception('MySQL server has gone away')
+        self.db = db
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def create_conn_details(hostname='db-central-slave', dbname='wikicities'):
+    return ConnectionDetails(hostname=hostname, username='reader', password='secret', dbname=dbname,
+                             cluster='central', master=False)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_reuse(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details(), max_size=1)
+
+        first = pool.acquire()
+        second = pool.acquire()
+        assert first is not second
+
+        pool.release(first)
+        pool.release(second)  # the pool is full
+        assert len(pool) == 1
+        assert first.rollbacks == 1
+        assert not first.closed
+        assert second.closed
+
+        assert pool.acquire() is first
+        assert len(pool) == 0
+
+    def test_health_check(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details())
+
+        raw_connection = pool.acquire()
+        pool.release(raw_connection)
+        raw_connection.alive = False
+
+        assert pool.acquire() is not raw_connection
+        assert raw_connection.closed
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details(), idle_timeout=60)
+
+        raw_connection = pool.acquire()
+        pool.release(raw_connection)
+        pool._idle[0] = (raw_connection, time.time() - 61)
+
+        assert pool.acquire() is not raw_connection
+        assert raw_connection.closed
+
+    def test_fork(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details())
+
+        raw_connection = pool.acquire()
+        pool.release(raw_connection)
+
+        # pretend the pool was filled by the parent process
+        pool._pid = os.getpid() + 1
+
+        assert pool.acquire() is not raw_connection
+        assert not raw_connection.closed  # the parent process still uses it
+        assert pool._inherited == [raw_connection]
+        assert len(pool) == 0
+        assert pool._pid == os.getpid()
+
+    def test_connection_close(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details())
+        raw_connection = pool.acquire()
+
+        with Connection(raw_connection, pool=pool) as conn:
+            assert conn.raw_connection is raw_connection
+
+        assert conn.raw_connection is None
+        assert len(pool) == 1
+
+        conn.close()  # no-op
+        assert len(pool) == 1
+
+        pool.close()
+        assert len(pool) == 0
+        assert raw_connection.closed
+
+
+    def test_session_reset(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details())
+
+        raw_connection = pool.acquire()
+        raw_connection.select_db('muppet')  # e.g. USE muppet
+        pool.release(raw_connection)
+
+        # the next user gets the connection with no transaction, table locks nor other database selected
+        assert pool.acquire() is raw_connection
+        assert raw_connection.rollbacks == 1
+        assert raw_connection.queries == ['UNLOCK TABLES']
+        assert raw_connection.db == 'wikicities'
+
+        raw_connection.alive = False
+        pool.release(raw_connection)  # can not be reset
+        assert raw_connection.closed
+        assert len(pool) == 0
+
+    def test_session_state_not_pooled(self):
+        pool = ConnectionPool(RawConnectionMock, create_conn_details())
+
+        for query in ("SELECT GET_LOCK('refresh-links', 10)", 'CREATE TEMPORARY TABLE tmp_pages (page_id INT)',
+                      'SET @counter = 0', "SET NAMES 'utf8mb4'", 'SELECT @rank := @rank + 1 FROM page'):
+            with Connection(pool.acquire(), pool=pool) as conn:
+                raw_connection = conn.raw_connection
+                conn.query(query)
+
+            assert raw_connection.closed, query
+            assert len(pool) == 0
+
+        with Connection(pool.acquire(), pool=pool) as conn:
+            raw_connection = conn.raw_connection
+            conn.query("UPDATE page SET page_title = 'Kermit' WHERE page_id = 1")
+
+        assert not raw_connection.closed
+        assert len(pool) == 1
+
+
+class LoadBalancerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_config_file = os.path.join(self.tmp_dir, 'DB.yml')
+
+        with open(self.db_config_file, 'w') as fp:
+            fp.write(DB_YML)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_connect(self):
+        load_balancer = LoadBalancer(self.db_config_file)
+        load_balancer._raw_connect = RawConnectionMock
+
+        with load_balancer.connect('wikicities', master=True) as conn:
+            raw_connection = conn.raw_connection
+            assert raw_connection.conn_details.hostname == 'db-central-master'
+
+        with load_balancer.connect('wikicities', master=True) as conn:
+            assert conn.raw_connection is raw_connection
+
+        with load_balancer.connect('wikicities', master=True, override_db_name='muppet') as conn:
+            assert conn.raw_connection is not raw_connection
+
+        load_balancer.close()
+        assert raw_connection.closed
+
+    def test_no_pooling(self):
+        load_balancer = LoadBalancer(self.db_config_file, pool_size=0)
+        load_balancer._raw_connect = RawConnectionMock
+
+        with load_balancer.connect('wikicities', master=True) as conn:
+            raw_connection = conn.raw_connection
+
+        assert raw_connection.closed
@@ -1,6 +1,6 @@
 import unittest
 
-from ..connection import SqlBuilderMixin
+from ..connection import QueryResult, SqlBuilderMixin
 from ..sqlliterals import SqlLiteral, SqlCondition
 
 
@@ -135,3 +135,81 @@ class SqlLiteralTest(unittest.TestCase):
             assert len(recorder.q_kwargs) == 1
             assert recorder.q_kwargs.keys()[0] == 'args'
             assert dict_eq(recorder.q_kwargs.values()[0], out_args)
+
+    def test_insert_many(self):
+        recorder = InsertManyRecorder()
+        rows = [{'id': i, 'name': 'row_{}'.format(i)} for i in range(5)]
+
+        assert recorder.insert_many('ab_config', rows, chunk_size=2, max_packet_size=4096) == 5
+        assert [len(args) for sql, args in recorder.queries] == [4, 4, 2]
+        assert recorder.commits == 3
+
+        sql, args = recorder.queries[0]
+        columns = ', '.join('`{}`'.format(column) for column in rows[0].keys())
+        assert sql == 'INSERT INTO ab_config({}) VALUES (%(r0_c0)s, %(r0_c1)s), (%(r1_c0)s, %(r1_c1)s);'.format(columns)
+        assert sorted(args.values()) == sorted([0, 1, 'row_0', 'row_1'])
+
+    def test_insert_many_upsert(self):
+        recorder = InsertManyRecorder()
+        rows = [{'id': 1, 'name': 'foo'}]
+
+        recorder.insert_many('ab_config', rows, ignore_errors=True, on_duplicate_update=['name'], max_packet_size=4096)
+        assert recorder.queries[0][0].startswith('INSERT IGNORE INTO ab_config(')
+        assert recorder.queries[0][0].endswith(' ON DUPLICATE KEY UPDATE `name` = VALUES(`name`);')
+
+        self.assertRaises(ValueError, recorder.insert_many, 'ab_config', [{'id': 1}, {'name': 'foo'}])
+
+    def test_insert_many_packet_size(self):
+        recorder = InsertManyRecorder()
+        rows = [{'text': 'x' * 1000} for _ in range(10)]
+
+        # max_allowed_packet is taken from the server
+        recorder.insert_many('ab_config', rows, chunk_size=100)
+        assert recorder.queries[0][0] == 'SELECT @@max_allowed_packet'
+        assert [len(args) for sql, args in recorder.queries[1:]] == [3, 3, 3, 1]
+
+    def test_sql_cache(self):
+        recorder = QueryBuilderRecorder()
+        recorder.sql_cache = {}
+
+        recorder.update('ab_config', {'text': 'asd'}, {'ab_id': 4})
+        recorder.update('ab_config', {'text': 'zxc'}, {'ab_id': 5})
+        assert len(recorder.sql_cache) == 1
+        assert recorder.q_args[0] == "UPDATE ab_config SET text = %(data_text)s WHERE ab_id = %(conds_ab_id)s;"
+        assert dict_eq(recorder.q_kwargs['args'], {'data_text': 'zxc', 'conds_ab_id': 5})
+
+        # SQL literals are a part of the statement shape
+        recorder.select('ab_config', '*', {'ab_id': create_sql_condition(312, 'ab_id > %d', [12])})
+        recorder.select('ab_config', '*', {'ab_id': create_sql_condition(312, 'ab_id > %d', [13])})
+        assert len(recorder.sql_cache) == 2
+        assert recorder.q_args[0] == "SELECT * FROM ab_config WHERE ab_id > %(lsqid_312__index_0)d;"
+        assert dict_eq(recorder.q_kwargs['args'], {'lsqid_312__index_0': 13})
+
+        recorder.select('ab_config', '*', {'ab_id': create_sql_condition(312, 'ab_id < %d', [13])})
+        assert recorder.q_args[0] == "SELECT * FROM ab_config WHERE ab_id < %(lsqid_312__index_0)d;"
+
+        recorder.delete('ab_config', None)
+        recorder.delete('ab_config', {})
+        assert recorder.q_args[0] == "DELETE FROM ab_config WHERE 1 = 1;"
+        assert len(recorder.sql_cache) == 4
+
+        recorder.insert('ab_config', {'text': 'asd'}, ignore_errors=True)
+        recorder.insert('ab_config', {'text': 'zxc'})
+        assert recorder.q_args[0] == "INSERT INTO ab_config(`text`) VALUES (%(text)s);"
+        assert dict_eq(recorder.q_kwargs['args'], {'text': 'zxc'})
+        assert len(recorder.sql_cache) == 6
+
+        self.assertRaises(ValueError, recorder.insert, 'ab_config', {'text': create_sql_condition(312, 'a = b')})
+
+
+class InsertManyRecorder(SqlBuilderMixin):
+    def __init__(self):
+        self.queries = []
+        self.commits = 0
+
+    def query(self, sql, args=None):
+        self.queries.append((sql, args))
+        return QueryResult(sql, (), {'args': args}, len(args or ()) // 2, None, [(8192,)])
+
+    def commit(self):
+        self.commits += 1
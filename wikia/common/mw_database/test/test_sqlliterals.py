@@ -36,3 +36,15 @@ class SqlLiteralTest(unittest.TestCase):
             literal = SqlLiteral(*input)
             assert literal.text == out_text
             assert tuple(literal.args.items()) == tuple(out_args.items())
+
+    def test_parsed_cache(self):
+        SqlLiteral.LITERAL_SEQ_ID = 312
+
+        first = SqlLiteral('fk_id IN (%s, %s)', ['a', 'b'])
+        second = SqlLiteral('fk_id IN (%s, %s)', ['c', 'd'])
+        assert first.text == second.text == 'fk_id IN (%(lsqid_312__index_0)s, %(lsqid_312__index_1)s)'
+        assert second.args == {'lsqid_312__index_0': 'c', 'lsqid_312__index_1': 'd'}
+
+        # arguments are checked for cached literals too
+        self.assertRaises(ValueError, SqlLiteral, 'fk_id IN (%s, %s)', ['a', 'b', 'c'])
+        self.assertRaises(IndexError, SqlLiteral, 'fk_id IN (%s, %s)', ['a'])